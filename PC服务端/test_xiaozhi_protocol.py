@@ -0,0 +1,85 @@
+# 会话恢复的测试：设备断线时放弃了说到一半的话，恢复会话后下一句话的录音只包含新的语音
+# 运行: cd PC服务端 && python -m pytest -q
+import json
+import wave
+
+from xiaozhi_protocol import FEATURE_RESUME, SessionConfig, SessionStore
+
+
+def hello(**extra):
+    payload = {'device_id': 'dev', 'session_id': 's1', 'features': [FEATURE_RESUME]}
+    payload.update(extra)
+    return json.dumps(payload).encode()
+
+
+def resume(store, payload):
+    """服务器处理重连握手的步骤(handle_control)"""
+    session = SessionConfig.from_hello(payload)
+    stream, resumed = store.attach(session.device_id, session.session_id)
+    if resumed and session.abandoned:
+        stream.abandon(*session.abandoned)
+    return stream, resumed
+
+
+def save_wav(path, data):
+    """与服务器的 save_inmp441_wav 相同"""
+    with wave.open(str(path), 'wb') as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(8000)
+        wav_file.writeframes(data)
+
+
+def read_wav(path):
+    with wave.open(str(path), 'rb') as wav_file:
+        return wav_file.readframes(wav_file.getnframes())
+
+
+def test_resume_after_mid_utterance_drop(tmp_path):
+    store = SessionStore()
+    stream, _ = resume(store, hello())
+    # 半句话：设备发出了 1~3，服务器只收到 1、2 就断线了
+    assert stream.receive(1, b'\x01\x00' * 4) is None
+    assert stream.receive(2, b'\x02\x00' * 4) is None
+
+    stream, resumed = resume(store, hello(abandoned=[1, 3]))
+    assert resumed
+    assert stream.last_seq == 3  # 设备不必重发放弃的帧
+
+    new = b'\x05\x00' * 4 + b'\x06\x00' * 4
+    assert stream.receive(4, new[:8]) is None
+    assert stream.receive(5, new[8:]) is None
+    utterance = stream.receive(6, b'')
+    save_wav(tmp_path / 'recording_1.wav', utterance)
+    assert read_wav(tmp_path / 'recording_1.wav') == new
+
+
+def test_resume_replays_previous_end_before_abandoned_frames(tmp_path):
+    store = SessionStore()
+    stream, _ = resume(store, hello())
+    # 上一句话的音频已收到，结束标记(3)和放弃的半句话(4、5)都没收到
+    previous = b'\x01\x00' * 8
+    stream.receive(1, previous[:8])
+    stream.receive(2, previous[8:])
+
+    stream, _ = resume(store, hello(abandoned=[4, 5]))
+    assert stream.last_seq == 2  # 结束标记还需要重发
+    # 设备按序重发 3~5，再发送下一句话
+    assert stream.receive(3, b'') == previous
+    assert stream.receive(4, b'\x07\x00' * 4) is None
+    assert stream.receive(5, b'\x07\x00' * 4) is None
+    new = b'\x09\x00' * 4
+    stream.receive(6, new)
+    save_wav(tmp_path / 'recording_1.wav', stream.receive(7, b''))
+    assert read_wav(tmp_path / 'recording_1.wav') == new
+
+
+def test_duplicate_frames_after_resume_are_dropped():
+    store = SessionStore()
+    stream, _ = resume(store, hello())
+    stream.receive(1, b'\x01\x00')
+    stream, resumed = resume(store, hello())
+    assert resumed
+    assert stream.receive(1, b'\x01\x00') is None  # 重发的重复帧
+    stream.receive(2, b'\x02\x00')
+    assert stream.receive(3, b'') == b'\x01\x00\x02\x00'
@@ -0,0 +1,70 @@
+# 设备运行指标的汇总与 HTTP 导出（Prometheus 文本格式），按设备 ID 区分
+#
+#   xiaozhi_device_<字段>       设备遥测帧上报的最新值(gauge)
+#   xiaozhi_playback_<字段>_total  每轮播放后设备上报的欠载/溢出/播放块数累计(counter)
+#   xiaozhi_device_last_seen_seconds  最后一次收到遥测的时间戳
+#
+# 浏览器或 Prometheus 访问 http://<服务器>:<端口>/metrics 即可查看。
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._gauges = {}  # {(名称, 设备ID): 值}
+        self._counters = {}
+        self._server = None
+
+    def set_gauges(self, device_id, values, prefix='xiaozhi_device_'):
+        """记录一组最新值，如一帧遥测"""
+        with self._lock:
+            for key, value in values.items():
+                self._gauges[(prefix + key, device_id)] = value
+            self._gauges[(prefix + 'last_seen_seconds', device_id)] = time.time()
+
+    def inc(self, device_id, name, value=1):
+        """累加一个计数"""
+        with self._lock:
+            key = (name, device_id)
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def render(self):
+        """导出为 Prometheus 文本格式"""
+        with self._lock:
+            items = [(name, 'gauge', device, value) for (name, device), value in self._gauges.items()]
+            items += [(name, 'counter', device, value) for (name, device), value in self._counters.items()]
+        lines = []
+        typed = set()
+        for name, kind, device, value in sorted(items):
+            if name not in typed:
+                lines.append(f"# TYPE {name} {kind}")
+                typed.add(name)
+            device = str(device).replace('\\', '\\\\').replace('"', '\\"')
+            lines.append(f'{name}{{device="{device}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port=9100, host="0.0.0.0"):
+        """在后台线程中启动 /metrics HTTP 服务"""
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):  # 不打印每次请求
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        print(f"指标地址：http://{host}:{port}/metrics")
+        return self._server
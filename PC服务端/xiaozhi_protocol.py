@@ -0,0 +1,372 @@
+# 小智 TCP 通信协议的公共定义（服务器端），与 esp32端/xiaozhi_protocol.py 保持一致
+#
+# 上行帧格式: <I 长度> + 数据，协商了 resume 后音频帧和结束标记为 <I 长度><I 序号> + 数据
+#   长度 == 0            : 一句话结束标记
+#   长度最高位为 0        : 音频帧，数据为 PCM
+#   长度最高位为 1        : 控制帧，低 31 位为数据长度，数据首字节为帧类型
+# 控制帧:
+#   FRAME_HELLO  设备连接后发送的握手信息(JSON)，服务器回复一行 JSON 确认
+#   FRAME_PLAYBACK_STATS  每轮播放结束后设备上报 <III 欠载次数, 溢出次数, 播放块数>
+#   FRAME_BARGE_IN   设备播放中检测到用户说话(打断)，服务器停止发送本轮回复
+#   FRAME_KEEPALIVE  设备空闲时的保活帧
+#   FRAME_LOG        设备最近的日志(UTF-8 文本，每行一条)
+#   FRAME_TELEMETRY  设备定期上报的运行状态，按 TELEMETRY_FORMAT 打包，字段见 TELEMETRY_FIELDS
+#
+# 下行(服务器 -> 设备):
+#   旧客户端    : 原始 PCM，以 "END_OF_STREAM\n" 结束
+#   framed_downlink: 与上行相同的 <I 长度> 分帧，长度 0 表示本轮回复结束
+#   FRAME_TILE   协商了 tiles 后，服务器排版并光栅化好的一行文字位图，
+#                数据为 TILE_HEADER <BHH 格式, 宽, 高> + 位图，设备贴到屏幕上（需 framed_downlink）
+#
+# 会话恢复(resume): 设备握手时带上本次开机的 session_id，断线重连后服务器回复 resumed 和已收到的
+# 最大序号 last_seq，设备重发之后的帧；没有发送完成的回复(pending_reply)由服务器重发。
+# 设备在断线期间放弃了说到一半的话时，握手带上 abandoned: [首帧序号, 末帧序号]，
+# 服务器丢弃这些帧（已收到的部分从会话缓冲区中清除），下一句话不会接在半句话后面。
+#
+# 服务器一次只处理一个连接。WiFi 闪断后旧连接成为半开连接，服务器会一直阻塞在 recv 上，
+# 接受不了设备的重连；因此每个连接都开启 TCP 保活，协商了 resume 的设备还设置接收超时
+# （这类设备空闲时定期发送遥测/保活帧），超时后按断开处理，回到 accept 接受重连。
+import json
+import select
+import socket
+import struct
+import time
+import weakref
+
+CTRL_FLAG = 0x80000000
+LEN_MASK = 0x7FFFFFFF
+
+FRAME_HELLO = b'H'
+FRAME_PLAYBACK_STATS = b'P'
+FRAME_BARGE_IN = b'B'
+FRAME_KEEPALIVE = b'K'
+FRAME_LOG = b'L'
+FRAME_TELEMETRY = b'T'
+FRAME_TILE = b'D'
+
+TILE_HEADER = '<BHH'
+TILE_MONO = 0  # MONO_HLSB
+TILE_RGB565 = 1  # RGB565，每像素 2 字节小端序
+
+# 遥测字段: 运行时长(s), GC 堆剩余, 最大空闲块, RSSI(dBm), 循环平均/最大耗时(us),
+# 超时帧数, 最长 GC(ms), 播放欠载, 播放溢出, 重连次数
+TELEMETRY_FORMAT = '<IIIhIIHHHHH'
+TELEMETRY_FIELDS = ('uptime_s', 'mem_free', 'largest_free', 'rssi', 'loop_avg_us', 'loop_max_us',
+                    'late_frames', 'gc_max_ms', 'underruns', 'overruns', 'reconnects')
+
+PROTOCOL_VERSION = 1
+
+# 连接空闲多久开始 TCP 保活探测(s)
+KEEPALIVE_IDLE_S = 10
+# 协商了 resume 的设备的接收超时(s)：设备空闲时每 60s 上报遥测(异步客户端每 15s 发送保活帧)，
+# 再留出播放一段回复的时间
+RESUME_RECV_TIMEOUT_S = 180
+
+# 可选功能
+FEATURE_FRAMED_DOWNLINK = 'framed_downlink'
+FEATURE_RESUME = 'resume'
+FEATURE_TILES = 'tiles'
+
+# 协商了分帧下行的连接
+_framed_conns = weakref.WeakSet()
+
+
+def recv_exact(conn, size):
+    """从连接中读满 size 字节，对端关闭或接收超时时抛出 ConnectionError"""
+    data = b''
+    while len(data) < size:
+        try:
+            packet = conn.recv(size - len(data))
+        except (socket.timeout, TimeoutError) as e:
+            raise ConnectionError(f"接收超时，连接可能已断开: {e}")
+        if not packet:
+            raise ConnectionError("客户端已断开连接")
+        data += packet
+    return data
+
+
+def enable_keepalive(conn, idle_s=KEEPALIVE_IDLE_S, interval_s=5, count=3):
+    """
+    开启 TCP 保活：连接空闲 idle_s 秒后开始探测，连续 count 次无响应时 recv 报错
+
+    各平台的选项名不同，不支持的选项跳过
+    """
+    conn.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    if hasattr(socket, 'TCP_KEEPIDLE'):  # Linux
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, idle_s)
+    elif hasattr(socket, 'TCP_KEEPALIVE'):  # macOS
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPALIVE, idle_s)
+    if hasattr(socket, 'TCP_KEEPINTVL'):
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, interval_s)
+    if hasattr(socket, 'TCP_KEEPCNT'):
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, count)
+    if hasattr(socket, 'SIO_KEEPALIVE_VALS'):  # Windows
+        conn.ioctl(socket.SIO_KEEPALIVE_VALS, (1, idle_s * 1000, interval_s * 1000))
+
+
+def pack_control(frame_type, payload=b''):
+    """打包一个控制帧"""
+    return struct.pack('<I', CTRL_FLAG | (len(payload) + 1)) + frame_type + payload
+
+
+def unpack_playback_stats(payload):
+    """解析播放统计控制帧"""
+    underruns, overruns, chunks = struct.unpack('<III', payload)
+    return {'underruns': underruns, 'overruns': overruns, 'chunks': chunks}
+
+
+def unpack_telemetry(payload):
+    """解析遥测控制帧"""
+    return dict(zip(TELEMETRY_FIELDS, struct.unpack(TELEMETRY_FORMAT, payload)))
+
+
+def unpack_log(payload):
+    """解析日志控制帧，返回日志行列表"""
+    return payload.decode('utf-8', errors='replace').splitlines()
+
+
+def send_tile(conn, fmt, width, height, bitmap):
+    """发送一块文字位图（仅限协商了 tiles 的分帧下行连接）"""
+    conn.sendall(pack_control(FRAME_TILE, struct.pack(TILE_HEADER, fmt, width, height) + bitmap))
+
+
+def set_framed_downlink(conn, enabled):
+    """设置该连接的下行是否分帧"""
+    if enabled:
+        _framed_conns.add(conn)
+    else:
+        _framed_conns.discard(conn)
+
+
+def send_audio_chunk(conn, chunk):
+    """发送一块下行音频"""
+    if conn in _framed_conns:
+        conn.sendall(struct.pack('<I', len(chunk)) + chunk)
+    else:
+        conn.sendall(chunk)
+
+
+def end_of_stream(conn):
+    """结束本轮回复，客户端停止等待播放数据"""
+    if conn in _framed_conns:
+        conn.sendall(struct.pack('<I', 0))
+    else:
+        conn.sendall("END_OF_STREAM\n".encode())
+
+
+def barge_in_pending(conn):
+    """
+    设备是否已发来打断帧（只窥探不读取，帧由接收循环正常处理）
+
+    全双工设备只在播放中检测到说话时才会在下行期间发送数据，
+    且打断帧总在新一句话的音频之前。
+    """
+    readable, _, _ = select.select([conn], [], [], 0)
+    if not readable:
+        return False
+    try:
+        head = conn.recv(5, socket.MSG_PEEK)
+    except OSError:
+        return False
+    if len(head) < 5:
+        return False
+    length = struct.unpack('<I', head[:4])[0]
+    return bool(length & CTRL_FLAG) and head[4:5] == FRAME_BARGE_IN
+
+
+def send_json_line(conn, obj):
+    """以一行 JSON 的形式发送给客户端"""
+    conn.sendall((json.dumps(obj, ensure_ascii=False) + "\n").encode())
+
+
+class SessionConfig:
+    """
+    一次连接协商出的音频参数
+
+    未发送握手的旧客户端使用默认值(8kHz/16bit/单声道 PCM)，
+    与 esp32端 的录音、播放参数一致。
+    """
+    SUPPORTED_CODECS = ('pcm_s16le',)
+    SUPPORTED_BITS = (16,)
+    SUPPORTED_FEATURES = frozenset({FEATURE_FRAMED_DOWNLINK, FEATURE_RESUME, FEATURE_TILES})  # 服务器支持的可选功能
+    SUPPORTED_TILE_FORMATS = {'RGB565': TILE_RGB565, 'MONO_HLSB': TILE_MONO}
+    MAX_PREROLL_MS = 1000  # 设备语音开始前预录时长的上限
+
+    def __init__(self):
+        self.device_id = "legacy"
+        self.capture_rate = 8000  # 设备录音采样率，即 ASR 输入采样率
+        self.playback_rate = 8000  # 设备播放采样率，即 TTS 输出采样率
+        self.bits = 16
+        self.channels = 1
+        self.codec = 'pcm_s16le'
+        self.capture_frame_bytes = 2048  # 设备每个上行音频帧的字节数
+        self.playback_chunk_bytes = 1024  # 下行音频每次发送的字节数
+        self.preroll_ms = 0  # 设备在语音开始帧之前补发的预录时长
+        self.session_id = None  # 设备本次开机的会话 ID，断线重连时用于恢复会话
+        self.abandoned = None  # 设备断线时放弃的半句话的序号范围 (首帧, 末帧)
+        self.display = None  # 协商了 tiles 时设备的屏幕信息: 宽, 高, 行高, 位图格式, 文字颜色
+        self.features = set()
+
+    @classmethod
+    def from_hello(cls, payload):
+        """
+        根据设备的握手信息协商会话参数
+
+        :param payload: 握手帧的 JSON 数据(bytes)
+        :return: SessionConfig
+        """
+        hello = json.loads(payload.decode('utf-8'))
+        cfg = cls()
+        cfg.device_id = str(hello.get('device_id', cfg.device_id))
+        cfg.capture_rate = int(hello.get('capture_rate', cfg.capture_rate))
+        cfg.playback_rate = int(hello.get('playback_rate', cfg.playback_rate))
+        bits = int(hello.get('bits', cfg.bits))
+        if bits not in cls.SUPPORTED_BITS:
+            raise ValueError(f"不支持的位深: {bits}")
+        cfg.bits = bits
+        cfg.channels = int(hello.get('channels', cfg.channels))
+        # 选择双方都支持的第一个编码
+        for codec in hello.get('codecs', [cfg.codec]):
+            if codec in cls.SUPPORTED_CODECS:
+                cfg.codec = codec
+                break
+        else:
+            raise ValueError(f"没有可用的音频编码: {hello.get('codecs')}")
+        cfg.capture_frame_bytes = int(hello.get('capture_frame_bytes', cfg.capture_frame_bytes))
+        # 下行块不超过设备的接收缓冲区，且按采样对齐
+        sample_bytes = cfg.bits // 8 * cfg.channels
+        recv_bytes = int(hello.get('playback_buffer_bytes', cfg.playback_chunk_bytes))
+        cfg.playback_chunk_bytes = max(sample_bytes, recv_bytes - recv_bytes % sample_bytes)
+        cfg.preroll_ms = max(0, min(int(hello.get('preroll_ms', 0)), cls.MAX_PREROLL_MS))
+        cfg.features = set(hello.get('features', [])) & cls.SUPPORTED_FEATURES
+        if hello.get('session_id'):
+            cfg.session_id = str(hello['session_id'])
+        else:
+            cfg.features.discard(FEATURE_RESUME)
+        abandoned = hello.get('abandoned')
+        if abandoned:
+            first, last = int(abandoned[0]), int(abandoned[1])
+            if 0 < first <= last:
+                cfg.abandoned = (first, last)
+        cfg.display = cls._parse_display(hello.get('display'))
+        if cfg.display is None or FEATURE_FRAMED_DOWNLINK not in cfg.features:
+            cfg.features.discard(FEATURE_TILES)
+        return cfg
+
+    @classmethod
+    def _parse_display(cls, display):
+        """解析握手中的屏幕信息，缺少或格式不支持时返回 None"""
+        if not isinstance(display, dict):
+            return None
+        fmt = cls.SUPPORTED_TILE_FORMATS.get(display.get('format', 'RGB565'))
+        if fmt is None:
+            return None
+        return {
+            'width': int(display['width']),
+            'height': int(display['height']),
+            'line_height': int(display.get('line_height', 16)),
+            'format': fmt,
+            'color': int(display.get('color', 0xFFFF)),
+            'bg_color': int(display.get('bg_color', 0)),
+        }
+
+    def ack(self):
+        """返回给设备的握手确认"""
+        return {
+            'type': 'hello_ack',
+            'version': PROTOCOL_VERSION,
+            'capture_rate': self.capture_rate,
+            'playback_rate': self.playback_rate,
+            'bits': self.bits,
+            'channels': self.channels,
+            'codec': self.codec,
+            'playback_chunk_bytes': self.playback_chunk_bytes,
+            'preroll_ms': self.preroll_ms,
+            'features': sorted(self.features),
+        }
+
+    def __str__(self):
+        return (f"设备 {self.device_id}: 录音 {self.capture_rate}Hz, 播放 {self.playback_rate}Hz, "
+                f"{self.bits}bit, {self.codec}, 下行块 {self.playback_chunk_bytes} 字节, 预录 {self.preroll_ms}ms")
+
+
+class StreamState:
+    """一个设备会话的上行进度，断线重连后据此恢复"""
+
+    def __init__(self, key):
+        self.key = key
+        self.audio = bytearray()  # 当前这句话已收到的音频
+        self.last_seq = 0  # 已收到的最大序号
+        self.pending_reply = None  # 没有发送完成的回复音频文件
+        self.skip = (0, -1)  # 设备放弃的半句话的序号范围，这些帧不计入音频
+        self.touched = time.monotonic()
+
+    def touch(self):
+        self.touched = time.monotonic()
+
+    def abandon(self, first, last):
+        """
+        设备断线时放弃了序号 first~last 的半句话，不会再为它发送结束标记
+
+        已收到的部分清除；之前的帧都已收到时，其余部分也视为已收到，设备不必重发
+        """
+        if self.last_seq >= first:  # 半句话已收到一部分，之前的句子都已完整
+            self.audio.clear()
+        if self.last_seq >= first - 1:
+            self.last_seq = max(self.last_seq, last)
+        self.skip = (first, last)
+
+    def receive(self, seq, data):
+        """
+        处理一个带序号的上行帧，重发的重复帧和放弃的帧丢弃
+
+        :param data: 音频数据，空为一句话结束标记
+        :return: 收到结束标记时返回这句话的音频(bytes)，否则返回 None
+        """
+        self.touch()
+        if seq <= self.last_seq:
+            return None
+        if seq != self.last_seq + 1:
+            print(f"⚠️ 上行丢失 {seq - self.last_seq - 1} 帧")
+        self.last_seq = seq
+        if self.skip[0] <= seq <= self.skip[1]:
+            return None
+        if data:
+            self.audio += data
+            return None
+        utterance = bytes(self.audio)
+        self.audio.clear()
+        return utterance
+
+
+class SessionStore:
+    """
+    按 (设备 ID, 会话 ID) 保存会话进度
+
+    设备断开后保留 ttl 秒，期间用同一会话 ID 重连即可恢复；设备重启后会话 ID 改变，从头开始。
+    """
+
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self._states = {}
+
+    def attach(self, device_id, session_id):
+        """
+        连接握手时取得会话进度
+
+        :return: (StreamState, 是否为恢复的会话)
+        """
+        self.expire()
+        key = (device_id, session_id)
+        state = self._states.get(key)
+        resumed = state is not None
+        if not resumed:
+            state = self._states[key] = StreamState(key)
+        state.touch()
+        return state, resumed
+
+    def expire(self):
+        """清除超时未恢复的会话"""
+        now = time.monotonic()
+        for key in [k for k, st in self._states.items() if now - st.touched > self.ttl]:
+            del self._states[key]
@@ -0,0 +1,186 @@
+# 服务器端文字排版与光栅化
+#
+# 协商了 tiles 的设备不再自己查字库、逐字渲染：服务器用与设备相同的 .bmf 点阵字体
+# 按设备屏幕宽度排版，每行渲染成一块 RGB565/MONO 位图，以控制帧发给设备，设备只需贴图。
+# 排版规则移植自 esp32端/textlayout.py，贴图模式与文字模式的换行位置相同：
+# ASCII 半宽，其余字符全宽；。，、等不出现在行首，（「等不出现在行尾；连续的英文字母、数字在空格处换行，
+# 单个词比一行还宽时按字断开。修改时两边保持一致。
+import os
+import struct
+
+from xiaozhi_protocol import TILE_MONO, TILE_RGB565
+
+# ASCII 字符的断行类别，与 esp32端/textlayout.py 相同
+_WORD = 1  # 英文字母、数字和符号，相邻的不断开
+_SPACE = 2  # 空格，可在其后断行，溢出或位于行首时丢弃
+_NO_START = 4  # 不出现在行首
+_NO_END = 8  # 不出现在行尾
+
+_ASCII_NO_START = ',.;:?!)]}%>'
+_ASCII_NO_END = '([{<$'
+# 全角标点
+_CJK_NO_START = frozenset(ord(c) for c in '，。、；：？！）」』》〉】〕”’…—～·％')
+_CJK_NO_END = frozenset(ord(c) for c in '（「『《〈【〔“‘￥')
+
+
+def _char_class(code):
+    """字符的断行类别"""
+    if code < 128:
+        cls = _WORD if 32 < code < 127 else 0
+        if code == 32:
+            cls = _SPACE
+        if chr(code) in _ASCII_NO_START:
+            cls |= _NO_START
+        if chr(code) in _ASCII_NO_END:
+            cls |= _NO_END
+        return cls
+    if code in _CJK_NO_START:
+        return _NO_START
+    if code in _CJK_NO_END:
+        return _NO_END
+    return 0
+
+# 默认使用设备端的字体文件
+DEFAULT_FONT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'esp32端',
+                            'text_lite_16px_2312.v3.bmf')
+
+
+class BMFontRaster:
+    """读取 .bmf(v3) 点阵字体并渲染文字"""
+
+    def __init__(self, font_file=DEFAULT_FONT):
+        with open(font_file, 'rb') as f:
+            data = f.read()
+        if data[0:2] != b'BM' or data[2] != 3:
+            raise ValueError(f"字体文件格式不正确: {font_file}")
+        start_bitmap = struct.unpack('>I', b'\x00' + data[4:7])[0]
+        self.font_size = data[7]
+        self.bitmap_size = data[8]
+        count = (start_bitmap - 16) // 2
+        codes = struct.unpack(f'>{count}H', data[16:16 + count * 2])
+        self._index = {code: i for i, code in enumerate(codes)}
+        self._bitmaps = data[start_bitmap:]
+        self._row_bytes = (self.font_size + 7) // 8
+
+    def glyph(self, char):
+        """字符的 MONO_HLSB 点阵，字体中没有时返回 None"""
+        i = self._index.get(ord(char))
+        if i is None:
+            return None
+        return self._bitmaps[i * self.bitmap_size:(i + 1) * self.bitmap_size]
+
+    def char_width(self, char, half_char=True):
+        """字符的前进宽度，控制字符为 0（不显示）"""
+        code = ord(char)
+        if code < 32:
+            return 0
+        return self.font_size // 2 if half_char and code < 128 else self.font_size
+
+    def layout(self, text, width, half_char=True):
+        """
+        按屏幕宽度排版，与设备端 TextLayout.layout 的换行位置相同
+
+        :return: 行的列表，每行为 [(字符, x), ...]，空行不返回
+        """
+        lines = []
+        line = []
+        x = 0
+        brk = 0  # 行内最后一个断行位置：可在 line[brk] 之前断开，0 表示没有
+        brk_x = 0
+        prev = 0  # 前一个字的类别
+        wrapped = False  # 当前行由自动换行产生，行首的空格丢弃
+        for char in text:
+            code = ord(char)
+            if code == 10:  # '\n'
+                lines.append(line)
+                line = []
+                x = 0
+                brk = 0
+                prev = 0
+                wrapped = False
+                continue
+            w = self.char_width(char, half_char)
+            if not w:
+                continue
+            cls = _char_class(code)
+            if cls & _SPACE and wrapped and not line:
+                continue
+            # 本字之前能否断行
+            if (line and not cls & (_NO_START | _SPACE) and not prev & _NO_END
+                    and not (prev & _WORD and cls & _WORD)):
+                brk = len(line)
+                brk_x = x
+            if x + w > width and x:
+                if cls & _SPACE:  # 溢出的空格丢弃
+                    lines.append(line)
+                    line = []
+                    x = 0
+                    brk = 0
+                    prev = 0
+                    wrapped = True
+                    continue
+                if brk:  # 在最后的断行位置断开，其后的字移到下一行
+                    carry = line[brk:]
+                    lines.append(line[:brk])
+                    line = [(c, cx - brk_x) for c, cx in carry]
+                    x -= brk_x
+                    if x + w > width and x:  # 移下来的词仍然放不下，按字断开
+                        lines.append(line)
+                        line = []
+                        x = 0
+                else:
+                    lines.append(line)
+                    line = []
+                    x = 0
+                brk = 0
+                wrapped = True
+            line.append((char, x))
+            x += w
+            prev = cls
+        lines.append(line)
+        return [line for line in lines if line]
+
+    def render_line(self, line, width, height, fmt=TILE_RGB565, color=0xFFFF, bg_color=0):
+        """
+        把一行文字渲染成位图
+
+        :param line: layout() 返回的一行
+        :param fmt: TILE_RGB565 或 TILE_MONO
+        :return: 位图数据(bytes)
+        """
+        size = self.font_size
+        on = [[False] * width for _ in range(height)]
+        for char, x0 in line:
+            bitmap = self.glyph(char)
+            if bitmap is None:
+                continue
+            for row in range(min(size, height)):
+                base = row * self._row_bytes
+                for col in range(size):
+                    x = x0 + col
+                    if x < width and bitmap[base + (col >> 3)] >> (7 - (col & 7)) & 1:
+                        on[row][x] = True
+        if fmt == TILE_MONO:
+            stride = (width + 7) // 8
+            out = bytearray(stride * height)
+            for y in range(height):
+                for x in range(width):
+                    if on[y][x]:
+                        out[y * stride + (x >> 3)] |= 0x80 >> (x & 7)
+            return bytes(out)
+        fg = struct.pack('<H', color)
+        bg = struct.pack('<H', bg_color)
+        return b''.join(fg if pixel else bg for row in on for pixel in row)
+
+    def render_text(self, text, width, line_height, fmt=TILE_RGB565, color=0xFFFF, bg_color=0, max_lines=None):
+        """
+        排版并渲染一段文字，每行一块
+
+        :param max_lines: 最多渲染最后几行，None 为全部
+        :return: [(格式, 宽, 高, 位图), ...]
+        """
+        lines = self.layout(text, width)
+        if max_lines:
+            lines = lines[-max_lines:]
+        return [(fmt, width, line_height, self.render_line(line, width, line_height, fmt, color, bg_color))
+                for line in lines]
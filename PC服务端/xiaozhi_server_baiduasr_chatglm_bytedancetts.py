@@ -2,6 +2,17 @@
 import subprocess
 import socket, os, time,re,wave,struct
 import soundfile as sf  # 添加音频读取库
+import numpy as np
+from xiaozhi_protocol import (CTRL_FLAG, LEN_MASK, FRAME_HELLO, FRAME_PLAYBACK_STATS, FRAME_BARGE_IN,
+                              FRAME_KEEPALIVE, FRAME_LOG, FRAME_TELEMETRY, FEATURE_FRAMED_DOWNLINK, FEATURE_RESUME,
+                              FEATURE_TILES, send_tile,
+                              SessionConfig, SessionStore, recv_exact, send_json_line, enable_keepalive,
+                              RESUME_RECV_TIMEOUT_S,
+                              send_audio_chunk, end_of_stream, set_framed_downlink, unpack_playback_stats,
+                              unpack_log, unpack_telemetry, barge_in_pending)
+from xiaozhi_metrics import MetricsRegistry
+from xiaozhi_raster import BMFontRaster, DEFAULT_FONT
+from xiaozhi_wakeword import WakeWordGate
 import edge_tts
 from openai import OpenAI
 from funasr import AutoModel
@@ -17,6 +28,8 @@ from zhipuai import ZhipuAI
 import uuid
 #替换自己火山引擎（豆包）文字转语音的账号信息appid，access_token,cluster
 class ByteDanceTTS:
+    SUPPORTED_RATES = (8000, 16000, 24000)
+
     def __init__(self, appid="xxx", access_token="xxx", cluster="xxx", voice_type="zh_female_wanwanxiaohe_moon_bigtts", rate="8000"):
         self.appid = appid
         self.access_token = access_token
@@ -68,7 +81,7 @@ class ByteDanceTTS:
         except Exception as e:
             print(f"⚠️ TTS生成失败: {str(e)}")
             time.sleep(0.03)# 结束客户端等待服务器返回播放数据
-            client_socket.sendall("END_OF_STREAM\n".encode())
+            end_of_stream(client_socket)
 #替换自己baiduASR的api-key,secret-key
 class BaiduTextToSpeech:
     def __init__(self, api_key="xxx", secret_key="xxx"):
@@ -145,7 +158,7 @@ class BaiduTextToSpeech:
         except requests.exceptions.RequestException as e:
             print(f"⚠️ TTS生成失败: {str(e)}")
             time.sleep(0.03)# 结束客户端等待服务器返回播放数据
-            client_socket.sendall("END_OF_STREAM\n".encode())
+            end_of_stream(client_socket)
 #替换自己的chatGLM的api-key
 class ZhipuAIClient:
     def __init__(self, api_key="xxx"):
@@ -175,7 +188,7 @@ class ZhipuAIClient:
             print(f"⚠️ API错误：{str(e)}")
             # TTS生成失败，结束客户端等待服务器返回播放数据
             time.sleep(0.03)
-            client_socket.sendall("END_OF_STREAM\n".encode())
+            end_of_stream(client_socket)
 #替换自己的baidustt的api-key，secret-key        
 class SpeechRecognizer:
     """百度语音识别API封装类"""
@@ -191,6 +204,7 @@ class SpeechRecognizer:
         self.token_url = "https://aip.baidubce.com/oauth/2.0/token"
         self.recognize_url = "https://vop.baidubce.com/server_api"
         self.access_token = None
+        self.rate = 8000  # 与设备录音采样率一致，握手后按会话参数更新，仅支持 8000/16000
 
     def _get_access_token(self):
         """获取百度语音API的访问令牌"""
@@ -261,7 +275,7 @@ class SpeechRecognizer:
             # 构造请求参数
             payload = json.dumps({
                 "format": "wav",
-                "rate": 8000,
+                "rate": self.rate,
                 "channel": 1,
                 "cuid": "5NNHy4FsIbdFu1qOU8T6c559oHh4bbp3",
                 "speech": speech_base64,
@@ -281,37 +295,77 @@ class SpeechRecognizer:
         except Exception as e:
             print(f"⚠️ API错误：{str(e)}")
             time.sleep(0.03)# 结束客户端等待服务器返回播放数据
-            client_socket.sendall("END_OF_STREAM\n".encode())
+            end_of_stream(client_socket)
 
 
 # FunASR语音识别，语音转文字
 class INMP441ToWAV:
     def __init__(self):
-        self.SAMPLE_RATE = 16000
+        self.SAMPLE_RATE = 8000  # 与设备录音采样率一致，握手后按会话参数更新
         self.BITS = 16
         self.CHANNELS = 1
         self.BUFFER_SIZE = 4096
+        self.PREROLL_BYTES = 0  # 设备在语音开始帧之前补发的预录字节数
+        self.TRIM_WINDOW_MS = 20  # 裁剪预录静音时的能量分析窗口
+        self.TRIM_MARGIN_MS = 100  # 语音之前保留的静音
+        self.stream = None  # 协商了 resume 时的会话进度(StreamState)，上行帧带序号
+
+    def configure(self, session):
+        """按协商的会话参数设置录音文件格式"""
+        self.SAMPLE_RATE = session.capture_rate
+        self.BITS = session.bits
+        self.CHANNELS = session.channels
+        self.PREROLL_BYTES = session.preroll_ms * session.capture_rate // 1000 * (session.bits // 8) * session.channels
+        self.stream = None
+
+    def trim_preroll(self, data):
+        """
+        裁掉预录部分中语音之前的静音
 
-
-    def receive_inmp441_data(self, conn):
-        audio_data = b''  # 用于累积音频数据的缓冲区
+        预录帧都在设备 VAD 判定的语音开始之前，之后全是有效语音，所以只在预录范围内裁剪，
+        以预录中最安静窗口的能量为噪声参考，保留语音前 TRIM_MARGIN_MS 的静音。
+        """
+        if not self.PREROLL_BYTES or self.BITS != 16 or self.CHANNELS != 1:
+            return data
+        window = self.SAMPLE_RATE * self.TRIM_WINDOW_MS // 1000
+        preroll = np.frombuffer(data[:self.PREROLL_BYTES], dtype='<i2')
+        windows = len(preroll) // window
+        if windows < 2:
+            return data
+        frames = preroll[:windows * window].astype(np.float64).reshape(windows, window)
+        rms = np.sqrt((frames ** 2).mean(axis=1))
+        voiced = np.nonzero(rms > max(rms.min() * 2, 1.0))[0]
+        start = voiced[0] if len(voiced) else windows
+        start = max(0, start - self.TRIM_MARGIN_MS // self.TRIM_WINDOW_MS)
+        return data[start * window * 2:]
+
+    def receive_inmp441_data(self, conn, on_control=None):
+        audio_data = bytearray()  # 用于累积音频数据的缓冲区（协商了 resume 时使用会话中的缓冲区）
         while True:
             # 读取包头
-            header = conn.recv(4)
-            if not header:
-                break
+            header = recv_exact(conn, 4)
             data_len = struct.unpack('<I', header)[0]
+            # 控制帧交给服务器处理，不计入音频（握手帧可能改变 self.stream）
+            if data_len & CTRL_FLAG:
+                payload = recv_exact(conn, data_len & LEN_MASK)
+                if on_control:
+                    on_control(conn, payload[:1], payload[1:])
+                continue
+            stream = self.stream
+            if stream is not None:
+                # 帧头后是序号；重连后设备重发的帧中已收到的、设备放弃的半句话丢弃
+                seq = struct.unpack('<I', recv_exact(conn, 4))[0]
+                utterance = stream.receive(seq, recv_exact(conn, data_len))
+                if utterance:
+                    self.save_inmp441_wav(self.trim_preroll(utterance))
+                    return "recording_1.wav"
+                continue
             # 读取数据体
-            data = b''
-            while len(data) < data_len:
-                packet = conn.recv(data_len - len(data))
-                if not packet:
-                    break
-                data += packet
+            data = recv_exact(conn, data_len)
             if data_len == 0:  # 结束标记
                 if audio_data:
-                    self.save_inmp441_wav(audio_data)
-                    audio_data = b''  # 清空缓冲区
+                    self.save_inmp441_wav(self.trim_preroll(bytes(audio_data)))
+                    audio_data.clear()  # 清空缓冲区
                     return "recording_1.wav"
             else:
                 audio_data += data  # 累积音频数据
@@ -360,7 +414,7 @@ class FunasrSpeechToText:
         except Exception as e:
             print(f"⚠️ API错误：{str(e)}")
             time.sleep(0.03)# 结束客户端等待服务器返回播放数据
-            client_socket.sendall("END_OF_STREAM\n".encode())
+            end_of_stream(client_socket)
 
 # deepseek 的回复，替换自己的api-key
 class DeepSeekReply:
@@ -405,7 +459,7 @@ class DeepSeekReply:
             print(f"⚠️ API错误：{str(e)}")
             # TTS生成失败，结束客户端等待服务器返回播放数据
             time.sleep(0.03)
-            client_socket.sendall("END_OF_STREAM\n".encode())
+            end_of_stream(client_socket)
 
 # EdgeTTS文字生成语音
 class EdgeTTSTextToSpeech:
@@ -432,7 +486,7 @@ class EdgeTTSTextToSpeech:
         except Exception as e:
             print(f"⚠️ TTS生成失败: {str(e)}")
             time.sleep(0.03)# 结束客户端等待服务器返回播放数据
-            client_socket.sendall("END_OF_STREAM\n".encode())
+            end_of_stream(client_socket)
 
 # FFmpeg 音频转换器
 class FFmpegToWav:
@@ -466,7 +520,7 @@ class FFmpegToWav:
         except FileNotFoundError:
             print("错误: 未找到 FFmpeg，请确保已正确安装并添加到系统 PATH")
             time.sleep(0.03)# 结束客户端等待服务器返回播放数据
-            client_socket.sendall("END_OF_STREAM\n".encode())
+            end_of_stream(client_socket)
 
 # MAX98357播放声音
 class MAX98357AudioPlay:
@@ -477,19 +531,28 @@ class MAX98357AudioPlay:
         with open(wav_file_path, "rb") as audio_file:
             audio_file.seek(44)# 跳过前44字节的WAV文件头信息
             while True:
-                chunk = audio_file.read(1024)
+                chunk = audio_file.read(self.chunk)
                 if not chunk:
                     break
-                client_socket.sendall(chunk)
+                if barge_in_pending(client_socket):# 用户打断，剩余音频不再发送
+                    print("设备打断，停止发送回复音频")
+                    break
+                send_audio_chunk(client_socket, chunk)
         time.sleep(0.1)
-        client_socket.sendall("END_OF_STREAM\n".encode())
+        end_of_stream(client_socket)
         print("回复音频已发送")
 
 # 小智AI服务器 主循环
 class XiaoZhi_Ai_TCPServer:
-    def __init__(self, host="0.0.0.0", port=8888, save_path="audio/received_audio.wav"):
+    def __init__(self, host="0.0.0.0", port=8888, save_path="audio/received_audio.wav", metrics_port=9100,
+                 wake_word=False, tile_font=DEFAULT_FONT):
         self.host = host
         self.port = port
+        self.metrics_port = metrics_port  # 设备指标的 HTTP 端口，None 时不启动
+        self.metrics = MetricsRegistry()
+        self.tile_font = tile_font  # 为协商了 tiles 的设备光栅化文字所用的字体，与设备端字体相同
+        self.raster = None  # 第一次需要时才加载字体
+        self.wake = WakeWordGate(enabled=wake_word)  # 开启后只回复呼叫了“小智”的语音（回复后的追问窗口内除外）
         self.received_audio_filename = save_path
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
@@ -499,13 +562,114 @@ class XiaoZhi_Ai_TCPServer:
         self.dsr = ZhipuAIClient()# chatGLM 的回复
         #self.etts = EdgeTTSTextToSpeech()# EdgeTTS 文字生成语音
         self.mapl = MAX98357AudioPlay()# MAX98357 播放音频
-        #self.fftw = FFmpegToWav(sample_rate=8000, channels=1, bit_depth=16)# # FFmpeg 音频转换器24100, 44100,32000
+        self.fftw = FFmpegToWav(sample_rate=8000, channels=1, bit_depth=16)# # FFmpeg 音频转换器，仅在TTS不支持设备采样率时使用
         #self.audioprocess = BaiduTextToSpeech() #baidu audio send to esp32
         self.audioprocess =ByteDanceTTS()
         self.inmp441tw = INMP441ToWAV()
+        self.session = SessionConfig()
+        self.sessions = SessionStore()  # 断线后可恢复的会话进度
+        self.playback_stats = {'underruns': 0, 'overruns': 0, 'chunks': 0}# 设备上报的播放统计（按会话累计）
+        self.tts_resample = False
+
+    def configure_session(self, session):
+        """按协商结果配置整条流水线：ASR 输入、TTS 输出、重采样、下行分块"""
+        self.session = session
+        self.playback_stats = {'underruns': 0, 'overruns': 0, 'chunks': 0}
+        self.inmp441tw.configure(session)# ASR 输入采样率 = 设备录音采样率
+        self.fstt.rate = session.capture_rate
+        if session.capture_rate not in (8000, 16000):
+            print(f"⚠️ 百度ASR仅支持 8000/16000Hz，当前录音采样率 {session.capture_rate}Hz")
+        # TTS 直接输出设备播放采样率；不支持时以 24000Hz 生成，再由 FFmpeg 重采样一次
+        if session.playback_rate in ByteDanceTTS.SUPPORTED_RATES:
+            self.audioprocess.rate = str(session.playback_rate)
+            self.tts_resample = False
+        else:
+            self.audioprocess.rate = "24000"
+            self.tts_resample = True
+        self.fftw.sample_rate = session.playback_rate
+        self.fftw.channels = session.channels
+        self.fftw.bit_depth = session.bits
+        self.mapl.chunk = session.playback_chunk_bytes
+        print(f"会话参数---：{session}")
+
+    def handle_control(self, conn, frame_type, payload):
+        """处理设备发来的控制帧"""
+        if frame_type == FRAME_HELLO:
+            try:
+                session = SessionConfig.from_hello(payload)
+            except ValueError as e:
+                print(f"握手失败: {e}")
+                send_json_line(conn, {'type': 'hello_error', 'error': str(e)})
+                return
+            self.configure_session(session)
+            ack = session.ack()
+            stream = None
+            if FEATURE_RESUME in session.features:
+                stream, resumed = self.sessions.attach(session.device_id, session.session_id)
+                if resumed and session.abandoned:  # 设备放弃了断线时说到一半的话
+                    stream.abandon(*session.abandoned)
+                # 设备空闲时也会定期发送遥测，超时没有数据说明是半开连接，断开后才能接受设备的重连
+                conn.settimeout(RESUME_RECV_TIMEOUT_S)
+                self.inmp441tw.stream = stream
+                ack.update(resumed=resumed, last_seq=stream.last_seq, pending_reply=stream.pending_reply is not None)
+                if resumed:
+                    print(f"设备 {session.device_id} 恢复会话，已收到序号 {stream.last_seq}")
+            send_json_line(conn, ack)
+            set_framed_downlink(conn, FEATURE_FRAMED_DOWNLINK in session.features)
+            # 断线前没有发送完成的回复，重新发送
+            if stream is not None and stream.pending_reply is not None:
+                self.send_reply(conn, stream.pending_reply)
+        elif frame_type == FRAME_PLAYBACK_STATS:
+            stats = unpack_playback_stats(payload)
+            for key, value in stats.items():
+                self.playback_stats[key] += value
+                self.metrics.inc(self.session.device_id, f"xiaozhi_playback_{key}_total", value)
+            if stats['underruns'] or stats['overruns']:
+                print(f"⚠️ 设备 {self.session.device_id} 播放欠载 {stats['underruns']} 次，溢出 {stats['overruns']} 次"
+                      f"（本会话累计 {self.playback_stats}）")
+        elif frame_type == FRAME_BARGE_IN:
+            print(f"设备 {self.session.device_id} 打断了回复")
+        elif frame_type == FRAME_KEEPALIVE:
+            pass
+        elif frame_type == FRAME_TELEMETRY:
+            telemetry = unpack_telemetry(payload)
+            self.metrics.set_gauges(self.session.device_id, telemetry)
+            if telemetry['late_frames']:
+                print(f"⚠️ 设备 {self.session.device_id} 录音循环超时 {telemetry['late_frames']} 次，"
+                      f"最长 {telemetry['loop_max_us'] // 1000}ms，RSSI {telemetry['rssi']}dBm")
+        elif frame_type == FRAME_LOG:
+            for line in unpack_log(payload):
+                print(f"[设备 {self.session.device_id}] {line}")
+        else:
+            print(f"未知的控制帧: {frame_type}")
+
+    def send_text_tiles(self, conn, text):
+        """协商了 tiles 时在服务器排版、光栅化回复文字，设备只需把每行位图贴到屏幕上"""
+        display = self.session.display
+        if FEATURE_TILES not in self.session.features or not text:
+            return
+        if self.raster is None:
+            self.raster = BMFontRaster(self.tile_font)
+        tiles = self.raster.render_text(text, display['width'], display['line_height'], display['format'],
+                                        display['color'], display['bg_color'],
+                                        max_lines=display['height'] // display['line_height'])
+        for tile in tiles:
+            send_tile(conn, *tile)
+
+    def send_reply(self, conn, path):
+        """发送回复音频，发送完成前断线时记入会话，设备恢复会话后重发"""
+        stream = self.inmp441tw.stream
+        if stream is not None:
+            stream.pending_reply = path
+        self.mapl.send_wav_file(conn, path)
+        if stream is not None:
+            stream.pending_reply = None
+
     def start(self):
         self.socket.bind((self.host, self.port))
         self.socket.listen(1)
+        if self.metrics_port:
+            self.metrics.serve(self.metrics_port)
         local_ip = socket.gethostbyname(socket.gethostname())
         print("\n=== 小智AI对话机器人服务器_V1.1 已启动 ===")
         print(f"IP端口为：{local_ip}:{self.port}")
@@ -514,23 +678,38 @@ class XiaoZhi_Ai_TCPServer:
             while True:  # 外层循环接受新连接
                 conn, addr = self.socket.accept()
                 print(f"接收到来自 {addr} 的持久连接")
+                enable_keepalive(conn)  # WiFi 闪断留下的半开连接由保活探测发现，避免一直阻塞在 recv
+                # 未握手的旧客户端使用默认参数
+                self.configure_session(SessionConfig())
                 try:
                     while True:
                         try:
                             # 接收INMP441 麦克风数据
-                            inmp441wav_path = self.inmp441tw.receive_inmp441_data(conn)
+                            inmp441wav_path = self.inmp441tw.receive_inmp441_data(conn, self.handle_control)
 
                             # FunASR语音识别，语音转文字
                             fstt_text = self.fstt.recognize(conn, inmp441wav_path)
                             print("FunASR 语音识别---：", fstt_text)
 
+                            # 唤醒词门控：不是对小智说的话直接结束本轮，不调用 LLM/TTS
+                            if fstt_text.strip() and not self.wake.allow(self.session.device_id, fstt_text):
+                                self.metrics.inc(self.session.device_id, 'xiaozhi_wakeword_skipped_total')
+                                print(f"未呼叫小智，跳过本轮（累计节省 {self.wake.skipped} 次 LLM 调用）")
+                                end_of_stream(conn)
+                                continue
+
                             # DeepSeek 生成回复
                             if fstt_text.strip():
                                 gdr_text = self.dsr.generate_slogan(conn, fstt_text)
                                 print("DeepSeek 的回复---：", gdr_text)
+                                self.send_text_tiles(conn, gdr_text)
 
                                 # Baidu ASR 文字转语音 语音转发
                                 self.audioprocess.generate_tts(conn, gdr_text)
+                                reply_path = 'output.wav'
+                                if self.tts_resample:
+                                    self.fftw.convert_to_wav(conn, reply_path, 'output_resampled.wav')
+                                    reply_path = 'output_resampled.wav'
 
                                 # EdgeTTS 文字生成语音
                                 # tts_path = self.etts.generate_audio(conn, gdr_text)
@@ -541,11 +720,12 @@ class XiaoZhi_Ai_TCPServer:
                                 # self.fftw.convert_to_wav(conn, tts_path, 'output.wav')
 
                                 # # MAX98357 播放音频'audio/textlen44-43380.wav'
-                                self.mapl.send_wav_file(conn, 'output.wav')  # gada
+                                self.send_reply(conn, reply_path)  # gada
+                                self.wake.replied(self.session.device_id)
                             else:
                                 print('FunASR语音识别为空，继续讲话....')
                                 time.sleep(0.03)
-                                conn.sendall("END_OF_STREAM\n".encode())
+                                end_of_stream(conn)
 
 
 
@@ -556,6 +736,8 @@ class XiaoZhi_Ai_TCPServer:
                             print(f"处理错误: {e}")
                             continue  # 继续等待下一个请求
                 finally:
+                    if self.inmp441tw.stream is not None:  # 从断开时开始计算会话保留时间
+                        self.inmp441tw.stream.touch()
                     conn.close()  # 🔴 关键修改 3: 手动关闭连接
                     print(f"连接 {addr} 已关闭")
         except KeyboardInterrupt:
@@ -0,0 +1,61 @@
+# 唤醒词门控：ASR 之后判断这句话是不是在跟小智说话
+#
+# 设备的 VAD 只看能量，电视声、旁人聊天都会触发一整轮 ASR -> LLM -> TTS。
+# 开启门控后，识别文本里没有唤醒词的语音直接结束本轮，不调用 LLM/TTS；
+# 小智回复后的 follow_up_s 秒内可以不带唤醒词继续对话。
+import re
+import time
+
+# ASR 常把“小智”识别成同音字
+DEFAULT_WAKE_WORDS = ('小智', '小志', '小知', '小芝', '晓智', '小致')
+
+_PUNCT = re.compile(r"[\s，。！？、,.!?~～…:：;；\"'“”‘’]+")
+
+
+class WakeWordGate:
+    def __init__(self, enabled=True, wake_words=DEFAULT_WAKE_WORDS, follow_up_s=30):
+        """
+        :param enabled: 是否开启门控，关闭时所有语音都放行
+        :param wake_words: 唤醒词（含常见的同音误识别）
+        :param follow_up_s: 回复之后免唤醒词的时长(秒)
+        """
+        self.enabled = enabled
+        self.wake_words = tuple(wake_words)
+        self.follow_up_s = follow_up_s
+        self._replied = {}  # {设备ID: 最后一次回复的时间}
+        self.passed = 0
+        self.skipped = 0  # 被跳过的轮次，即节省的 LLM/TTS 调用次数
+
+    def addressed(self, text):
+        """文本中是否包含唤醒词"""
+        text = _PUNCT.sub('', text)
+        return any(word in text for word in self.wake_words)
+
+    def in_follow_up(self, device_id):
+        """是否处于回复之后的免唤醒窗口"""
+        replied = self._replied.get(device_id)
+        return replied is not None and time.monotonic() - replied <= self.follow_up_s
+
+    def allow(self, device_id, text):
+        """
+        这句话是否需要回复
+
+        :param device_id: 设备ID
+        :param text: ASR 识别结果
+        :return: True 时继续 LLM/TTS，False 时跳过本轮
+        """
+        if not self.enabled or self.addressed(text) or self.in_follow_up(device_id):
+            self.passed += 1
+            return True
+        self.skipped += 1
+        return False
+
+    def replied(self, device_id):
+        """回复发送完成后调用，开始免唤醒窗口"""
+        self._replied[device_id] = time.monotonic()
+
+    def stats(self):
+        """门控统计"""
+        total = self.passed + self.skipped
+        return {'passed': self.passed, 'skipped': self.skipped,
+                'skip_rate': self.skipped / total if total else 0.0}
@@ -1,11 +1,14 @@
 import time
-from machine import SoftI2C, Pin
+from machine import I2C, Pin
 import ssd1306
 import ufont
+from textlayout import get_layout
 
 class OLEDScroller:
-    def __init__(self, scl_pin=6, sda_pin=5, width=128, height=64, font_file="unifont-14-12917-16.v3.bmf"):
-        self.i2c = SoftI2C(scl=Pin(scl_pin), sda=Pin(sda_pin))
+    def __init__(self, scl_pin=6, sda_pin=5, width=128, height=64, font_file="unifont-14-12917-16.v3.bmf",
+                 i2c_freq=1000000):
+        # 硬件 I2C，显示异常时把 i2c_freq 降到 400000
+        self.i2c = I2C(0, scl=Pin(scl_pin), sda=Pin(sda_pin), freq=i2c_freq)
         self.oled_width = width
         self.oled_height = height
         self.display = ssd1306.SSD1306_I2C(width, height, self.i2c)
@@ -13,51 +16,20 @@ class OLEDScroller:
         self.font_size = 16  # 字体大小
         self.line_height = 16  # 行高
         self.max_lines = self.oled_height // self.line_height  # 每屏最大行数
+        self.layout = get_layout(self.font_size)  # 排版器，按中文禁则换行
 
     def clear(self):
         """清屏"""
         self.display.fill(0)
         self.display.show()
 
-    def is_chinese_char(self, char):
-        """
-        判断字符是否是中文字符
-        :param char: 单个字符
-        :return: True 是中文字符，False 不是
-        """
-        unicode_val = ord(char)
-        # 判断是否在常用汉字范围内
-        if 0x4E00 <= unicode_val <= 0x9FFF:
-            return True
-        # 判断是否在扩展汉字范围内（可选）
-        if 0x3400 <= unicode_val <= 0x4DBF or 0x20000 <= unicode_val <= 0x2A6DF:
-            return True
-        return False
-
-    def is_english_char(self, char):
-        """
-        判断字符是否是英文字符
-        :param char: 单个字符
-        :return: True 是英文字符，False 不是
-        """
-        unicode_val = ord(char)
-        # 判断是否在 ASCII 范围内
-        if 0x0000 <= unicode_val <= 0x007F:
-            return True
-        return False
-
     def get_char_width(self, char):
         """
-        获取字符的宽度（假设中文字符宽度为 16，英文字符宽度为 8）
+        获取字符的宽度（ASCII 为半宽，其余字符为全宽）
         :param char: 单个字符
         :return: 字符宽度
         """
-        if self.is_chinese_char(char):
-            return 16  # 中文字符宽度
-        elif self.is_english_char(char):
-            return 8   # 英文字符宽度
-        else:
-            return 8   # 默认宽度
+        return self.layout.char_width(char)
 
     def display_text_with_scroll(self, text, char_delay=0.1, line_delay=0.5, scroll_delay=0.02, fast_scroll_delay=0.01):
         """
@@ -70,16 +42,13 @@ class OLEDScroller:
         """
         lines = []  # 当前屏的行
         current_line = ""  # 当前行内容
-        x, y = 0, 0  # 当前字符的坐标
+        y = 0  # 当前行的 y 坐标
 
-        words = text.split(' ')  # 按空格分割文本为单词
-        for word in words:
-            # 计算单词宽度
-            word_width = sum(self.get_char_width(char) for char in word)
-            if x + word_width > self.oled_width:  # 换行
+        # 按字排版（中文没有空格，不能按单词换行），每行的字和 x 坐标一次算好
+        for i, (line, _) in enumerate(self.layout.layout(text, self.oled_width)):
+            if i:  # 换行
                 lines.append(current_line)
                 current_line = ""
-                x = 0
                 y += self.line_height
 
                 if y >= self.oled_height:  # 满屏后向上滚动
@@ -87,31 +56,12 @@ class OLEDScroller:
                     y -= self.line_height
                     lines.pop(0)  # 移除最上面一行
 
-            # 绘制当前单词
-            for char in word:
-                char_width = self.get_char_width(char)
-                if x + char_width > self.oled_width:  # 换行
-                    lines.append(current_line)
-                    current_line = ""
-                    x = 0
-                    y += self.line_height
-
-                    if y >= self.oled_height:  # 满屏后向上滚动
-                        self._scroll_up(lines, scroll_delay)
-                        y -= self.line_height
-                        lines.pop(0)  # 移除最上面一行
-
+            for char, x in line:
                 self.font.text(self.display, char, x, y, show=False)
                 self.display.show()
                 current_line += char
-                x += char_width
                 time.sleep(char_delay)
 
-            # 添加空格（单词间）
-            if x + self.get_char_width(' ') <= self.oled_width:
-                current_line += ' '
-                x += self.get_char_width(' ')
-
         # 显示剩余内容
         if current_line:
             lines.append(current_line)
@@ -1,27 +1,42 @@
 import time
 from machine import SPI, Pin
 import st7735_buf
+import st7735_band
 from easydisplay import EasyDisplay
+from render import RenderScheduler
+from linestore import LineStore
+from textlayout import get_layout
 
 class ScreenManager:
     def __init__(self, width=160, height=80, line_height=16, 
                  spi_num=1, baudrate=20000000, sck_pin=5, mosi_pin=4,
                  cs_pin=6, dc_pin=3, res_pin=2, bl_pin=1, rotate=3,
-                 font="text_lite_16px_2312.v3.bmf", color=0xFFFF):
+                 font="text_lite_16px_2312.v3.bmf", color=0xFFFF, fps=20, wait=True,
+                 history_lines=16, band_rows=0):
+        # fps: 最高刷新率；wait 为 False 时 add_text 等方法立即返回，由调用方循环调用 update()
+        # history_lines: 保存的行数（不少于一屏），用于重绘，内存在创建时固定
+        # band_rows: 大于 0 时使用低内存驱动 st7735_band，只分配这么多行的帧缓冲区，滚动改为重绘
         # 初始化 SPI
         self.spi = SPI(spi_num, baudrate=baudrate, polarity=0, phase=0, 
                        sck=Pin(sck_pin), mosi=Pin(mosi_pin))
         
         # 初始化 ST7735 显示驱动
-        self.dp = st7735_buf.ST7735(width=width, height=height, spi=self.spi, 
-                                    cs=Pin(cs_pin), dc=Pin(dc_pin), res=Pin(res_pin), 
-                                    rotate=rotate, bl=Pin(bl_pin), 
-                                    invert=False, rgb=False)
+        if band_rows:
+            self.dp = st7735_band.ST7735Band(width=width, height=height, spi=self.spi, 
+                                             cs=Pin(cs_pin), dc=Pin(dc_pin), res=Pin(res_pin), 
+                                             rotate=rotate, bl=Pin(bl_pin), 
+                                             invert=False, rgb=False, band_rows=band_rows)
+        else:
+            self.dp = st7735_buf.ST7735(width=width, height=height, spi=self.spi, 
+                                        cs=Pin(cs_pin), dc=Pin(dc_pin), res=Pin(res_pin), 
+                                        rotate=rotate, bl=Pin(bl_pin), 
+                                        invert=False, rgb=False)
         
         # 初始化 EasyDisplay
         self.ed = EasyDisplay(self.dp, "RGB565", 
                               font=font, 
-                              show=True, color=color, clear=False)
+                              show=True, color=color, clear=False,
+                              preload_index=True)  # 码位表小于 8KB 的字体常驻内存
         
         # 显示参数
         self.width = width
@@ -30,30 +45,16 @@ class ScreenManager:
         self.max_lines = height // line_height
         self.current_x = 0  # 当前光标X坐标
         self.current_y = 0  # 当前光标Y坐标
-        self.lines = []  # 存储每行文本内容
+        self.lines = LineStore(max(history_lines, self.max_lines), width // 8)  # 每行文本内容，最新一行即光标所在的行
+        self.lines.new_line()
+        self.layout = get_layout(self.ed.font_size)  # 排版器，宽度表按字号共用
         self.color = color
-
-    @staticmethod
-    def is_chinese_char(char):
-        """判断字符是否为中文字符"""
-        unicode_val = ord(char)
-        return (0x4E00 <= unicode_val <= 0x9FFF or 
-                0x3400 <= unicode_val <= 0x4DBF or 
-                0x20000 <= unicode_val <= 0x2A6DF)
-
-    @staticmethod
-    def is_english_char(char):
-        """判断字符是否为英文字符"""
-        unicode_val = ord(char)
-        return 0x0000 <= unicode_val <= 0x007F
+        self.wait = wait
+        self.render = RenderScheduler(self.ed.show, fps)  # 绘制排队，按时间推进打字机效果，按帧率合并刷新
 
     def get_char_width(self, char):
-        """获取字符宽度（中文16像素，英文8像素）"""
-        if self.is_chinese_char(char):
-            return 16
-        elif self.is_english_char(char):
-            return 8
-        return 8  # 默认宽度
+        """获取字符宽度（ASCII 半宽，其余字符全宽）"""
+        return self.layout.char_width(char)
 
     def add_text(self, text, char_delay=0.01, line_delay=0):
         """
@@ -64,89 +65,78 @@ class ScreenManager:
             char_delay: 字符显示间隔时间(秒)，设为0禁用延迟
             line_delay: 行显示间隔时间(秒)，设为0禁用延迟
         """
-        line_buffer = []  # 当前行缓冲区
-        line_width = self.current_x  # 从当前光标位置开始
+        char_ms = int(char_delay * 1000)
+        line_ms = int(line_delay * 1000)
         
-        for char in text:
-            if char == '\n':  # 换行符
-                self._flush_line_buffer(line_buffer, line_width)
-                self._new_line()
-                line_buffer = []
-                line_width = 0
-                if line_delay > 0:
-                    time.sleep(line_delay)
-                continue
-                
-            char_width = self.get_char_width(char)
-            
-            # 检查是否需要换行
-            if line_width + char_width > self.width:
-                self._flush_line_buffer(line_buffer, line_width)
+        # 一遍排版，第一行从当前光标位置开始，之后每行另起一行
+        for i, (line_buffer, line_width) in enumerate(self.layout.layout(text, self.width, self.current_x)):
+            if i:
                 self._new_line()
-                line_buffer = []
-                line_width = 0
-                if line_delay > 0:
-                    time.sleep(line_delay)
-            
-            # 添加到行缓冲区
-            line_buffer.append((char, line_width))
-            line_width += char_width
-            
-            # 显示当前字符（如果启用延迟）
-            if char_delay > 0:
-                self.ed.text(char, line_width - char_width, self.current_y, self.color)
-                self.ed.show()
-                time.sleep(char_delay)
-        
-        # 刷新剩余内容
-        if line_buffer:
-            self._flush_line_buffer(line_buffer, line_width)
+                if line_ms > 0:  # 行间停顿
+                    self.render.add(line_ms, self.render.request)
+            self._flush_line_buffer(line_buffer, line_width, char_ms)
+        self._sync()
 
-    def _flush_line_buffer(self, line_buffer, line_width):
-        """将行缓冲区内容显示到屏幕并更新光标位置"""
+    def _flush_line_buffer(self, line_buffer, line_width, char_ms=0):
+        """将行缓冲区内容排入渲染队列并更新光标位置"""
         if not line_buffer:
             return
             
         # 检查是否需要滚动
         if self.current_y >= self.height:
-            self._scroll_up()
+            self.render.add(0, self._scroll_up)
             self.current_y = self.height - self.line_height
         
-        # 显示整行内容
+        # 逐字排队，每个字间隔 char_ms 毫秒显示
         for char, x in line_buffer:
-            self.ed.text(char, x, self.current_y, self.color)
-            self.lines.append((char, x, self.current_y))
+            self.render.add(char_ms, self._draw_char, char, x, self.current_y, self.color)
         
-        self.ed.show()
         # 更新光标X坐标到行末
         self.current_x = line_width
 
+    def _draw_char(self, char, x, y, color):
+        """渲染队列中的绘制操作：画一个字（不刷新屏幕）"""
+        self.ed.text(char, x, y, color, show=False)
+        self.lines.append(char, x, color)
+
     def _new_line(self):
         """处理换行"""
         self.current_x = 0
         self.current_y += self.line_height
+        self.render.add(0, self.lines.new_line)
         # 检查是否需要滚动
         if self.current_y >= self.height:
-            self._scroll_up()
+            self.render.add(0, self._scroll_up)
             self.current_y = self.height - self.line_height
 
     def _scroll_up(self):
         """向上滚动一行"""
-        if hasattr(self.dp, 'scroll'):
+        if hasattr(self.dp, 'scroll') and not getattr(self.dp, 'partial_frame', False):
             self.dp.scroll(0, -self.line_height)
             self.ed.fill_rect(0, self.height - self.line_height, 
                              self.width, self.line_height, 0)
         else:
+            # 按行存储重绘最新的一屏
             self.ed.fill(0)
-            new_lines = []
-            for char, x, y in self.lines:
-                new_y = y - self.line_height
-                if new_y >= 0:
-                    self.ed.text(char, x, new_y, self.color)
-                    new_lines.append((char, x, new_y))
-            self.lines = new_lines
-        self.ed.show()
+            rows = min(self.max_lines, self.lines.count)
+            for row in range(rows):
+                for char, x, color in self.lines.chars(rows - 1 - row):
+                    self.ed.text(char, x, row * self.line_height, color, show=False)
+
+    def _sync(self):
+        """wait 为 True 时等到队列执行完，否则只推进到期的操作"""
+        if self.wait:
+            self.render.wait()
+        else:
+            self.render.update()
+
+    def update(self):
+        """推进打字机效果并按帧率刷新，不阻塞；返回是否还有未显示完的内容"""
+        return self.render.update()
 
+    def flush(self):
+        """立即显示所有排队中的内容"""
+        self.render.flush()
 
     def display_image(self, file, x, y, key=None, show=True, clear=False, invert=False, color=None, bg_color=None):
         """
@@ -163,15 +153,21 @@ class ScreenManager:
             color: 主体颜色
             bg_color: 背景颜色
         """
-        self.ed.pbm(file, x, y, key=key, show=show, clear=clear, invert=invert, color=color, bg_color=bg_color)
+        self.render.add(0, lambda: self.ed.pbm(file, x, y, key=key, show=False, clear=clear, invert=invert,
+                                               color=color, bg_color=bg_color))
+        if show:
+            self._sync()
 
     def clear(self):
         """清空屏幕"""
-        self.ed.clear()
-        self.lines = []
         self.current_x = 0
         self.current_y = 0
-        self.ed.show()
+        self.render.add(0, self._clear_screen)
+        self._sync()
+
+    def _clear_screen(self):
+        self.ed.clear()
+        self.lines.clear()
 
     def display_text(self, text, char_delay=0.005, line_delay=0.01, clear=True):
         """
@@ -194,6 +190,7 @@ class ScreenManager:
     def set_font(self, font_path):
         """设置字体"""
         self.ed.load_font(font_path)
+        self.layout = get_layout(self.ed.font_size)
 
 # 示例用法
 if __name__ == "__main__":
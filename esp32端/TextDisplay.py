@@ -1,13 +1,18 @@
 import time
 from machine import SPI, Pin
 import st7735_buf
+import st7735_band
 from easydisplay import EasyDisplay
+from render import RenderScheduler
+from linestore import LineStore
+from textlayout import get_layout
 
 class TextDisplay:
     def __init__(self, width=160, height=80, line_height=16, 
                  spi_num=1, baudrate=20000000, sck_pin=5, mosi_pin=4,
                  cs_pin=6, dc_pin=3, res_pin=2, bl_pin=1, rotate=3,
-                 font="text_lite_16px_2312.v3.bmf", color=0xFFFF):
+                 font="text_lite_16px_2312.v3.bmf", color=0xFFFF, fps=20, wait=True, hw_scroll=True,
+                 history_lines=16, band_rows=0):
         """
         初始化文本显示器
         
@@ -26,17 +31,32 @@ class TextDisplay:
             rotate: 屏幕旋转方向
             font: 字体文件路径
             color: 文本颜色(RGB565格式)
+            fps: 最高刷新率，同一帧内的绘制合并为一次刷新
+            wait: add_text 等方法是否等到文字显示完再返回；为 False 时立即返回，
+                  由调用方循环调用 update() 推进打字机效果和刷新
+            hw_scroll: 竖屏(rotate 0/4)时使用 ST7735 的硬件垂直滚动，帧缓冲区作为循环行缓冲区，
+                       滚动一行只写一个寄存器并刷新新的一行；其他方向退回整屏滚动
+            history_lines: 保存的行数（不少于一屏），用于重绘和 view_history 回看，内存在创建时固定
+            band_rows: 大于 0 时使用低内存驱动 st7735_band，只分配这么多行的帧缓冲区（取行高即可），
+                       横屏滚动改为按行存储重绘；为 0 时使用整屏帧缓冲区
         """
         # 初始化显示屏
         self.spi = SPI(spi_num, baudrate=baudrate, polarity=0, phase=0, 
                       sck=Pin(sck_pin), mosi=Pin(mosi_pin))
-        self.dp = st7735_buf.ST7735(width=width, height=height, spi=self.spi, 
-                                   cs=Pin(cs_pin), dc=Pin(dc_pin), res=Pin(res_pin), 
-                                   rotate=rotate, bl=Pin(bl_pin), 
-                                   invert=False, rgb=False)
+        if band_rows:
+            self.dp = st7735_band.ST7735Band(width=width, height=height, spi=self.spi, 
+                                             cs=Pin(cs_pin), dc=Pin(dc_pin), res=Pin(res_pin), 
+                                             rotate=rotate, bl=Pin(bl_pin), 
+                                             invert=False, rgb=False, band_rows=band_rows)
+        else:
+            self.dp = st7735_buf.ST7735(width=width, height=height, spi=self.spi, 
+                                       cs=Pin(cs_pin), dc=Pin(dc_pin), res=Pin(res_pin), 
+                                       rotate=rotate, bl=Pin(bl_pin), 
+                                       invert=False, rgb=False)
         self.ed = EasyDisplay(self.dp, "RGB565", 
                              font=font, 
-                             show=True, color=color, clear=False)
+                             show=True, color=color, clear=False,
+                             preload_index=True)  # 码位表小于 8KB 的字体常驻内存
         
         # 显示参数设置
         self.width = width
@@ -45,151 +65,199 @@ class TextDisplay:
         self.max_lines = height // line_height
         self.current_x = 0
         self.current_y = 0
-        self.lines = []  # 存储每行文本内容
+        # 每行文本内容：最新一行即光标所在的行
+        self.lines = LineStore(max(history_lines, self.max_lines), width // 8)
+        self.lines.new_line()
+        self.layout = get_layout(self.ed.font_size)  # 排版器，宽度表按字号共用
+        self._view_back = 0  # 回看历史时，屏幕最下面一行是第几新的行
         self.color = color
+        self.wait = wait
+        self.render = RenderScheduler(self.ed.show, fps)
+        # 硬件滚动：屏幕第 0 行对应帧缓冲区的第 _top 行，逻辑坐标 y 画在 (y + _top) % height
+        self._top = 0
+        self._hw_scroll = (hw_scroll and height % line_height == 0 and
+                           hasattr(self.dp, 'vscroll_supported') and self.dp.vscroll_supported())
+        if self._hw_scroll:
+            self.dp.vscroll_define()
+            self.dp.vscroll_start(0)
         
-    @staticmethod
-    def is_chinese_char(char):
-        """
-        判断字符是否是中文字符
-        :param char: 单个字符
-        :return: True 是中文字符，False 不是
-        """
-        unicode_val = ord(char)
-        # 判断是否在常用汉字范围内
-        if 0x4E00 <= unicode_val <= 0x9FFF:
-            return True
-        # 判断是否在扩展汉字范围内（可选）
-        if 0x3400 <= unicode_val <= 0x4DBF or 0x20000 <= unicode_val <= 0x2A6DF:
-            return True
-        return False
-
-    @staticmethod
-    def is_english_char(char):
-        """
-        判断字符是否是英文字符
-        :param char: 单个字符
-        :return: True 是英文字符，False 不是
-        """
-        unicode_val = ord(char)
-        # 判断是否在 ASCII 范围内
-        if 0x0000 <= unicode_val <= 0x007F:
-            return True
-        return False
-
     def get_char_width(self, char):
         """
-        获取字符的宽度（中文字符宽度为 16，英文字符宽度为 8）
+        获取字符的宽度（ASCII 为半宽，其余字符为全宽）
         :param char: 单个字符
         :return: 字符宽度
         """
-        if self.is_chinese_char(char):
-            return 16  # 中文字符宽度
-        elif self.is_english_char(char):
-            return 8   # 英文字符宽度
-        else:
-            return 8   # 默认宽度
+        return self.layout.char_width(char)
 
     def add_text(self, text, char_delay=0.01, line_delay=0):
         """
         添加文本到显示器
-        
+
+        文字先排版、排入渲染队列，打字机效果按经过的时间推进，刷新频率不超过 fps
+
         参数:
             text: 要显示的文本
             char_delay: 字符显示间隔时间(秒)，设为0可禁用
             line_delay: 行显示间隔时间(秒)，设为0可禁用
         """
-        line_buffer = []  # 当前行缓冲区
-        line_width = 0    # 当前行宽度
+        char_ms = int(char_delay * 1000)
+        line_ms = int(line_delay * 1000)
+        if self._view_back:  # 正在回看历史，先回到最新内容
+            self.view_history(0)
         
-        for char in text:
-            if char == '\n':  # 换行符
-                self._flush_line_buffer(line_buffer)
+        # 一遍排版得到每行的字和 x 坐标，第一行写在当前行，之后每行另起一行
+        for i, (line_buffer, _) in enumerate(self.layout.layout(text, self.width)):
+            if i:
                 self._new_line()
-                line_buffer = []
-                line_width = 0
-                if line_delay > 0:
-                    time.sleep(line_delay)
-                continue
-                
-            char_width = self.get_char_width(char)
-            
-            # 检查是否需要换行
-            if line_width + char_width > self.width:
-                self._flush_line_buffer(line_buffer)
-                self._new_line()
-                line_buffer = []
-                line_width = 0
-                if line_delay > 0:
-                    time.sleep(line_delay)
-            
-            # 添加到行缓冲区
-            line_buffer.append((char, line_width))
-            line_width += char_width
-            
-            # 显示当前字符（如果启用延迟）
-            if char_delay > 0:
-                self.ed.text(char, line_width - char_width, self.current_y, self.color)
-                self.ed.show()
-                time.sleep(char_delay)
-        
-        # 刷新剩余内容
-        if line_buffer:
-            self._flush_line_buffer(line_buffer)
+                if line_ms > 0:  # 行间停顿
+                    self.render.add(line_ms, self.render.request)
+            self._flush_line_buffer(line_buffer, char_ms)
+        self._sync()
     
-    def _flush_line_buffer(self, line_buffer):
-        """将行缓冲区内容一次性显示到屏幕"""
+    def _flush_line_buffer(self, line_buffer, char_ms=0):
+        """将行缓冲区内容排入渲染队列，每个字间隔 char_ms 毫秒显示"""
         if not line_buffer:
             return
             
         # 检查是否需要滚动
         if self.current_y >= self.height:
-            self._scroll_up()
+            self.render.add(0, self._scroll_up)
             self.current_y = self.height - self.line_height
         
-        # 一次性显示整行
         for char, x in line_buffer:
-            self.ed.text(char, x, self.current_y, self.color)
-            self.lines.append((char, x, self.current_y))
-        
-        self.ed.show()
-    
+            self.render.add(char_ms, self._draw_char, char, x, self.current_y, self.color)
+
+    def _draw_char(self, char, x, y, color):
+        """渲染队列中的绘制操作：画一个字（不刷新屏幕）"""
+        self.ed.text(char, x, self._phys_y(y), color, show=False)
+        self.lines.append(char, x, color)
+
+    def _phys_y(self, y):
+        """逻辑行坐标对应的帧缓冲区行坐标"""
+        if self._top:
+            y += self._top
+            if y >= self.height:
+                y -= self.height
+        return y
+
+    def _sync(self):
+        """wait 为 True 时等到队列执行完，否则只推进到期的操作"""
+        if self.wait:
+            self.render.wait()
+        else:
+            self.render.update()
+
+    def update(self):
+        """
+        推进打字机效果并按帧率刷新（wait 为 False 时由调用方循环调用，不阻塞）
+
+        返回:
+            是否还有未显示完的内容
+        """
+        return self.render.update()
+
+    def flush(self):
+        """立即显示所有排队中的文字"""
+        self.render.flush()
+
+    def add_tile(self, tile, width, height, palette=None):
+        """
+        另起一行贴上服务器光栅化好的文字位图（tiles 模式），不查字库、不逐字渲染
+
+        参数:
+            tile: 该行的 FrameBuffer
+            width: 位图宽度(像素)
+            height: 位图高度(像素)，与行高一致
+            palette: MONO 位图的调色板，RGB565 位图为 None
+        """
+        # 位图缓冲区会被下一块复用，不能排队，先显示完排队中的文字再直接绘制
+        # 位图不保存到行存储，重绘时这一行为空
+        self._new_line()
+        if self.current_y + height > self.height:
+            self.render.add(0, self._scroll_up)
+            self.current_y = self.height - height
+        self.render.flush()
+        y = self._phys_y(self.current_y)
+        if palette is None:
+            self.dp.blit(tile, 0, y, -1, None, width, height)
+        else:
+            self.dp.blit(tile, 0, y, -1, palette, width, height)
+        self.render.request()
+        self.render.flush()
+
     def _new_line(self):
         """换行处理"""
         self.current_x = 0
         self.current_y += self.line_height
+        self.render.add(0, self.lines.new_line)
     
     def clear(self):
         """清空显示器"""
-        self.ed.fill(0)
-        self.lines = []
         self.current_x = 0
         self.current_y = 0
-        self.ed.show()
+        self.render.add(0, self._clear_screen)
+        self._sync()
+
+    def _clear_screen(self):
+        self.ed.fill(0)
+        self.lines.clear()
+        self._view_back = 0
+        if self._top:
+            self._top = 0
+            self.dp.vscroll_start(0)
     
     def _scroll_up(self):
         """向上滚动一行（整屏上移）"""
         # 计算保留区域的位置和大小
         scroll_height = self.height - self.line_height
         
-        # 使用硬件加速的滚动功能（如果支持）
-        if hasattr(self.dp, 'scroll'):
+        if self._hw_scroll:
+            # 最上面一行移到底部：清空它所在的帧缓冲区行并先刷新这一行，再移动滚动起始行，
+            # 像素只传输一行，与屏幕大小无关
+            self.ed.fill_rect(0, self._top, self.width, self.line_height, 0)
+            self.dp.show()
+            self._top += self.line_height
+            if self._top >= self.height:
+                self._top = 0
+            self.dp.vscroll_start(self._top)
+        # 使用帧缓冲区的滚动功能（如果支持）
+        elif hasattr(self.dp, 'scroll') and not getattr(self.dp, 'partial_frame', False):
             self.dp.scroll(0, -self.line_height)
             # 填充新的空白行
             self.ed.fill_rect(0, self.height - self.line_height, 
                              self.width, self.line_height, 0)
         else:
-            # 软件实现：重绘所有内容上移一行
-            self.ed.fill(0)
-            new_lines = []
-            for char, x, y in self.lines:
-                new_y = y - self.line_height
-                if new_y >= 0:  # 只保留仍然可见的内容
-                    self.ed.text(char, x, new_y, self.color)
-                    new_lines.append((char, x, new_y))
-            self.lines = new_lines
-        
-        self.ed.show()
+            # 软件实现：按行存储重绘，所有内容上移一行
+            self._redraw(0)
+
+    def _redraw(self, back):
+        """
+        按行存储重绘整屏
+
+        参数:
+            back: 屏幕最下面一行是第几新的行，0 为最新内容
+        """
+        self.ed.fill(0)
+        if self._top:
+            self._top = 0
+            self.dp.vscroll_start(0)
+        rows = min(self.max_lines, self.lines.count - back)
+        for row in range(rows):
+            y = row * self.line_height
+            for char, x, color in self.lines.chars(back + rows - 1 - row):
+                self.ed.text(char, x, y, color, show=False)
+        self._view_back = back
+
+    def view_history(self, back=0):
+        """
+        回看历史：屏幕最下面一行显示第 back 新的行，0 回到最新内容（之后的 add_text 也会回到最新内容）
+
+        参数:
+            back: 向上回看的行数，不超过 history_lines 保存的行数
+        """
+        back = max(0, min(back, self.lines.count - 1))
+        self.render.add(0, self._redraw, back)
+        self._sync()
 
     def display_text(self, text, char_delay=0.005, line_delay=0.01, clear=True):
         """
@@ -220,6 +288,7 @@ class TextDisplay:
         :param font_path: 字体文件路径
         """
         self.ed.set_font(font_path)
+        self.layout = get_layout(self.ed.font_size)
 
 # 示例用法
 if __name__ == "__main__":
@@ -0,0 +1,177 @@
+# MAX98357 播放：预分配环形缓冲区，sock.readinto 直接收数据，定点增益原地调节音量
+# 播放过程中不创建 bytes/array 对象，避免频繁 GC 造成的断音
+#
+# I2S 工作在非阻塞(IRQ)模式：网络接收与 I2S 播放互不阻塞。
+# 环形缓冲区同时作为抖动缓冲：先预填 prefill_ms 的音频再开始播放，边播边收。
+#   underruns: 播放中缓冲区被取空(网络跟不上)的次数
+#   overruns : 缓冲区已满、网络数据需要等待播放腾出空间的次数
+import time
+from array import array
+from xiaozhi_protocol import CTRL_FLAG, LEN_MASK
+from audio_dsp import apply_gain, gain_q15
+
+
+class AudioPlayer:
+    def __init__(self, audio_out, chunk_bytes=512, slots=8, volume=0.13,
+                 rate=8000, bits=16, prefill_ms=128):
+        """
+        初始化播放器
+
+        参数:
+            audio_out: I2S 输出实例(MAX98357)
+            chunk_bytes: 每个缓冲区的字节数，与握手协商的下行块大小一致
+            slots: 环形缓冲区个数，决定抖动缓冲的最大时长
+            volume: 音量因子(0~1)
+            rate: 播放采样率
+            bits: 播放位深
+            prefill_ms: 开始播放前预填的音频时长(ms)
+        """
+        self.audio_out = audio_out
+        self.slots = slots
+        self.bytes_per_ms = rate * (bits // 8) // 1000
+        self.prefill_ms = prefill_ms
+        self._hdr = bytearray(4)
+        self._hdr_mv = memoryview(self._hdr)
+        self.underruns = 0
+        self.overruns = 0
+        self.chunks = 0
+        self.resize(chunk_bytes)
+        self.set_volume(volume)
+        # 切换到非阻塞模式，每块播放完成后在回调中提交下一块
+        audio_out.irq(self._on_tx_done)
+
+    def resize(self, chunk_bytes):
+        """按下行块大小重新分配环形缓冲区（仅在握手后大小变化时调用）"""
+        self.chunk_bytes = chunk_bytes
+        self._bufs = [bytearray(chunk_bytes) for _ in range(self.slots)]
+        self._views = [memoryview(buf) for buf in self._bufs]
+        self._lens = array('H', [0] * self.slots)
+        self._wr = 0  # 已填充的块数（网络侧写入）
+        self._rd = 0  # 已播完的块数（I2S 回调更新）
+        self._playing = False
+        self._ended = True
+        self.set_prefill(self.prefill_ms)
+
+    def set_prefill(self, prefill_ms):
+        """设置抖动缓冲预填时长(ms)"""
+        self.prefill_ms = prefill_ms
+        chunk_ms = max(1, self.chunk_bytes // self.bytes_per_ms)
+        self._prefill = max(1, min(self.slots - 1, (prefill_ms + chunk_ms - 1) // chunk_ms))
+
+    def set_volume(self, volume):
+        """设置音量因子(0~1)"""
+        self.gain = gain_q15(volume)
+
+    def _submit(self):
+        """把下一块提交给 I2S（非阻塞）"""
+        i = self._rd % self.slots
+        n = self._lens[i]
+        self.audio_out.write(self._views[i] if n == self.chunk_bytes else self._views[i][:n])
+
+    def _on_tx_done(self, i2s):
+        """I2S 回调：一块播放完成"""
+        self._rd += 1
+        self.chunks += 1
+        if self._wr > self._rd:
+            self._submit()
+        else:
+            self._playing = False
+            if not self._ended:
+                self.underruns += 1  # 网络数据没跟上，重新预填后再播放
+
+    def _maybe_start(self):
+        """缓冲达到预填量（或数据已收完）时开始播放"""
+        if not self._playing:
+            buffered = self._wr - self._rd
+            if buffered >= self._prefill or (self._ended and buffered > 0):
+                self._playing = True
+                self._submit()
+
+    def _readinto(self, sock, mv, nbytes):
+        """从 socket 读满 nbytes 字节到 mv 开头"""
+        got = sock.readinto(mv, nbytes)
+        if not got:
+            raise OSError("连接已断开")
+        # 少数情况下 TCP 分段不足一块，才需要切片补读
+        while got < nbytes:
+            n = sock.readinto(mv[got:], nbytes - got)
+            if not n:
+                raise OSError("连接已断开")
+            got += n
+
+    def _read_header(self, sock):
+        """读取 <I 长度> 帧头"""
+        self._readinto(sock, self._hdr_mv, 4)
+        hdr = self._hdr
+        return hdr[0] | (hdr[1] << 8) | (hdr[2] << 16) | (hdr[3] << 24)
+
+    def _skip(self, sock, nbytes):
+        """丢弃 nbytes 字节，借用下一个空闲块作读缓冲区"""
+        # 环形缓冲区满时下一块就是 I2S 正在播放的块，等它播完再借用（不计入溢出）
+        while self._wr - self._rd >= self.slots:
+            self._maybe_start()
+            time.sleep_ms(1)
+        mv = self._views[self._wr % self.slots]
+        while nbytes > 0:
+            n = min(nbytes, self.chunk_bytes)
+            self._readinto(sock, mv, n)
+            nbytes -= n
+
+    def _wait_free_slot(self):
+        """环形缓冲区已满时等待 I2S 播完一块"""
+        if self._wr - self._rd >= self.slots:
+            self.overruns += 1
+            while self._wr - self._rd >= self.slots:
+                self._maybe_start()
+                time.sleep_ms(1)
+
+    def drain(self):
+        """等待缓冲区中的音频全部播放完"""
+        self._ended = True
+        self._maybe_start()
+        while self._playing:
+            time.sleep_ms(1)
+
+    def reset_stats(self):
+        """清零统计计数"""
+        self.underruns = 0
+        self.overruns = 0
+        self.chunks = 0
+
+    def play_stream(self, sock, on_control=None):
+        """
+        接收并播放一轮分帧下行音频，直到收到结束帧并播放完毕
+
+        参数:
+            sock: 已握手(framed_downlink)的 socket
+            on_control: 下行控制帧的处理函数 on_control(sock, nbytes)，须读完 nbytes 字节；
+                        为 None 时丢弃控制帧
+        """
+        chunk_bytes = self.chunk_bytes
+        views = self._views
+        lens = self._lens
+        self._ended = False
+        try:
+            while True:
+                length = self._read_header(sock)
+                if length == 0:  # 本轮回复结束
+                    break
+                if length & CTRL_FLAG:
+                    if on_control is not None:
+                        on_control(sock, length & LEN_MASK)
+                    else:
+                        self._skip(sock, length & LEN_MASK)
+                    continue
+                while length > 0:
+                    self._wait_free_slot()
+                    n = chunk_bytes if length > chunk_bytes else length
+                    i = self._wr % self.slots
+                    mv = views[i]
+                    self._readinto(sock, mv, n)
+                    apply_gain(mv, n, self.gain)
+                    lens[i] = n
+                    self._wr += 1
+                    self._maybe_start()
+                    length -= n
+        finally:
+            self.drain()
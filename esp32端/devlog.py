@@ -0,0 +1,102 @@
+# 设备端日志：分级、按消息限频、最近日志保存在内存环形缓冲区
+#
+# 串口输出本身很慢（115200 波特率下一行约 5ms），每帧打印会拖慢录音循环，
+# 所以热路径先判断级别再调用：
+#     if log.level <= DEBUG:
+#         log.debug("能量: %d", energy)
+# 级别关闭时只有一次属性读取和比较；格式化只在消息确实输出时进行。
+# 环形缓冲区可随时 dump() 打印，或由客户端打包成日志控制帧发给服务器。
+import time
+
+DEBUG = 10
+INFO = 20
+WARN = 30
+ERROR = 40
+
+_NAMES = {DEBUG: 'D', INFO: 'I', WARN: 'W', ERROR: 'E'}
+
+
+class Logger:
+    def __init__(self, level=INFO, console=True, ring_lines=32, ring_level=INFO):
+        """
+        初始化日志
+
+        参数:
+            level: 最低输出级别
+            console: 是否打印到串口
+            ring_lines: 环形缓冲区保存的行数
+            ring_level: 写入环形缓冲区的最低级别
+        """
+        self.level = level
+        self.console = console
+        self.ring_level = ring_level
+        self._ring = [None] * ring_lines
+        self._ring_i = 0
+        self._last_ms = {}  # 限频消息上次输出的时间
+        self._suppressed = {}  # 限频期间被丢弃的条数
+
+    def log(self, level, msg, *args, every_ms=0):
+        """
+        输出一条日志
+
+        参数:
+            level: 级别
+            msg: 消息格式串（% 格式），同时作为限频的键
+            args: 格式化参数，消息被丢弃时不格式化
+            every_ms: 同一消息的最短输出间隔(ms)，0 为不限频
+        """
+        if level < self.level:
+            return
+        suffix = ''
+        if every_ms:
+            now = time.ticks_ms()
+            last = self._last_ms.get(msg)
+            if last is not None and time.ticks_diff(now, last) < every_ms:
+                self._suppressed[msg] = self._suppressed.get(msg, 0) + 1
+                return
+            self._last_ms[msg] = now
+            dropped = self._suppressed.pop(msg, 0)
+            if dropped:
+                suffix = " (已抑制 %d 条)" % dropped
+        text = (msg % args if args else msg) + suffix
+        if self.console:
+            print(text)
+        if level >= self.ring_level and self._ring:
+            self._ring[self._ring_i] = "%d %s %s" % (time.ticks_ms(), _NAMES.get(level, '?'), text)
+            self._ring_i = (self._ring_i + 1) % len(self._ring)
+
+    def debug(self, msg, *args, every_ms=0):
+        if self.level <= DEBUG:
+            self.log(DEBUG, msg, *args, every_ms=every_ms)
+
+    def info(self, msg, *args, every_ms=0):
+        if self.level <= INFO:
+            self.log(INFO, msg, *args, every_ms=every_ms)
+
+    def warn(self, msg, *args, every_ms=0):
+        if self.level <= WARN:
+            self.log(WARN, msg, *args, every_ms=every_ms)
+
+    def error(self, msg, *args, every_ms=0):
+        self.log(ERROR, msg, *args, every_ms=every_ms)
+
+    def lines(self):
+        """环形缓冲区中的日志，按时间先后排列"""
+        n = len(self._ring)
+        return [self._ring[(self._ring_i + k) % n] for k in range(n)
+                if self._ring[(self._ring_i + k) % n] is not None]
+
+    def dump(self):
+        """把环形缓冲区中的日志打印到串口"""
+        for line in self.lines():
+            print(line)
+
+    def clear(self):
+        """清空环形缓冲区"""
+        for k in range(len(self._ring)):
+            self._ring[k] = None
+        self._ring_i = 0
+
+
+# 默认日志实例，各模块共用
+log = Logger()
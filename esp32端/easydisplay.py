@@ -13,9 +13,46 @@
 # PBM文件转换：https://blog.csdn.net/jd3096/article/details/121319042
 # 灰度化、二值化：https://blog.csdn.net/li_wen01/article/details/72867057
 # Framebuffer 的 Palette: https://forum.micropython.org/viewtopic.php?t=12857
+import micropython
 from io import BytesIO
 from struct import unpack
 from framebuf import FrameBuffer, MONO_HLSB, RGB565
+from fontcache import default_cache, FontIndex
+from glyphscale import GlyphScaler, scale_hlsb
+
+
+@micropython.viper
+def _copy_bytes(dst, src, n: int):
+    """把 src 的前 n 个字节复制到 dst，不分配内存"""
+    d = ptr8(dst)
+    s = ptr8(src)
+    i = 0
+    while i < n:
+        d[i] = s[i]
+        i += 1
+
+
+class _GlyphContext:
+    """
+    Text render context 文字渲染的预分配缓冲区
+
+    Each (font size, color type) pair gets one: a MONO glyph buffer, the palette, and in direct-drive
+    mode an RGB565 glyph buffer. text() reuses them for every character instead of allocating.
+    每个 (字号, 颜色类型) 一份：MONO 字形缓冲区、调色板，直接驱动模式下还有 RGB565 字形缓冲区，
+    text() 逐字复用，不再为每个字分配内存。
+    """
+    def __init__(self, font_size: int, color_type: str, direct: bool):
+        self.glyph = bytearray(font_size * ((font_size + 7) >> 3))
+        self.fbuf = FrameBuffer(self.glyph, font_size, font_size, MONO_HLSB)
+        if color_type == "MONO":
+            self.palette = FrameBuffer(bytearray(1), 2, 1, MONO_HLSB)  # MONO pixels occupy 1 byte for every 8 pixels
+        elif color_type == "RGB565":
+            self.palette = FrameBuffer(bytearray(4), 2, 1, RGB565)  # RGB565 pixels occupy 2 bytes for every 1 pixel
+        else:
+            raise KeyError("Unsupported color_type: {}".format(color_type))
+        self.rgb = None
+        if direct and color_type == "RGB565":
+            self.rgb = FrameBuffer(bytearray(font_size * font_size * 2), font_size, font_size, RGB565)
 
 
 class EasyDisplay:
@@ -34,6 +71,10 @@ class EasyDisplay:
                  auto_wrap: bool = False,
                  half_char: bool = True,
                  line_spacing: int = 0,
+                 glyph_cache=None,
+                 preload_index: bool = False,
+                 index_max_bytes: int = 8192,
+                 scaled_cache_bytes: int = 2048,
                  *args, **kwargs):
         """
         初始化 EasyDisplay
@@ -67,9 +108,18 @@ class EasyDisplay:
                 半宽显示 ASCII 字符
             line_spacing: Line spacing for text
                 文本行间距
+            glyph_cache: Glyph bitmap cache (fontcache.GlyphCache), shared with ufont.BMFont by default
+                字形点阵缓存，默认与 ufont.BMFont 共用同一个
+            preload_index: Load the font's codepoint table into RAM, flash is then only read for glyphs
+                把字体的码位表读入内存，之后只在取点阵时读 flash
+            index_max_bytes: Memory cap of the preloaded index, larger fonts fall back to seek lookups
+                常驻索引的内存上限，超出时仍在 flash 上查找
+            scaled_cache_bytes: Memory cap of the scaled glyph cache for each non-native size
+                非原始字号时，每个字号缩放后点阵缓存的内存上限
         """
         self.display = display
         self._buffer = hasattr(display, 'buffer')  # buffer: 驱动是否使用了帧缓冲区，False（SPI 直接驱动） / True（Framebuffer）
+        self._sized_blit = hasattr(display, 'damage')  # 驱动只刷新脏矩形时，blit 需要告知源图像尺寸
         self._font = None
         self._key = key
         self._show = show
@@ -89,6 +139,14 @@ class EasyDisplay:
         self.font_map_mode = None
         self.font_start_bitmap = None
         self.font_bitmap_size = None
+        self.glyph_cache = glyph_cache if glyph_cache is not None else default_cache()
+        self._font_key = 0
+        self.preload_index = preload_index
+        self.index_max_bytes = index_max_bytes
+        self._index = None
+        self._contexts = {}  # 字号 << 1 | 颜色类型 -> _GlyphContext
+        self.scaled_cache_bytes = scaled_cache_bytes
+        self._scalers = {}  # 字号 -> GlyphScaler，换字体时清空
         if font:
             self.load_font(font)
 
@@ -163,6 +221,8 @@ class EasyDisplay:
             word: Character 字符
         """
         word_code = ord(word)
+        if self._index is not None:  # Preloaded index 常驻内存的索引
+            return self._index.find(word_code)
         start = 0x10
         end = self.font_start_bitmap
         _seek = self._font.seek
@@ -179,7 +239,6 @@ class EasyDisplay:
                 start = mid + 2
         return -1
 
-    # @timeit
     @staticmethod
     def _hlsb_font_size(bytearray_data: bytearray, new_size: int, old_size: int) -> bytearray:
         """
@@ -193,19 +252,21 @@ class EasyDisplay:
         Returns:
             Scaled character data 缩放后的数据
         """
-        r = range(new_size)  # Preload functions to avoid repeated execution and improve efficiency
         if old_size == new_size:
             return bytearray_data
-        _t = bytearray(new_size * ((new_size >> 3) + 1))
-        _new_index = -1
-        for _col in r:
-            for _row in r:
-                if _row % 8 == 0:
-                    _new_index += 1
-                _old_index = int(_col / (new_size / old_size)) * old_size + int(_row / (new_size / old_size))
-                _t[_new_index] = _t[_new_index] | (
-                        (bytearray_data[_old_index >> 3] >> (7 - _old_index % 8) & 1) << (7 - _row % 8))
-        return _t
+        return scale_hlsb(bytearray_data, new_size, old_size)
+
+    def _scaler(self, font_size: int) -> GlyphScaler:
+        """
+        Get the scaler for a non-native size 取得字号对应的缩放器（索引表和缩放后点阵的缓存）
+
+        Args:
+            font_size: Font size 字号
+        """
+        scaler = self._scalers.get(font_size)
+        if scaler is None:
+            scaler = self._scalers[font_size] = GlyphScaler(self.font_size, font_size, self.scaled_cache_bytes)
+        return scaler
 
     def get_bitmap(self, word: str) -> bytes:
         """
@@ -217,12 +278,32 @@ class EasyDisplay:
         Returns:
             Bytes representing the dot matrix image of the character 字符点阵
         """
+        key = self._font_key | ord(word)
+        bitmap = self.glyph_cache.get(key)  # Cached glyphs skip the index search and the read 命中缓存时不读文件
+        if bitmap is not None:
+            return bitmap
         index = self._get_index(word)
         if index == -1:
-            return b'\xff\xff\xff\xff\xff\xff\xff\xff\xf0\x0f\xcf\xf3\xcf\xf3\xff\xf3\xff\xcf\xff?\xff?\xff\xff\xff' \
-                   b'?\xff?\xff\xff\xff\xff'  # Returns the question mark icon
-        self._font.seek(self.font_start_bitmap + index * self.font_bitmap_size, 0)
-        return self._font.read(self.font_bitmap_size)
+            bitmap = b'\xff\xff\xff\xff\xff\xff\xff\xff\xf0\x0f\xcf\xf3\xcf\xf3\xff\xf3\xff\xcf\xff?\xff?\xff\xff\xff' \
+                     b'?\xff?\xff\xff\xff\xff'  # Returns the question mark icon
+        else:
+            self._font.seek(self.font_start_bitmap + index * self.font_bitmap_size, 0)
+            bitmap = self._font.read(self.font_bitmap_size)
+        self.glyph_cache.put(key, bitmap)
+        return bitmap
+
+    def _glyph_context(self, font_size: int) -> _GlyphContext:
+        """
+        Get the scratch buffers for a font size 取得字号对应的预分配缓冲区（首次使用时分配）
+
+        Args:
+            font_size: Font size 字号
+        """
+        key = font_size << 1 | (self.color_type == "RGB565")
+        ctx = self._contexts.get(key)
+        if ctx is None:
+            ctx = self._contexts[key] = _GlyphContext(font_size, self.color_type, not self._buffer)
+        return ctx
 
     def load_font(self, file: str):
         """
@@ -233,6 +314,8 @@ class EasyDisplay:
         """
         self.font_file = file
         self._font = open(file, "rb")
+        self._font_key = self.glyph_cache.font_key(file)
+        self._scalers = {}
         # 获取字体文件信息
         #  字体文件信息大小 16 byte ,按照顺序依次是
         #   文件标识 2 byte
@@ -259,6 +342,12 @@ class EasyDisplay:
             self.size = int(self.font_size)
         # 点阵所占字节，用来定位字体数据位置
         self.font_bitmap_size = self.font_bmf_info[8]
+        # 码位表读入内存，超过内存上限时仍在 flash 上查找
+        self._index = None
+        if self.preload_index:
+            index = FontIndex(self._font, self.font_start_bitmap, self.index_max_bytes)
+            if index.loaded:
+                self._index = index
 
     def text(self, s: str, x: int, y: int,
              color: int = None, bg_color: int = None, size: int = None,
@@ -332,15 +421,16 @@ class EasyDisplay:
         if invert:
             color, bg_color = bg_color, color
 
-        # 配置调色板
-        if color_type == "MONO":
-            palette = FrameBuffer(bytearray(1), 2, 1, MONO_HLSB)  # MONO pixels occupy 1 byte for every 8 pixels
-        elif color_type == "RGB565":
-            palette = FrameBuffer(bytearray(4), 2, 1, RGB565)  # RGB565 pixels occupy 2 bytes for every 1 pixel
-        else:
-            raise KeyError("Unsupported color_type: {}".format(color_type))
+        # 预分配的字形缓冲区和调色板，逐字复用
+        ctx = self._glyph_context(font_size)
+        glyph = ctx.glyph
+        glyph_bytes = len(glyph)
+        fbuf = ctx.fbuf
+        palette = ctx.palette
         palette.pixel(1, 0, color)
         palette.pixel(0, 0, bg_color)
+        # 非原始字号：缩放后的点阵按码位缓存
+        scaler = self._scaler(font_size) if font_size != self.font_size else None
 
         # 清屏
         if clear:
@@ -367,21 +457,28 @@ class EasyDisplay:
             if x > dp.width or y > dp.height:
                 continue
 
-            # 获取字体的点阵数据
-            byte_data = self.get_bitmap(char)
+            # 获取字体的点阵数据，非原始字号时取缩放后的点阵
+            if scaler is None:
+                byte_data = self.get_bitmap(char)
+            else:
+                byte_data = scaler.get(ord(char))
+                if byte_data is None:
+                    byte_data = scaler.scale(ord(char), self.get_bitmap(char))
 
-            # 准备并缩放字符数据
-            byte_data = bytearray(byte_data)
-            if font_size != self.font_size:
-                byte_data = self._hlsb_font_size(byte_data, font_size, self.font_size)
+            # 复制到字形缓冲区
+            _copy_bytes(glyph, byte_data, min(glyph_bytes, len(byte_data)))
 
             # 显示字符
-            fbuf = FrameBuffer(byte_data, font_size, font_size, MONO_HLSB)
             if self._buffer:  # FrameBuffer Driven
-                dp.blit(fbuf, x, y, key, palette)
+                if self._sized_blit:
+                    dp.blit(fbuf, x, y, key, palette, font_size, font_size)
+                else:
+                    dp.blit(fbuf, x, y, key, palette)
             else:
                 if color_type == "RGB565":
-                    n_fbuf = FrameBuffer(bytearray(font_size * font_size * 2), font_size, font_size, RGB565)
+                    n_fbuf = ctx.rgb
+                    if key != -1:
+                        n_fbuf.fill(0)  # 透明的像素保持底色，不留上一个字的残影
                     n_fbuf.blit(fbuf, 0, 0, key, palette)  # Render black and white pixels to color
                 elif color_type == "MONO":
                     n_fbuf = fbuf  # Not tested
@@ -776,3 +873,33 @@ class EasyDisplay:
                     raise TypeError("Unsupported File Type: {}".format(file_head))
                 except:
                     raise TypeError("Unsupported File Type!")
+
+
+def bench_text(ed, text="小智你好，今天天气怎么样？Hello, XiaoZhi!", repeat=10):
+    """
+    统计 text() 的堆分配(gc.mem_free 前后差值)与速度
+
+    同时测一个字和整串文字：两者每次调用的分配相同，说明逐字绘制不再分配内存，
+    剩下的只是每次调用的固定开销（关键字参数字典、字符串迭代器等）。
+
+    Args:
+        ed: EasyDisplay instance (font loaded) 已加载字体的 EasyDisplay 实例
+        text: Test text 测试文本
+        repeat: Repeat count 重复次数
+    """
+    import gc
+    import time
+    ed.text(text, 0, 0, show=False)  # 预热：建立字形缓冲区、填充字形缓存
+    results = []
+    for name, s in (("单字", text[0]), ("整串", text)):
+        gc.collect()
+        free = gc.mem_free()
+        t = time.ticks_us()
+        for _ in range(repeat):
+            ed.text(s, 0, 0, show=False)
+        us = time.ticks_diff(time.ticks_us(), t)
+        used = free - gc.mem_free()
+        results.append((name, len(s), used // repeat, len(s) * repeat * 1000000 // max(1, us)))
+    for name, n, used, cps in results:
+        print("{}({}字): 每次调用分配 {} 字节, {} 字/秒".format(name, n, used, cps))
+    return results
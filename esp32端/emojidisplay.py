@@ -1,12 +1,12 @@
-from machine import Pin, SoftI2C
+from machine import Pin, I2C
 import ssd1306
 import time
 import math
 
 class EmojiDisplay:
-    def __init__(self, scl_pin=6, sda_pin=5, width=128, height=64):
-        # 初始化I2C
-        self.i2c = SoftI2C(scl=Pin(scl_pin), sda=Pin(sda_pin))
+    def __init__(self, scl_pin=6, sda_pin=5, width=128, height=64, i2c_freq=1000000):
+        # 初始化硬件I2C，显示异常时把 i2c_freq 降到 400000
+        self.i2c = I2C(0, scl=Pin(scl_pin), sda=Pin(sda_pin), freq=i2c_freq)
         # 初始化SSD1306显示屏
         self.oled = ssd1306.SSD1306_I2C(width, height, self.i2c)
         # 清屏
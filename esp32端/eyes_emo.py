@@ -1,6 +1,7 @@
 from machine import Pin, PWM, I2C
 import time
 import math
+import framebuf
 from ssd1306 import SSD1306_I2C
 
 # 自定义 SSD1306_I2C 类，添加 fill_round_rect 和 fill_triangle 方法
@@ -18,13 +19,16 @@ class CustomSSD1306_I2C(SSD1306_I2C):
         # 绘制中间的矩形
         self.fill_rect(x + r, y, w - 2 * r, h, color)
         self.fill_rect(x, y + r, w, h - 2 * r, color)
+        # 圆角都在矩形范围内，整体记录一次修改区域，逐点绘制时直接调用 FrameBuffer.pixel
+        self.damage(x, y, w, h)
+        pixel = framebuf.FrameBuffer.pixel
         
         # 绘制四个角的圆角
         def draw_circle_part(cx, cy):
             for i in range(cx - r, cx + r + 1):
                 for j in range(cy - r, cy + r + 1):
                     if (i - cx) ** 2 + (j - cy) ** 2 <= r ** 2:
-                        self.pixel(i, j, color)
+                        pixel(self, i, j, color)
         
         # 左上角
         draw_circle_part(x + r, y + r)
@@ -96,7 +100,7 @@ class EyeExpression:
         # 屏幕配置
         self.SCREEN_WIDTH = 128
         self.SCREEN_HEIGHT = 64
-        self.i2c = I2C(0, scl=Pin(6), sda=Pin(5), freq=400000)
+        self.i2c = I2C(0, scl=Pin(6), sda=Pin(5), freq=1000000)  # 显示异常时降到 400000
         self.display = CustomSSD1306_I2C(self.SCREEN_WIDTH, self.SCREEN_HEIGHT, self.i2c)
 
         # 舵机配置
@@ -135,6 +139,8 @@ class EyeExpression:
             'right_eye_width': self.ref_eye_width
         }
 
+        self._eye_boxes = ()  # 上一帧两只眼睛的区域，下一帧只清除这些区域
+
         # 初始化舵机位置
         self.write_servo(self.servo_x, self.X_CENTER)
         self.write_servo(self.servo_y, self.Y_CENTER)
@@ -157,23 +163,22 @@ class EyeExpression:
         pwm.duty(duty)
 
     def draw_eyes(self, update=True):
-        self.display.fill(0)
+        # 只清除上一帧眼睛所在的区域（表情的三角形也画在其中），屏幕只刷新这些页
+        for box in self._eye_boxes:
+            self.display.fill_rect(*box, 0)
         
         # 绘制左眼
         x = int(self.current_state['left_eye_x'] - self.current_state['left_eye_width']/2)
         y = int(self.current_state['left_eye_y'] - self.current_state['left_eye_height']/2)
-        self.display.fill_round_rect(x, y, 
-                                   self.current_state['left_eye_width'], 
-                                   self.current_state['left_eye_height'],
-                                   self.ref_corner_radius, 1)
+        left = (x, y, self.current_state['left_eye_width'], self.current_state['left_eye_height'])
+        self.display.fill_round_rect(*left, self.ref_corner_radius, 1)
         
         # 绘制右眼
         x = int(self.current_state['right_eye_x'] - self.current_state['right_eye_width']/2)
         y = int(self.current_state['right_eye_y'] - self.current_state['right_eye_height']/2)
-        self.display.fill_round_rect(x, y, 
-                                   self.current_state['right_eye_width'], 
-                                   self.current_state['right_eye_height'],
-                                   self.ref_corner_radius, 1)
+        right = (x, y, self.current_state['right_eye_width'], self.current_state['right_eye_height'])
+        self.display.fill_round_rect(*right, self.ref_corner_radius, 1)
+        self._eye_boxes = (left, right)
         
         if update:
             self.display.show()
@@ -262,6 +267,31 @@ class EyeExpression:
             time.sleep_ms(10)
         time.sleep_ms(1000)
 
+    def bench(self, frames=30):
+        """
+        对比整屏刷新与按页局部刷新时眨眼动画的帧率
+
+        参数:
+            frames: 每种方式测试的帧数
+        """
+        display = self.display
+        results = []
+        for name, full in (("整屏刷新", True), ("局部刷新", False)):
+            t = time.ticks_us()
+            for i in range(frames):
+                self.current_state['left_eye_height'] = self.ref_eye_height - (i % 6) * 6
+                self.current_state['right_eye_height'] = self.current_state['left_eye_height']
+                if full:
+                    display.fill(0)
+                self.draw_eyes(update=False)
+                display.show()
+            us = time.ticks_diff(time.ticks_us(), t)
+            results.append((name, frames * 1000000 / us))
+        self.eye_center()
+        for name, fps in results:
+            print("{}: {:.1f} fps".format(name, fps))
+        return results
+
     def main(self):
         while True:
             # 测试各种功能
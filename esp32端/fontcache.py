@@ -0,0 +1,179 @@
+# 字形点阵 LRU 缓存，EasyDisplay 与 ufont.BMFont 共用
+#
+# 从 .bmf 字体取一个字要先二分查找索引（每步一次 seek + read，ESP32-C3 上约 2.67ms），
+# 再 seek + read 一次点阵；而屏幕上反复绘制的总是那些字。缓存按 字体编号<<21 | 码位 保存点阵，
+# 键是小整数，查找不分配内存；总大小受 max_bytes 限制，超出时淘汰最久未用的字。
+#
+# FontIndex 把字体的码位表整个读入内存，没命中缓存的字也不必在 flash 上二分查找。
+from array import array
+from collections import OrderedDict
+
+_FONT_SHIFT = 21  # Unicode 码位不超过 0x10FFFF
+_ENTRY_OVERHEAD = 24  # 每个缓存项除点阵外的大致开销(字节)
+
+
+class GlyphCache:
+    def __init__(self, max_bytes=4096):
+        """
+        初始化缓存
+
+        参数:
+            max_bytes: 缓存占用内存的上限(字节)，0 为不缓存
+        """
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()
+        self._fonts = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def font_key(self, font_file):
+        """为字体文件分配编号，返回该字体的键前缀"""
+        no = self._fonts.get(font_file)
+        if no is None:
+            no = self._fonts[font_file] = len(self._fonts) + 1
+        return no << _FONT_SHIFT
+
+    def get(self, key):
+        """取出缓存的点阵，没有时返回 None"""
+        items = self._items
+        bitmap = items.pop(key, None)
+        if bitmap is None:
+            self.misses += 1
+            return None
+        items[key] = bitmap  # 重新插入，移到最近使用的一端
+        self.hits += 1
+        return bitmap
+
+    def put(self, key, bitmap):
+        """放入点阵，超出内存上限时淘汰最久未用的项"""
+        size = len(bitmap) + _ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return
+        items = self._items
+        old = items.pop(key, None)
+        if old is not None:
+            self.bytes -= len(old) + _ENTRY_OVERHEAD
+        while self.bytes + size > self.max_bytes:
+            oldest = next(iter(items))
+            self.bytes -= len(items.pop(oldest)) + _ENTRY_OVERHEAD
+        items[key] = bitmap
+        self.bytes += size
+
+    def clear(self):
+        """清空缓存（统计保留）"""
+        self._items = OrderedDict()
+        self.bytes = 0
+
+    def hit_rate(self):
+        """命中率(0~1)"""
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self):
+        return "字形缓存: {} 字 {}/{} 字节 命中率 {:.1%}".format(
+            len(self._items), self.bytes, self.max_bytes, self.hit_rate())
+
+
+class FontIndex:
+    """
+    常驻内存的字体索引
+
+    .bmf 文件头之后是按码位升序排列的 >H 码位表，字的序号即其在表中的位置。
+    表整个读入 array('H')，在内存中二分查找；ASCII 另建直接映射表，一次下标即可取得。
+    码位表超过 max_bytes 时不加载（loaded 为 False），调用方继续走 seek 查找。
+    """
+    def __init__(self, font, start_bitmap, max_bytes=8192):
+        """
+        参数:
+            font: 已打开的字体文件
+            start_bitmap: 点阵数据开始位置，即码位表的结束位置
+            max_bytes: 码位表占用内存的上限(字节)
+        """
+        self.count = (start_bitmap - 16) // 2
+        self.codes = None
+        self.ascii = None
+        if self.count <= 0 or self.count * 2 > max_bytes:
+            return
+        codes = array('H', bytes(self.count * 2))
+        font.seek(16, 0)
+        if font.readinto(codes) != self.count * 2:
+            return
+        # 文件中是大端序，ESP32 是小端序，原地交换高低字节
+        for i in range(self.count):
+            c = codes[i]
+            codes[i] = (c >> 8) | (c & 0xFF) << 8
+        # ASCII 在表的最前面，序号都小于 128，用一个字节保存，0xFF 表示字体中没有
+        ascii = bytearray(b'\xff' * 128)
+        for i in range(min(128, self.count)):
+            if codes[i] < 128:
+                ascii[codes[i]] = i
+        self.codes = codes
+        self.ascii = ascii
+
+    @property
+    def loaded(self):
+        return self.codes is not None
+
+    def nbytes(self):
+        """占用的内存(字节)"""
+        return self.count * 2 + 128 if self.codes is not None else 0
+
+    def find(self, code):
+        """码位对应的字序号，字体中没有时返回 -1"""
+        if code < 128:
+            i = self.ascii[code]
+            return -1 if i == 0xFF else i
+        codes = self.codes
+        lo = 0
+        hi = self.count - 1
+        while lo <= hi:
+            mid = (lo + hi) >> 1
+            c = codes[mid]
+            if c == code:
+                return mid
+            if c < code:
+                lo = mid + 1
+            else:
+                hi = mid - 1
+        return -1
+
+
+_default = None
+
+
+def default_cache():
+    """EasyDisplay 和 BMFont 默认共用的缓存"""
+    global _default
+    if _default is None:
+        _default = GlyphCache()
+    return _default
+
+
+def bench(font, text="小智你好，今天天气怎么样？Hello, XiaoZhi! 0123456789", repeat=5):
+    """
+    对比有无缓存时取字形的速度(字/秒)
+
+    参数:
+        font: EasyDisplay 或 BMFont 实例（已加载字体）
+        text: 测试文本
+        repeat: 重复次数，模拟屏幕反复重绘相同的字
+    """
+    import time
+    cache = font.glyph_cache
+    results = []
+    for name, budget in (("无缓存", 0), ("有缓存", cache.max_bytes or 4096)):
+        saved = cache.max_bytes
+        cache.max_bytes = budget
+        cache.clear()
+        cache.hits = cache.misses = 0
+        t = time.ticks_us()
+        for _ in range(repeat):
+            for char in text:
+                font.get_bitmap(char)
+        us = time.ticks_diff(time.ticks_us(), t)
+        results.append((name, len(text) * repeat * 1000000 // max(1, us), cache.hit_rate()))
+        cache.max_bytes = saved
+    for name, cps, rate in results:
+        print("{}: {:6d} 字/秒 命中率 {:.1%}".format(name, cps, rate))
+    return results
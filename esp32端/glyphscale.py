@@ -0,0 +1,171 @@
+# 字形缩放：EasyDisplay 与 ufont.BMFont 共用
+#
+# 以非原始字号显示文字时，原来每画一个字都要重新缩放一次点阵，每个像素做两次浮点除法。
+# 这里为每对 (原字号, 新字号) 预先算好整数索引表：新点阵第 y 行对应原点阵的位偏移、第 x 列对应的原列号，
+# 缩放的内层循环用 viper 实现，只做查表和位运算；缩放后的点阵按码位缓存，同一个字只缩放一次。
+# 大字号的状态画面因此和原始字号一样快。
+import micropython
+from array import array
+from framebuf import FrameBuffer, RGB565
+from fontcache import GlyphCache
+
+_maps = {}
+
+
+def scale_map(old_size, new_size):
+    """
+    (原字号, 新字号) 的整数索引表，按字号对缓存
+
+    前 new_size 项为新点阵每一行在原点阵中的起始位偏移，后 new_size 项为每一列对应的原列号；
+    原点阵按位连续存放（与 .bmf 一致）。
+    """
+    key = old_size << 8 | new_size
+    maps = _maps.get(key)
+    if maps is None:
+        maps = array('H', bytes(new_size * 4))
+        for i in range(new_size):
+            src = i * old_size // new_size
+            maps[i] = src * old_size
+            maps[new_size + i] = src
+        _maps[key] = maps
+    return maps
+
+
+@micropython.viper
+def _scale_hlsb(src, dst, maps, size: int):
+    """按索引表缩放 MONO_HLSB 点阵，dst 需预先清零，每行按字节对齐"""
+    s = ptr8(src)
+    d = ptr8(dst)
+    m = ptr16(maps)
+    stride = (size + 7) >> 3
+    y = 0
+    while y < size:
+        base = int(m[y])
+        row = y * stride
+        x = 0
+        while x < size:
+            i = base + int(m[size + x])
+            if (s[i >> 3] >> (7 - (i & 7))) & 1:
+                j = row + (x >> 3)
+                d[j] = d[j] | (0x80 >> (x & 7))
+            x += 1
+        y += 1
+
+
+@micropython.viper
+def hlsb_to_rgb565(src, dst, size: int, color: int, bg_color: int):
+    """把按字节对齐的 MONO_HLSB 点阵着色为 RGB565（小端）"""
+    s = ptr8(src)
+    d = ptr8(dst)
+    stride = (size + 7) >> 3
+    j = 0
+    y = 0
+    while y < size:
+        row = y * stride
+        x = 0
+        while x < size:
+            c = bg_color
+            if (s[row + (x >> 3)] >> (7 - (x & 7))) & 1:
+                c = color
+            d[j] = c & 0xFF
+            d[j + 1] = (c >> 8) & 0xFF
+            j += 2
+            x += 1
+        y += 1
+
+
+def scale_hlsb(bitmap, new_size, old_size):
+    """缩放一个字的点阵，返回新的 bytearray（不经过缓存）"""
+    out = bytearray(new_size * ((new_size + 7) >> 3))
+    if new_size:
+        _scale_hlsb(bitmap, out, scale_map(old_size, new_size), new_size)
+    return out
+
+
+class GlyphScaler:
+    def __init__(self, old_size, new_size, max_bytes=2048):
+        """
+        某个字体缩放到某个字号的缩放器
+
+        参数:
+            old_size: 字体的原始字号
+            new_size: 显示的字号
+            max_bytes: 缩放后点阵缓存的内存上限(字节)，0 为不缓存
+        """
+        self.old_size = old_size
+        self.new_size = new_size
+        self.glyph_bytes = new_size * ((new_size + 7) >> 3)
+        self.maps = scale_map(old_size, new_size)
+        self.cache = GlyphCache(max_bytes)  # 键为码位，每个缩放器属于一个字体
+        self._rgb = None
+        self._rgb_fbuf = None
+
+    def get(self, code):
+        """取出缓存的缩放点阵，没有时返回 None"""
+        return self.cache.get(code)
+
+    def scale(self, code, bitmap):
+        """缩放原始点阵并放入缓存"""
+        out = bytearray(self.glyph_bytes)
+        _scale_hlsb(bitmap, out, self.maps, self.new_size)
+        self.cache.put(code, out)
+        return out
+
+    def rgb565(self, bitmap, color, bg_color):
+        """把缩放后的点阵着色为 RGB565，返回复用的 FrameBuffer（下一个字会覆盖它）"""
+        size = self.new_size
+        if self._rgb is None:
+            self._rgb = bytearray(size * size * 2)
+            self._rgb_fbuf = FrameBuffer(self._rgb, size, size, RGB565)
+        hlsb_to_rgb565(bitmap, self._rgb, size, color, bg_color)
+        return self._rgb_fbuf
+
+
+def _scale_reference(bitmap, new_size, old_size):
+    """原来的浮点实现，供 bench 对比"""
+    t = bytearray(new_size * ((new_size >> 3) + 1))
+    new_index = -1
+    for col in range(new_size):
+        for row in range(new_size):
+            if row % 8 == 0:
+                new_index += 1
+            old_index = int(col / (new_size / old_size)) * old_size + int(row / (new_size / old_size))
+            t[new_index] = t[new_index] | ((bitmap[old_index >> 3] >> (7 - old_index % 8) & 1) << (7 - row % 8))
+    return t
+
+
+def bench(font, size=32, text="小智你好，今天天气怎么样？Hello!", repeat=5):
+    """
+    对比缩放一段文字的速度(字/秒)：原来的浮点实现、整数索引表 + viper、再加上缩放缓存
+
+    参数:
+        font: EasyDisplay 或 BMFont 实例（已加载字体）
+        size: 显示的字号
+        text: 测试文本
+        repeat: 重复次数，模拟状态画面反复重绘相同的字
+    """
+    import time
+    old_size = font.font_size
+    bitmaps = [(ord(char), font.get_bitmap(char)) for char in text]
+    scaler = GlyphScaler(old_size, size, max_bytes=len(text) * (size * ((size + 7) >> 3) + 32))
+
+    def cached(code, bitmap):
+        scaled = scaler.get(code)
+        return scaled if scaled is not None else scaler.scale(code, bitmap)
+
+    cases = (
+        ("浮点", lambda code, bitmap: _scale_reference(bitmap, size, old_size)),
+        ("viper", lambda code, bitmap: scale_hlsb(bitmap, size, old_size)),
+        ("viper+缓存", cached),
+    )
+    results = []
+    for name, fn in cases:
+        t = time.ticks_us()
+        for _ in range(repeat):
+            for code, bitmap in bitmaps:
+                fn(code, bitmap)
+        us = time.ticks_diff(time.ticks_us(), t)
+        results.append((name, len(bitmaps) * repeat * 1000000 // max(1, us)))
+    for name, cps in results:
+        print("{:>10}: {}->{}px {:6d} 字/秒".format(name, old_size, size, cps))
+    return results
@@ -0,0 +1,78 @@
+# 文本控制台的行存储：固定容量的环形缓冲区，TextDisplay 和 ScreenManager 共用
+#
+# 原来每画一个字就追加一个 (char, x, y) 元组，硬件滚动时从不清理，长时间运行后状态文字会慢慢耗尽内存。
+# 这里每行最多 max_chars 个字，码位、x 坐标和颜色分别存在预分配的 array/bytearray 中，
+# 共 capacity 行，写满后覆盖最旧的一行；占用的内存在创建时就固定了，可用于滚屏重绘和回看历史。
+from array import array
+
+
+class LineStore:
+    def __init__(self, capacity=16, max_chars=20):
+        """
+        初始化行存储
+
+        参数:
+            capacity: 保存的行数（含屏幕上可见的行和可回看的历史）
+            max_chars: 每行最多的字数，超出的字不保存
+        """
+        self.capacity = capacity
+        self.max_chars = max_chars
+        size = capacity * max_chars
+        self._codes = array('H', bytes(size * 2))  # 码位，超出 BMP 的字存为 '?'
+        self._colors = array('H', bytes(size * 2))
+        self._xs = array('H', bytes(size * 2))  # 每个字在行内的 x 坐标，宽于 255 像素的屏幕也不截断
+        self._lens = bytearray(capacity)
+        self._newest = 0  # 最新一行所在的槽位
+        self.count = 0  # 已保存的行数
+
+    def nbytes(self):
+        """占用的内存(字节)"""
+        return self.capacity * self.max_chars * 6 + self.capacity
+
+    def clear(self):
+        """清空所有行，并开始新的一行"""
+        self.count = 0
+        self.new_line()
+
+    def new_line(self):
+        """开始新的一行，已满时覆盖最旧的一行"""
+        if self.count:
+            self._newest = (self._newest + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+        self._lens[self._newest] = 0
+
+    def append(self, char, x, color):
+        """向最新一行追加一个字"""
+        if not self.count:
+            self.new_line()
+        slot = self._newest
+        n = self._lens[slot]
+        if n >= self.max_chars:
+            return
+        i = slot * self.max_chars + n
+        code = ord(char)
+        self._codes[i] = code if code < 0x10000 else 0x3F
+        self._xs[i] = x
+        self._colors[i] = color
+        self._lens[slot] = n + 1
+
+    def chars(self, back):
+        """
+        逐个取出一行的字
+
+        参数:
+            back: 第几新的行，0 为最新一行
+        返回:
+            (字符, x, 颜色) 的生成器
+        """
+        if back >= self.count:
+            return
+        slot = (self._newest - back) % self.capacity
+        start = slot * self.max_chars
+        for i in range(start, start + self._lens[slot]):
+            yield chr(self._codes[i]), self._xs[i], self._colors[i]
+
+    def text(self, back):
+        """一行的文本内容"""
+        return ''.join(char for char, _, _ in self.chars(back))
@@ -0,0 +1,108 @@
+# 帧率受限的渲染调度器，TextDisplay 和 ScreenManager 共用
+#
+# 绘制操作先排队，update() 只执行已经到期的操作：打字机效果按经过的时间推进，不在调用方线程里 sleep；
+# 一帧内的多次刷新请求合并成一次 show()，刷新频率不超过 fps，每次 update() 最多执行 max_ops 个操作。
+# 文字再多，每帧的 CPU 和 SPI 开销也有上限。
+import time
+
+
+class RenderScheduler:
+    def __init__(self, show, fps=20, max_ops=32):
+        """
+        初始化调度器
+
+        参数:
+            show: 刷新屏幕的函数，如 EasyDisplay.show
+            fps: 最高刷新率
+            max_ops: 每次 update() 最多执行的绘制操作数
+        """
+        self._show = show
+        self.frame_ms = 1000 // fps
+        self.max_ops = max_ops
+        self._ops = []  # (距上一个操作的延时ms, 函数, 参数)
+        self._head = 0
+        self._due = time.ticks_ms()  # 上一个操作的执行时间，下一个操作在它之后 delay 毫秒到期
+        self._last_show = time.ticks_add(self._due, -self.frame_ms)
+        self._dirty = False
+        self.frames = 0  # 实际刷新的帧数
+
+    def add(self, delay_ms, fn, *args):
+        """排入一个绘制操作，在上一个操作之后 delay_ms 毫秒执行"""
+        if self._head >= len(self._ops):  # 队列已空，延时从现在算起
+            self._ops = []
+            self._head = 0
+            now = time.ticks_ms()
+            if time.ticks_diff(now, self._due) > 0:
+                self._due = now
+        self._ops.append((delay_ms, fn, args))
+
+    def request(self):
+        """请求在下一帧刷新屏幕"""
+        self._dirty = True
+
+    def pending(self):
+        """排队中的操作数"""
+        return len(self._ops) - self._head
+
+    def update(self):
+        """
+        执行到期的操作，距上次刷新满一帧时刷新屏幕；不阻塞
+
+        返回:
+            是否还有未完成的操作或未刷新的内容
+        """
+        now = time.ticks_ms()
+        ops = self._ops
+        n = 0
+        while self._head < len(ops) and n < self.max_ops:
+            delay_ms, fn, args = ops[self._head]
+            due = time.ticks_add(self._due, delay_ms)
+            if time.ticks_diff(due, now) > 0:
+                break
+            self._due = due
+            self._head += 1
+            fn(*args)
+            self._dirty = True
+            n += 1
+        if self._dirty and time.ticks_diff(now, self._last_show) >= self.frame_ms:
+            self._flip(now)
+        return self._head < len(ops) or self._dirty
+
+    def _flip(self, now):
+        self._show()
+        self._dirty = False
+        self._last_show = now
+        self.frames += 1
+
+    def flush(self):
+        """立即执行所有排队的操作（跳过打字机延时）并刷新一次"""
+        ops = self._ops
+        while self._head < len(ops):
+            _, fn, args = ops[self._head]
+            self._head += 1
+            fn(*args)
+            self._dirty = True
+        self._ops = []
+        self._head = 0
+        now = time.ticks_ms()
+        self._due = now
+        if self._dirty:
+            self._flip(now)
+
+    def _idle_ms(self):
+        """距下一个操作到期或下一帧可以刷新还有多久(ms)"""
+        now = time.ticks_ms()
+        wait = 1000
+        if self._head < len(self._ops):
+            due = time.ticks_add(self._due, self._ops[self._head][0])
+            wait = time.ticks_diff(due, now)
+        if self._dirty:
+            wait = min(wait, time.ticks_diff(time.ticks_add(self._last_show, self.frame_ms), now))
+        return wait
+
+    def wait(self):
+        """阻塞直到所有操作执行完并刷新；两次 update() 之间睡到下一个事件，而不是每个字睡一次"""
+        while self.update():
+            idle = self._idle_ms()
+            if idle > 0:
+                time.sleep_ms(idle)
@@ -1,5 +1,8 @@
 # MicroPython SSD1306 OLED driver, I2C and SPI interfaces
 # https://github.com/micropython/micropython/blob/master/drivers/display/ssd1306.py
+#
+# 在原驱动的基础上按页(8 行)记录被修改的列范围，show() 只写入修改过的页和列，
+# 一个 16x16 的字只需写 2 页 x 16 列 = 32 字节，而整屏为 1KB。
 from micropython import const
 import framebuf
 
@@ -33,6 +36,10 @@ class SSD1306(framebuf.FrameBuffer):
         self.external_vcc = external_vcc
         self.pages = self.height // 8
         self.buffer = bytearray(self.pages * self.width)
+        self._buf_mv = memoryview(self.buffer)
+        # 每页被修改的列范围 [_col0, _col1)，_col0 >= _col1 表示该页未修改
+        self._col0 = bytearray([self.width] * self.pages)
+        self._col1 = bytearray(self.pages)
         super().__init__(self.buffer, self.width, self.height, framebuf.MONO_VLSB)
         self.init_display()
 
@@ -92,21 +99,120 @@ class SSD1306(framebuf.FrameBuffer):
         self.write_cmd(SET_COM_OUT_DIR | ((rotate & 1) << 3))
         self.write_cmd(SET_SEG_REMAP | (rotate & 1))
 
-    def show(self):
-        x0 = 0
-        x1 = self.width - 1
-        if self.width != 128:
-            # narrow displays use centred columns
-            col_offset = (128 - self.width) // 2
-            x0 += col_offset
-            x1 += col_offset
+    def damage(self, x, y, w, h):
+        """标记被修改的区域，记录到所在页的列范围"""
+        x0 = x if x > 0 else 0
+        y0 = y if y > 0 else 0
+        x1 = x + w if x + w < self.width else self.width
+        y1 = y + h if y + h < self.height else self.height
+        if x0 >= x1 or y0 >= y1:
+            return
+        col0 = self._col0
+        col1 = self._col1
+        for page in range(y0 >> 3, ((y1 - 1) >> 3) + 1):
+            if x0 < col0[page]:
+                col0[page] = x0
+            if x1 > col1[page]:
+                col1[page] = x1
+
+    def damage_all(self):
+        """标记整个屏幕需要刷新"""
+        for page in range(self.pages):
+            self._col0[page] = 0
+            self._col1[page] = self.width
+
+    def fill(self, c):
+        super().fill(c)
+        self.damage_all()
+
+    def pixel(self, x, y, c=None):
+        if c is None:
+            return super().pixel(x, y)
+        super().pixel(x, y, c)
+        self.damage(x, y, 1, 1)
+
+    def hline(self, x, y, w, c):
+        super().hline(x, y, w, c)
+        self.damage(x, y, w, 1)
+
+    def vline(self, x, y, h, c):
+        super().vline(x, y, h, c)
+        self.damage(x, y, 1, h)
+
+    def line(self, x1, y1, x2, y2, c):
+        super().line(x1, y1, x2, y2, c)
+        self.damage(min(x1, x2), min(y1, y2), abs(x2 - x1) + 1, abs(y2 - y1) + 1)
+
+    def rect(self, x, y, w, h, c, f=False):
+        super().rect(x, y, w, h, c, f)
+        self.damage(x, y, w, h)
+
+    def fill_rect(self, x, y, w, h, c):
+        super().fill_rect(x, y, w, h, c)
+        self.damage(x, y, w, h)
+
+    def ellipse(self, x, y, xr, yr, c, f=False, m=15):
+        super().ellipse(x, y, xr, yr, c, f, m)
+        self.damage(x - xr, y - yr, xr * 2 + 1, yr * 2 + 1)
+
+    def poly(self, x, y, coords, c, f=False):
+        super().poly(x, y, coords, c, f)
+        self.damage_all()
+
+    def text(self, s, x, y, c=1):
+        super().text(s, x, y, c)
+        self.damage(x, y, len(s) * 8, 8)
+
+    def scroll(self, xstep, ystep):
+        super().scroll(xstep, ystep)
+        self.damage_all()
+
+    def blit(self, fbuf, x, y, key=-1, palette=None, w=0, h=0):
+        """w, h 为源图像尺寸，用于记录修改区域；为 0 时按 (x, y) 到屏幕右下角计算"""
+        super().blit(fbuf, x, y, key, palette)
+        self.damage(x, y, w or self.width - x, h or self.height - y)
+
+    def _set_window(self, x0, x1, page0, page1):
         self.write_cmd(SET_COL_ADDR)
         self.write_cmd(x0)
         self.write_cmd(x1)
         self.write_cmd(SET_PAGE_ADDR)
-        self.write_cmd(0)
-        self.write_cmd(self.pages - 1)
-        self.write_data(self.buffer)
+        self.write_cmd(page0)
+        self.write_cmd(page1)
+
+    def show(self):
+        """只写入修改过的页和列；连续的整页一次写入，其余逐页写入对应的列"""
+        # narrow displays use centred columns
+        col_offset = (128 - self.width) // 2 if self.width != 128 else 0
+        col0 = self._col0
+        col1 = self._col1
+        width = self.width
+        mv = self._buf_mv
+        page = 0
+        while page < self.pages:
+            x0 = col0[page]
+            x1 = col1[page]
+            if x0 >= x1:
+                page += 1
+                continue
+            end = page + 1
+            if x0 == 0 and x1 == width:
+                while end < self.pages and col0[end] == 0 and col1[end] == width:
+                    end += 1
+            self._set_window(x0 + col_offset, x1 - 1 + col_offset, page, end - 1)
+            if end - page > 1:
+                self.write_data(mv[page * width:end * width])
+            else:
+                self.write_data(mv[page * width + x0:page * width + x1])
+            for p in range(page, end):
+                col0[p] = width
+                col1[p] = 0
+            page = end
+
+    def show_all(self):
+        """写入整个帧缓冲区"""
+        self.damage_all()
+        self.show()
 
     def clear(self):
         self.fill(0)
@@ -118,6 +224,10 @@ class SSD1306_I2C(SSD1306):
         self.addr = addr
         self.temp = bytearray(2)
         self.write_list = [b"\x40", None]  # Co=0, D/C#=1
+        self._window = bytearray(7)  # 设置显示窗口的 6 个命令在一次 I2C 传输中发送
+        self._window[0] = 0x00  # Co=0, D/C#=0
+        self._window[1] = SET_COL_ADDR
+        self._window[4] = SET_PAGE_ADDR
         super().__init__(width, height, external_vcc)
 
     def write_cmd(self, cmd):
@@ -129,6 +239,14 @@ class SSD1306_I2C(SSD1306):
         self.write_list[1] = buf
         self.i2c.writevto(self.addr, self.write_list)
 
+    def _set_window(self, x0, x1, page0, page1):
+        window = self._window
+        window[2] = x0
+        window[3] = x1
+        window[5] = page0
+        window[6] = page1
+        self.i2c.writeto(self.addr, window)
+
 
 class SSD1306_SPI(SSD1306):
     def __init__(self, width, height, spi, dc, res, cs, external_vcc=False):
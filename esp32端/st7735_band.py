@@ -0,0 +1,300 @@
+# 低内存的 ST7735 驱动：只保留一条若干行高的帧缓冲区（条带/tile），绘制时按需移动并流式发送到屏幕
+#
+# st7735_buf.ST7735 为整屏分配帧缓冲区，160x80 RGB565 就是 25.6KB，在同时运行 WiFi、I2S 和语音客户端的
+# ESP32-C3 上占了可用堆的一大块，内存不足时只能 machine.reset()。这里的 ST7735Band 只分配 band_rows 行
+# （默认 16 行，一行文字，160 像素宽为 5KB），接口与 ST7735 相同，EasyDisplay/TextDisplay 可直接使用：
+#   - 绘图方法使用屏幕坐标；目标区域在当前条带内时直接画，否则先把修改过的区域发送到屏幕，再把条带移过去
+#     （按条带高度对齐，与原位置重叠的行保留），跨越多个条带的图形逐条带绘制
+#   - fill() 不经过条带，直接把颜色流式写满整屏，之后条带移入的空白行也用这个颜色填充
+#   - 屏幕内容无法读回，条带移动后条带外原有的像素在缓冲区中视为背景色：不透明的字形、位图和填充不受影响，
+#     带透明色(key)叠加在其他图形上的绘制会看到背景色而不是原来的图形
+#   - 屏幕上的内容无法整屏移动：scroll() 只清成背景色，由调用方重绘；TextDisplay/ScreenManager 检查
+#     partial_frame，竖屏时用硬件滚动(vscroll_*)，横屏时直接按行存储重绘
+import framebuf
+from st7735_buf import ST7735
+
+_fb = framebuf.FrameBuffer
+
+
+class ST7735Band(ST7735):
+    partial_frame = True  # 帧缓冲区只覆盖屏幕的一部分，TextDisplay 据此不使用整屏 scroll
+
+    def __init__(self, width: int, height: int, spi, res: int, dc: int,
+                 cs: int = None, bl: int = None, rotate: int = 0, rgb: bool = True, invert: bool = True,
+                 band_rows: int = 16):
+        """
+        初始化屏幕驱动
+
+        Args:
+            width: 宽度
+            height: 高度
+            spi: SPI 实例
+            res: RESET 引脚
+            dc: Data / Command 引脚
+            cs: 片选引脚
+            bl: 背光引脚
+            rotate: 旋转图像，数值为 0-6
+            rgb: 使用 RGB 颜色模式，而不是 BGR
+            invert: 反转颜色
+            band_rows: 条带的行数，取文字行高时每行文字只占一个条带
+        """
+        self.band_rows = band_rows
+        self.band_y = 0
+        self._bg = 0  # 条带移入的空白行的颜色，即最近一次 fill() 的颜色
+        super().__init__(width, height, spi, res, dc, cs, bl, rotate, rgb, invert)
+
+    def _init_buffer(self):
+        """只分配一条条带，旋转后宽度会变，按长边计算"""
+        self.buffer = bytearray(max(self.width, self.height) * self.band_rows * 2)
+        self._buf_mv = memoryview(self.buffer)
+
+    def _init_framebuffer(self, rows=None):
+        super()._init_framebuffer(min(self.band_rows, self.height))
+        self.band_y = 0
+        _fb.fill(self, self._bg)
+
+    def nbytes(self):
+        """帧缓冲区占用的内存(字节)"""
+        return len(self.buffer)
+
+    def _rows(self):
+        return self.band_rows if self.band_rows < self.height else self.height
+
+    def _move(self, y):
+        """把条带移到包含屏幕第 y 行的位置，移动前发送修改过的区域"""
+        rows = self._rows()
+        top = y - y % rows
+        if top + rows > self.height:
+            top = self.height - rows
+        delta = self.band_y - top
+        if not delta:
+            return
+        self.show()
+        if -rows < delta < rows:  # 与原位置重叠的行保留，其余填背景色
+            _fb.scroll(self, 0, delta)
+            if delta > 0:
+                _fb.fill_rect(self, 0, 0, self.width, delta, self._bg)
+            else:
+                _fb.fill_rect(self, 0, rows + delta, self.width, -delta, self._bg)
+        else:
+            _fb.fill(self, self._bg)
+        self.band_y = top
+
+    def _inside(self, y, h):
+        """[y, y+h) 行是否在条带内；在一个条带高度以内时先把条带移过去"""
+        by = self.band_y
+        rows = self._rows()
+        if by <= y and y + h <= by + rows:
+            return True
+        if h <= rows and y >= 0 and y % rows + h <= rows:
+            self._move(y)
+            return True
+        return False
+
+    def _span(self, x, y, w, h, draw):
+        """逐条带执行跨越多个条带的绘制，draw(dy) 以 y 减 dy 的坐标在条带中绘制"""
+        y0 = y if y > 0 else 0
+        y1 = y + h if y + h < self.height else self.height
+        start = y0
+        while start < y1:
+            self._move(start)
+            draw(self.band_y)
+            self.damage(x, y, w, h)
+            start = self.band_y + self._rows()
+
+    def damage(self, x, y, w, h):
+        """
+        标记被修改的区域（屏幕坐标），只记录落在当前条带内的部分
+
+        Args:
+            x: 左上角 x 坐标
+            y: 左上角 y 坐标
+            w: 宽度
+            h: 高度
+        """
+        y -= self.band_y
+        rows = self._rows()
+        if y < 0:
+            h += y
+            y = 0
+        if y + h > rows:
+            h = rows - y
+        if h > 0:
+            super().damage(x, y, w, h)
+
+    def damage_all(self):
+        """标记整个条带需要刷新（条带外的屏幕内容不在内存中）"""
+        self._dx0 = self._dy0 = 0
+        self._dx1 = self.width
+        self._dy1 = self._rows()
+
+    def fill(self, c):
+        """用颜色 c 填满整屏：条带填好后重复发送，不经过脏矩形"""
+        self._bg = c
+        self._dx0 = self._dy0 = self._dx1 = self._dy1 = 0
+        _fb.fill(self, c)
+        rows = self._rows()
+        stride = self.width * 2
+        mv = self._buf_mv
+        self.set_window(0, 0, self.width - 1, self.height - 1)
+        self.cs(0)
+        self.dc(1)
+        left = self.height
+        while left > 0:
+            n = rows if left > rows else left
+            self.spi.write(mv[:n * stride])
+            left -= n
+        self.cs(1)
+
+    def pixel(self, x, y, c=None):
+        by = self.band_y
+        if c is None:  # 条带外的像素无法读回
+            return _fb.pixel(self, x, y - by) if by <= y < by + self._rows() else self._bg
+        if self._inside(y, 1):
+            _fb.pixel(self, x, y - self.band_y, c)
+            self.damage(x, y, 1, 1)
+
+    def hline(self, x, y, w, c):
+        if self._inside(y, 1):
+            _fb.hline(self, x, y - self.band_y, w, c)
+            self.damage(x, y, w, 1)
+
+    def vline(self, x, y, h, c):
+        if self._inside(y, h):
+            _fb.vline(self, x, y - self.band_y, h, c)
+            self.damage(x, y, 1, h)
+        else:
+            self._span(x, y, 1, h, lambda dy: _fb.vline(self, x, y - dy, h, c))
+
+    def line(self, x1, y1, x2, y2, c):
+        x = min(x1, x2)
+        y = min(y1, y2)
+        w = abs(x2 - x1) + 1
+        h = abs(y2 - y1) + 1
+        if self._inside(y, h):
+            by = self.band_y
+            _fb.line(self, x1, y1 - by, x2, y2 - by, c)
+            self.damage(x, y, w, h)
+        else:
+            self._span(x, y, w, h, lambda dy: _fb.line(self, x1, y1 - dy, x2, y2 - dy, c))
+
+    def rect(self, x, y, w, h, c, f=False):
+        if self._inside(y, h):
+            _fb.rect(self, x, y - self.band_y, w, h, c, f)
+            self.damage(x, y, w, h)
+        else:
+            self._span(x, y, w, h, lambda dy: _fb.rect(self, x, y - dy, w, h, c, f))
+
+    def fill_rect(self, x, y, w, h, c):
+        if self._inside(y, h):
+            _fb.fill_rect(self, x, y - self.band_y, w, h, c)
+            self.damage(x, y, w, h)
+        else:
+            self._span(x, y, w, h, lambda dy: _fb.fill_rect(self, x, y - dy, w, h, c))
+
+    def ellipse(self, x, y, xr, yr, c, f=False, m=15):
+        if self._inside(y - yr, yr * 2 + 1):
+            _fb.ellipse(self, x, y - self.band_y, xr, yr, c, f, m)
+            self.damage(x - xr, y - yr, xr * 2 + 1, yr * 2 + 1)
+        else:
+            self._span(x - xr, y - yr, xr * 2 + 1, yr * 2 + 1,
+                       lambda dy: _fb.ellipse(self, x, y - dy, xr, yr, c, f, m))
+
+    def poly(self, x, y, coords, c, f=False):
+        y0 = y1 = coords[1]
+        for i in range(3, len(coords), 2):
+            if coords[i] < y0:
+                y0 = coords[i]
+            elif coords[i] > y1:
+                y1 = coords[i]
+        self._span(0, y + y0, self.width, y1 - y0 + 1, lambda dy: _fb.poly(self, x, y - dy, coords, c, f))
+
+    def text(self, s, x, y, c=1):
+        if self._inside(y, 8):
+            _fb.text(self, s, x, y - self.band_y, c)
+            self.damage(x, y, len(s) * 8, 8)
+        else:
+            self._span(x, y, len(s) * 8, 8, lambda dy: _fb.text(self, s, x, y - dy, c))
+
+    def scroll(self, xstep, ystep):
+        """
+        条带外的内容不在内存中，无法移动：整屏清成背景色，由调用方重绘滚动后的内容
+
+        TextDisplay/ScreenManager 检查 partial_frame，不调用本方法
+        """
+        if xstep or ystep:
+            self.fill(self._bg)
+
+    def blit(self, fbuf, x, y, key=-1, palette=None, w=0, h=0):
+        """
+        把另一个 FrameBuffer 绘制到屏幕上
+
+        Args:
+            w: 源图像宽度；为 0 时按 (x, y) 到屏幕右边计算
+            h: 源图像高度；为 0 时按到屏幕底部计算（会逐条带绘制到底部）
+        """
+        w = w or self.width - x
+        h = h or self.height - y
+        if self._inside(y, h):
+            _fb.blit(self, fbuf, x, y - self.band_y, key, palette)
+            self.damage(x, y, w, h)
+        else:
+            self._span(x, y, w, h, lambda dy: _fb.blit(self, fbuf, x, y - dy, key, palette))
+
+
+def bench(spi, width=160, height=80, cs=6, dc=3, res=2, bl=1, rotate=3, band_rows=16,
+          font="text_lite_16px_2312.v3.bmf", text="小智你好，今天天气怎么样？"):
+    """
+    对比整屏帧缓冲区与条带缓冲区的内存占用和刷新速度
+
+    依次创建两种驱动，记录创建前后 gc.mem_free() 的差值，并计时：整屏清屏、逐字显示一行文字（每字刷新一次）、
+    按行重绘整屏文字（横屏滚动一行时 TextDisplay 的做法）
+
+    Args:
+        spi: SPI 实例
+        band_rows: 条带的行数
+        font: 字体文件
+        text: 测试文本
+    """
+    import gc
+    import time
+    from machine import Pin
+    from easydisplay import EasyDisplay
+    results = []
+    for name in ("整屏", "条带"):
+        gc.collect()
+        free = gc.mem_free()
+        if name == "整屏":
+            dp = ST7735(width, height, spi, Pin(res), Pin(dc), Pin(cs), Pin(bl), rotate, False, False)
+        else:
+            dp = ST7735Band(width, height, spi, Pin(res), Pin(dc), Pin(cs), Pin(bl), rotate, False, False,
+                            band_rows)
+        gc.collect()
+        used = free - gc.mem_free()
+        ed = EasyDisplay(dp, "RGB565", font=font, show=False, clear=False)
+        size = ed.font_size
+        per_line = dp.width // size
+
+        t = time.ticks_us()
+        dp.fill(0)
+        dp.show()
+        fill_us = time.ticks_diff(time.ticks_us(), t)
+
+        t = time.ticks_us()
+        for i, char in enumerate(text[:per_line]):
+            ed.text(char, i * size, 0, show=False)
+            dp.show()
+        char_us = time.ticks_diff(time.ticks_us(), t) // max(1, min(len(text), per_line))
+
+        t = time.ticks_us()
+        dp.fill(0)
+        for row in range(dp.height // size):
+            ed.text(text[:per_line], 0, row * size, show=False)
+        dp.show()
+        redraw_us = time.ticks_diff(time.ticks_us(), t)
+
+        results.append((name, used, fill_us, char_us, redraw_us))
+        del ed, dp
+    for name, used, fill_us, char_us, redraw_us in results:
+        print("{}: 占用 {} 字节, 清屏 {}us, 每字 {}us, 重绘整屏 {}us".format(name, used, fill_us, char_us, redraw_us))
+    return results
@@ -30,7 +30,9 @@ RASET = const(0x2B)
 RAMWR = const(0x2C)
 RAMRD = const(0x2E)
 
+VSCRDEF = const(0x33)
 MADCTL = const(0x36)
+VSCSAD = const(0x37)
 COLMOD = const(0x3A)
 
 FRMCTR1 = const(0xB1)
@@ -61,6 +63,7 @@ _ENCODE_POS = ">HH"
 _DECODE_PIXEL = ">BBB"
 
 _BUFFER_SIZE = const(256)
+_GRAM_ROWS = const(162)  # 控制器显存的行数（垂直滚动方向）
 
 GMCTRP1 = const(0xE0)
 GMCTRN1 = const(0xE1)
@@ -114,6 +117,8 @@ def _encode_pixel(c):
 
 
 class ST7735(framebuf.FrameBuffer):
+    band_y = 0  # 帧缓冲区第 0 行对应的屏幕行（整屏缓冲区为 0，条带缓冲区见 st7735_band.py）
+
     def __init__(self, width: int, height: int, spi, res: int, dc: int,
                  cs: int = None, bl: int = None, rotate: int = 0, rgb: bool = True, invert: bool = True):
         """
@@ -169,7 +174,10 @@ class ST7735(framebuf.FrameBuffer):
         self._write(COLMOD, bytearray([0x05]))  # color mode
         sleep_ms(50)
         gc.collect()  # 垃圾收集
-        self.buffer = bytearray(self.height * self.width * 2)
+        self._init_buffer()
+        # 脏矩形 [x0, x1) x [y0, y1)：绘图方法记录被修改的区域，show() 只发送这一块
+        self._dx0 = self._dy0 = 0
+        self._dx1 = self._dy1 = 0
         self.rotate(self._rotate)
         self.invert(invert)
         sleep_ms(10)
@@ -187,6 +195,20 @@ class ST7735(framebuf.FrameBuffer):
         self.clear()
         self.show()
 
+    def _init_buffer(self):
+        """分配整屏帧缓冲区"""
+        self.buffer = bytearray(self.height * self.width * 2)
+        self._buf_mv = memoryview(self.buffer)
+
+    def _init_framebuffer(self, rows=None):
+        """
+        按当前方向初始化 FrameBuffer
+
+        Args:
+            rows: 帧缓冲区的行数，默认为整屏
+        """
+        super().__init__(self.buffer, self.width, rows or self.height, framebuf.RGB565, self.width)
+
     def _write(self, command=None, data=None):
         """SPI write to the device: commands and data."""
         self.cs(0)
@@ -291,8 +313,9 @@ class ST7735(framebuf.FrameBuffer):
             )
 
         self.width, self.height, self.x_start, self.y_start = table[rotate]
-        super().__init__(self.buffer, self.width, self.height, framebuf.RGB565, self.width)
+        self._init_framebuffer()
         self._write(MADCTL, bytes([madctl | (0x00 if self._rgb else 0x08)]))
+        self.damage_all()
 
     def _set_columns(self, start, end):
         """
@@ -333,18 +356,164 @@ class ST7735(framebuf.FrameBuffer):
             self._set_rows(y0, y1)
             self._write(RAMWR)
 
+    def vscroll_supported(self):
+        """
+        当前旋转方向能否使用硬件垂直滚动
+
+        硬件滚动沿显存的行方向进行，只有行交换(MV)和行翻转(MY)都未开启的竖屏方向（rotate 0 / 4）
+        上下滚动才与屏幕的上下一致
+        """
+        return ROTATIONS[self._rotate] & 0xA0 == 0
+
+    def vscroll_define(self, top=0, bottom=0):
+        """
+        定义硬件垂直滚动区域
+
+        Args:
+            top: 顶部固定区域的行数
+            bottom: 底部固定区域的行数
+        """
+        top += self.y_start
+        area = self.height - (top - self.y_start) - bottom
+        self._write(VSCRDEF, pack(">HHH", top, area, _GRAM_ROWS - top - area))
+
+    def vscroll_start(self, line):
+        """
+        设置滚动区域从帧缓冲区的哪一行开始显示，只写一个寄存器，不传输像素
+
+        Args:
+            line: 帧缓冲区中显示在滚动区域顶部的行
+        """
+        self._write(VSCSAD, pack(">H", line + self.y_start))
+
     def clear(self):
         """
         清屏
         """
         self.fill(0)
 
+    def damage(self, x, y, w, h):
+        """
+        标记帧缓冲区中被修改的区域，与已有的脏矩形合并
+
+        Args:
+            x: 左上角 x 坐标
+            y: 左上角 y 坐标
+            w: 宽度
+            h: 高度
+        """
+        x0 = x if x > 0 else 0
+        y0 = y if y > 0 else 0
+        x1 = x + w if x + w < self.width else self.width
+        y1 = y + h if y + h < self.height else self.height
+        if x0 >= x1 or y0 >= y1:
+            return
+        if self._dx1 <= self._dx0:  # 原来没有脏区域
+            self._dx0, self._dy0, self._dx1, self._dy1 = x0, y0, x1, y1
+            return
+        if x0 < self._dx0:
+            self._dx0 = x0
+        if y0 < self._dy0:
+            self._dy0 = y0
+        if x1 > self._dx1:
+            self._dx1 = x1
+        if y1 > self._dy1:
+            self._dy1 = y1
+
+    def damage_all(self):
+        """标记整个屏幕需要刷新"""
+        self._dx0 = self._dy0 = 0
+        self._dx1 = self.width
+        self._dy1 = self.height
+
+    def fill(self, c):
+        super().fill(c)
+        self.damage_all()
+
+    def pixel(self, x, y, c=None):
+        if c is None:
+            return super().pixel(x, y)
+        super().pixel(x, y, c)
+        self.damage(x, y, 1, 1)
+
+    def hline(self, x, y, w, c):
+        super().hline(x, y, w, c)
+        self.damage(x, y, w, 1)
+
+    def vline(self, x, y, h, c):
+        super().vline(x, y, h, c)
+        self.damage(x, y, 1, h)
+
+    def line(self, x1, y1, x2, y2, c):
+        super().line(x1, y1, x2, y2, c)
+        self.damage(min(x1, x2), min(y1, y2), abs(x2 - x1) + 1, abs(y2 - y1) + 1)
+
+    def rect(self, x, y, w, h, c, f=False):
+        super().rect(x, y, w, h, c, f)
+        self.damage(x, y, w, h)
+
+    def fill_rect(self, x, y, w, h, c):
+        super().fill_rect(x, y, w, h, c)
+        self.damage(x, y, w, h)
+
+    def ellipse(self, x, y, xr, yr, c, f=False, m=15):
+        super().ellipse(x, y, xr, yr, c, f, m)
+        self.damage(x - xr, y - yr, xr * 2 + 1, yr * 2 + 1)
+
+    def poly(self, x, y, coords, c, f=False):
+        super().poly(x, y, coords, c, f)
+        self.damage_all()
+
+    def text(self, s, x, y, c=1):
+        super().text(s, x, y, c)
+        self.damage(x, y, len(s) * 8, 8)
+
+    def scroll(self, xstep, ystep):
+        super().scroll(xstep, ystep)
+        self.damage_all()
+
+    def blit(self, fbuf, x, y, key=-1, palette=None, w=0, h=0):
+        """
+        把另一个 FrameBuffer 绘制到帧缓冲区
+
+        Args:
+            w: 源图像宽度，用于记录脏矩形；为 0 时（FrameBuffer 无法取得尺寸）按 (x, y) 到屏幕右下角计算
+            h: 源图像高度
+        """
+        super().blit(fbuf, x, y, key, palette)
+        self.damage(x, y, w or self.width - x, h or self.height - y)
+
     def show(self):
         """
-        将帧缓冲区数据发送到屏幕
+        将帧缓冲区中被修改的区域发送到屏幕，没有修改时不发送
+
+        整行宽度的区域在缓冲区中是连续的，一次发送；否则逐行发送缓冲区切片，均不复制数据
         """
-        self.set_window(0, 0, self.width - 1, self.height - 1)
-        self._write(RAMWR, self.buffer)
+        x0, y0, x1, y1 = self._dx0, self._dy0, self._dx1, self._dy1
+        if x1 <= x0:
+            return
+        self._dx0 = self._dy0 = self._dx1 = self._dy1 = 0
+        by = self.band_y
+        self.set_window(x0, y0 + by, x1 - 1, y1 - 1 + by)
+        mv = self._buf_mv
+        stride = self.width * 2
+        self.cs(0)
+        self.dc(1)
+        if x0 == 0 and x1 == self.width:
+            self.spi.write(mv[y0 * stride:y1 * stride])
+        else:
+            n = (x1 - x0) * 2
+            start = y0 * stride + x0 * 2
+            write = self.spi.write
+            for _ in range(y1 - y0):
+                write(mv[start:start + n])
+                start += stride
+        self.cs(1)
+
+    def show_all(self):
+        """将整个帧缓冲区发送到屏幕"""
+        self.damage_all()
+        self.show()
 
     # @staticmethod
     # def color(r, g, b):
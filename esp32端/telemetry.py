@@ -0,0 +1,128 @@
+# 设备遥测：定期把运行状态打包成二进制控制帧发给服务器
+#   mem_free / largest_free : GC 堆剩余内存 / IDF 堆最大空闲块（碎片化程度）
+#   loop_avg_us / loop_max_us : 录音循环每帧的平均/最大耗时
+#   late_frames  : 耗时超过一帧时长的次数（I2S 读取不及时，可能丢音）
+#   gc_max_ms    : 最长的一次 gc.collect 耗时
+#   underruns / overruns : 播放欠载/溢出累计次数
+#   reconnects   : 重连次数
+#   rssi         : WiFi 信号强度(dBm)
+# 计数只做整数加法和比较，不分配内存；打包时写入预分配的缓冲区。
+import gc
+import time
+import ustruct as struct
+from xiaozhi_protocol import CTRL_FLAG, FRAME_TELEMETRY, TELEMETRY_FORMAT
+
+try:
+    import esp32
+except ImportError:
+    esp32 = None
+
+
+def largest_free_block():
+    """IDF 数据堆中最大的连续空闲块，不支持时返回 0"""
+    if esp32 is None:
+        return 0
+    try:
+        return max(info[2] for info in esp32.idf_heap_info(esp32.HEAP_DATA))
+    except (AttributeError, ValueError):
+        return 0
+
+
+def wifi_rssi():
+    """当前 WiFi 信号强度，未连接时返回 0"""
+    import network
+    sta_if = network.WLAN(network.STA_IF)
+    try:
+        return sta_if.status('rssi') if sta_if.isconnected() else 0
+    except (OSError, ValueError):
+        return 0
+
+
+class Telemetry:
+    def __init__(self, frame_ms, interval_s=60):
+        """
+        初始化遥测
+
+        参数:
+            frame_ms: 录音帧时长(ms)，循环耗时超过它计为一次 late_frames
+            interval_s: 上报间隔(s)
+        """
+        self.frame_us = frame_ms * 1000
+        self.interval_ms = interval_s * 1000
+        # ticks_ms 约 12.4 天回绕一次，ticks_diff 只在一半范围内有效，运行时长不能直接用开机时刻相减：
+        # 每次检查时把两次之间经过的时间累加到秒数和余下的毫秒数里（都是小整数，不分配内存）
+        self._mark_ms = time.ticks_ms()
+        self.uptime_s = 0
+        self._uptime_rem_ms = 0
+        self._sent_ms = self._mark_ms
+        self._loop_start = 0
+        self._frame = bytearray(4 + 1 + struct.calcsize(TELEMETRY_FORMAT))
+        struct.pack_into('<I', self._frame, 0, CTRL_FLAG | (len(self._frame) - 4))
+        self._frame[4] = FRAME_TELEMETRY[0]
+        self.reconnects = 0
+        self.underruns = 0
+        self.overruns = 0
+        self.reset_window()
+
+    def reset_window(self):
+        """清零每个上报周期内的统计"""
+        self.loop_total_us = 0
+        self.loop_count = 0
+        self.loop_max_us = 0
+        self.late_frames = 0
+        self.gc_max_ms = 0
+
+    def loop_start(self):
+        self._loop_start = time.ticks_us()
+
+    def loop_end(self):
+        """一帧处理结束时调用"""
+        us = time.ticks_diff(time.ticks_us(), self._loop_start)
+        self.loop_total_us += us
+        self.loop_count += 1
+        if us > self.loop_max_us:
+            self.loop_max_us = us
+        if us > self.frame_us:
+            self.late_frames += 1
+
+    def collect(self):
+        """执行 gc.collect 并记录耗时"""
+        t = time.ticks_ms()
+        gc.collect()
+        ms = time.ticks_diff(time.ticks_ms(), t)
+        if ms > self.gc_max_ms:
+            self.gc_max_ms = ms
+
+    def add_playback(self, underruns, overruns):
+        """累计一轮播放的欠载/溢出次数"""
+        self.underruns += underruns
+        self.overruns += overruns
+
+    def _advance(self, now):
+        """累加上次调用以来经过的时间"""
+        ms = self._uptime_rem_ms + time.ticks_diff(now, self._mark_ms)
+        self._mark_ms = now
+        self.uptime_s += ms // 1000
+        self._uptime_rem_ms = ms % 1000
+
+    def due(self):
+        """是否到了上报时间"""
+        now = time.ticks_ms()
+        self._advance(now)
+        return time.ticks_diff(now, self._sent_ms) >= self.interval_ms
+
+    def frame(self):
+        """打包一个遥测控制帧，并开始新的统计周期"""
+        now = time.ticks_ms()
+        self._advance(now)
+        self._sent_ms = now
+        count = max(1, self.loop_count)
+        struct.pack_into(TELEMETRY_FORMAT, self._frame, 5,
+                         self.uptime_s,
+                         gc.mem_free(), largest_free_block(), wifi_rssi(),
+                         self.loop_total_us // count, self.loop_max_us,
+                         min(self.late_frames, 0xFFFF), min(self.gc_max_ms, 0xFFFF),
+                         min(self.underruns, 0xFFFF), min(self.overruns, 0xFFFF),
+                         min(self.reconnects, 0xFFFF))
+        self.reset_window()
+        return self._frame
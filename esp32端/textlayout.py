@@ -0,0 +1,210 @@
+# 文本排版：TextDisplay、ScreenManager 和 OLEDScroller 共用
+#
+# 原来三个类各自实现 is_chinese_char/get_char_width 和换行，每个字要调用好几次 ord()，
+# OLEDScroller 还按空格分词，中文里没有空格，整段话会被当成一个词。
+# 这里每个字只 ord() 一次：ASCII 的宽度和断行类别查预先算好的表，其余字符为全宽；
+# 一遍扫描得到每行的 (字, x) 列表，并按中文排版的禁则断行：
+#   - 。，、；：？！）」》等不出现在行首，（「《等不出现在行尾，需要时把前一个字一起移到下一行
+#   - 连续的英文字母、数字不从中间断开，在空格处换行；行首的空格丢弃
+#   - 单个词比一行还宽时按字断开
+# 宽度表按字号缓存，同一字号的字体共用。
+
+# ASCII 字符的断行类别
+_WORD = 1  # 英文字母、数字和符号，相邻的不断开
+_SPACE = 2  # 空格，可在其后断行，溢出或位于行首时丢弃
+_NO_START = 4  # 不出现在行首
+_NO_END = 8  # 不出现在行尾
+
+_ASCII_NO_START = ',.;:?!)]}%>'
+_ASCII_NO_END = '([{<$'
+# 全角标点
+_CJK_NO_START = frozenset(ord(c) for c in '，。、；：？！）」』》〉】〕”’…—～·％')
+_CJK_NO_END = frozenset(ord(c) for c in '（「『《〈【〔“‘￥')
+
+
+def _ascii_classes():
+    classes = bytearray(128)
+    for code in range(32, 127):
+        classes[code] = _WORD
+    classes[32] = _SPACE
+    for c in _ASCII_NO_START:
+        classes[ord(c)] |= _NO_START
+    for c in _ASCII_NO_END:
+        classes[ord(c)] |= _NO_END
+    return classes
+
+
+_ASCII_CLASSES = _ascii_classes()
+
+
+class TextLayout:
+    def __init__(self, font_size=16, half_char=True):
+        """
+        初始化排版器
+
+        参数:
+            font_size: 字号（全宽字符的宽度）
+            half_char: ASCII 字符是否半宽显示，与 EasyDisplay/BMFont 的 half_char 一致
+        """
+        self.font_size = font_size
+        self.half_char = half_char
+        # ASCII 宽度表，控制字符为 0（不显示）
+        half = font_size // 2 if half_char else font_size
+        widths = bytearray(128)
+        for code in range(32, 128):
+            widths[code] = half
+        self._widths = widths
+
+    def char_width(self, char):
+        """字符的前进宽度"""
+        code = ord(char)
+        return self._widths[code] if code < 128 else self.font_size
+
+    def layout(self, text, width, x=0):
+        """
+        按宽度排版，一遍扫描完成
+
+        参数:
+            text: 要排版的文本，'\\n' 为强制换行
+            width: 行宽(像素)
+            x: 第一行的起始 x 坐标（接着上次的行尾继续写时传入）
+        返回:
+            行的列表，每行为 ([(字, x), ...], 行宽)；第一行接在起始位置之后，之后每行都要另起一行
+        """
+        widths = self._widths
+        classes = _ASCII_CLASSES
+        full = self.font_size
+        lines = []
+        line = []
+        brk = -1  # 行内最后一个断行位置：可在 line[brk] 之前断开，-1 表示没有
+        brk_x = 0
+        prev = 0  # 前一个字的类别
+        wrapped = False  # 当前行由自动换行产生，行首的空格丢弃
+        for char in text:
+            code = ord(char)
+            if code == 10:  # '\n'
+                lines.append((line, x))
+                line = []
+                x = 0
+                brk = -1
+                prev = 0
+                wrapped = False
+                continue
+            if code < 128:
+                w = widths[code]
+                if not w:
+                    continue
+                cls = classes[code]
+                if cls & _SPACE and wrapped and not line:
+                    continue
+            else:
+                w = full
+                cls = _NO_START if code in _CJK_NO_START else _NO_END if code in _CJK_NO_END else 0
+            # 本字之前能否断行；接着上次的行尾写(x > 0)时第一行开头也可以断开，整个词移到下一行
+            if ((line or x) and not cls & (_NO_START | _SPACE) and not prev & _NO_END
+                    and not (prev & _WORD and cls & _WORD)):
+                brk = len(line)
+                brk_x = x
+            if x + w > width and x:
+                if cls & _SPACE:  # 溢出的空格丢弃
+                    lines.append((line, x))
+                    line = []
+                    x = 0
+                    brk = -1
+                    prev = 0
+                    wrapped = True
+                    continue
+                if brk >= 0:  # 在最后的断行位置断开，其后的字移到下一行
+                    carry = line[brk:]
+                    lines.append((line[:brk], brk_x))
+                    line = [(c, cx - brk_x) for c, cx in carry]
+                    x -= brk_x
+                    if x + w > width and x:  # 移下来的词仍然放不下，按字断开
+                        lines.append((line, x))
+                        line = []
+                        x = 0
+                else:
+                    lines.append((line, x))
+                    line = []
+                    x = 0
+                brk = -1
+                wrapped = True
+            line.append((char, x))
+            x += w
+            prev = cls
+        lines.append((line, x))
+        return lines
+
+
+_layouts = {}
+
+
+def get_layout(font_size=16, half_char=True):
+    """按字号取得共用的排版器（宽度表只建一次）"""
+    key = font_size << 1 | bool(half_char)
+    layout = _layouts.get(key)
+    if layout is None:
+        layout = _layouts[key] = TextLayout(font_size, half_char)
+    return layout
+
+
+def _legacy_layout(text, width):
+    """原来 TextDisplay 的排版方式，供 bench 对比"""
+    def is_chinese_char(char):
+        unicode_val = ord(char)
+        return (0x4E00 <= unicode_val <= 0x9FFF or
+                0x3400 <= unicode_val <= 0x4DBF or
+                0x20000 <= unicode_val <= 0x2A6DF)
+
+    def get_char_width(char):
+        if is_chinese_char(char):
+            return 16
+        elif 0x0000 <= ord(char) <= 0x007F:
+            return 8
+        return 8
+
+    lines = []
+    line = []
+    line_width = 0
+    for char in text:
+        if char == '\n':
+            lines.append(line)
+            line = []
+            line_width = 0
+            continue
+        char_width = get_char_width(char)
+        if line_width + char_width > width:
+            lines.append(line)
+            line = []
+            line_width = 0
+        line.append((char, line_width))
+        line_width += char_width
+    lines.append(line)
+    return lines
+
+
+def bench(width=160, length=500, repeat=5, font_size=16):
+    """
+    对比原来的逐字判断与查表排版一段回复所需的时间
+
+    参数:
+        width: 行宽(像素)
+        length: 回复的字数
+        repeat: 重复次数
+        font_size: 字号
+    """
+    import time
+    sample = ("好的，我来帮你查一下。今天北京晴，气温 12~23°C，空气质量良好（AQI 45）。"
+              "出门记得带上水杯！Have a nice day, XiaoZhi 会一直陪着你。\n")
+    text = (sample * (length // len(sample) + 1))[:length]
+    layout = get_layout(font_size)
+    results = []
+    for name, fn in (("逐字判断", _legacy_layout), ("查表排版", layout.layout)):
+        t = time.ticks_us()
+        for _ in range(repeat):
+            lines = fn(text, width)
+        us = time.ticks_diff(time.ticks_us(), t) // repeat
+        results.append((name, us, len(lines)))
+    for name, us, n in results:
+        print("{}: {} 字 {:6d} us, {} 行".format(name, length, us, n))
+    return results
@@ -0,0 +1,100 @@
+# 接收服务器光栅化好的文字位图(tiles)并贴到屏幕上
+#
+# 协商了 tiles 后，服务器用与设备相同的 .bmf 字体排版回复文字，每行渲染成一块位图，
+# 在回复音频之前以 FRAME_TILE 控制帧发来。设备不必查字库、逐字创建 FrameBuffer 和调色板，
+# 只需把位图读入预分配的缓冲区，再 blit 一次、show 一次。
+import framebuf
+import ustruct as struct
+from xiaozhi_protocol import FRAME_TILE, TILE_HEADER, TILE_MONO, TILE_RGB565
+
+_HEADER_BYTES = 1 + struct.calcsize(TILE_HEADER)  # 帧类型 + 位图头
+
+
+def display_info(display, fmt='RGB565'):
+    """
+    握手时告知服务器的屏幕信息
+
+    参数:
+        display: TextDisplay 实例
+        fmt: 请求的位图格式，'RGB565' 或 'MONO_HLSB'（数据量为 RGB565 的 1/16，贴图时按调色板着色）
+    """
+    return {
+        'width': display.width,
+        'height': display.height,
+        'line_height': display.line_height,
+        'format': fmt,
+        'color': display.color,
+        'bg_color': 0,
+    }
+
+
+class TileReceiver:
+    def __init__(self, display, max_bytes=0, sink=None):
+        """
+        初始化接收器
+
+        参数:
+            display: TextDisplay 实例
+            max_bytes: 单块位图的最大字节数，默认为一整行 RGB565
+            sink: 贴图的对象（需有 add_tile 方法），默认为 display；屏幕由显示线程管理时传入 UIThread
+        """
+        self.display = display
+        self.sink = sink or display
+        self._buf = bytearray(max_bytes or display.width * display.line_height * 2)
+        self._mv = memoryview(self._buf)
+        self._head = bytearray(_HEADER_BYTES)
+        self._head_mv = memoryview(self._head)
+        # MONO 位图贴到 RGB565 屏幕时的调色板：0 为背景色，1 为文字颜色
+        self._palette = framebuf.FrameBuffer(bytearray(4), 2, 1, framebuf.RGB565)
+        self.tiles = 0
+        self.skipped = 0  # 过大或格式不支持而丢弃的块
+
+    def _readinto(self, sock, mv, nbytes):
+        """从 socket 读满 nbytes 字节到 mv 开头"""
+        got = 0
+        while got < nbytes:
+            n = sock.readinto(mv[got:], nbytes - got)
+            if not n:
+                raise OSError("连接已断开")
+            got += n
+
+    def _skip(self, sock, nbytes):
+        """丢弃 nbytes 字节"""
+        size = len(self._buf)
+        while nbytes > 0:
+            n = min(nbytes, size)
+            self._readinto(sock, self._mv, n)
+            nbytes -= n
+
+    def on_control(self, sock, nbytes):
+        """AudioPlayer.play_stream 的控制帧回调：是位图就贴到屏幕上，其他控制帧丢弃"""
+        if nbytes < _HEADER_BYTES:
+            self._skip(sock, nbytes)
+            return
+        self._readinto(sock, self._head_mv, _HEADER_BYTES)
+        nbytes -= _HEADER_BYTES
+        if self._head[0] != FRAME_TILE[0]:
+            self._skip(sock, nbytes)
+            return
+        fmt, width, height = struct.unpack_from(TILE_HEADER, self._head, 1)
+        if fmt == TILE_RGB565:
+            size = width * height * 2
+            mode = framebuf.RGB565
+        elif fmt == TILE_MONO:
+            size = (width + 7) // 8 * height
+            mode = framebuf.MONO_HLSB
+        else:
+            size = -1
+        if size != nbytes or size > len(self._buf):
+            self.skipped += 1
+            self._skip(sock, nbytes)
+            return
+        self._readinto(sock, self._mv, size)
+        tile = framebuf.FrameBuffer(self._mv[:size], width, height, mode)
+        palette = None
+        if mode == framebuf.MONO_HLSB:
+            palette = self._palette
+            palette.pixel(0, 0, 0)
+            palette.pixel(1, 0, self.display.color)
+        self.sink.add_tile(tile, width, height, palette)
+        self.tiles += 1
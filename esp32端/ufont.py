@@ -11,6 +11,9 @@ import struct
 
 import framebuf
 
+from fontcache import default_cache
+from glyphscale import GlyphScaler, scale_hlsb, hlsb_to_rgb565
+
 DEBUG = False
 
 
@@ -82,6 +85,10 @@ class BMFont:
         else:
             reverse = False
 
+        sized_blit = hasattr(display, 'damage')
+        # 非原始字号：缩放后的点阵按码位缓存
+        scaler = self._scaler(font_size) if font_size != self.font_size else None
+
         # 清屏
         try:
             display.clear() if clear else 0
@@ -109,30 +116,31 @@ class BMFont:
             if x > display.width or y > display.height:
                 continue
 
-            # 获取字体的点阵数据
-            byte_data = list(self.get_bitmap(string[char]))
-
             # 分四种情况逐个优化
             #   1. 黑白屏幕/无放缩
             #   2. 黑白屏幕/放缩
             #   3. 彩色屏幕/无放缩
-            #   4. 彩色屏幕/放缩
-            if color_type == 0:
-                byte_data = self._reverse_byte_data(byte_data) if reverse else byte_data
-                if font_size == self.font_size:
-                    display.blit(framebuf.FrameBuffer(bytearray(byte_data), font_size, font_size, framebuf.MONO_HLSB),
-                                 x, y,
-                                 alpha_color)
+            #   4. 彩色屏幕/放缩（缩放后的点阵取自缓存，着色到复用的缓冲区）
+            if scaler is not None:
+                byte_data = self._scaled_bitmap(scaler, string[char])
+                if color_type == 0:
+                    byte_data = self._reverse_byte_data(bytearray(byte_data)) if reverse else byte_data
+                    fbuf = framebuf.FrameBuffer(byte_data, font_size, font_size, framebuf.MONO_HLSB)
                 else:
-                    display.blit(
-                        framebuf.FrameBuffer(self._HLSB_font_size(byte_data, font_size, self.font_size), font_size,
-                                             font_size, framebuf.MONO_HLSB), x, y, alpha_color)
-            elif color_type == 1 and font_size == self.font_size:
-                display.blit(framebuf.FrameBuffer(self._flatten_byte_data(byte_data, palette), font_size, font_size,
-                                                  framebuf.RGB565), x, y, alpha_color)
-            elif color_type == 1 and font_size != self.font_size:
-                display.blit(framebuf.FrameBuffer(self._RGB565_font_size(byte_data, font_size, palette, self.font_size),
-                                                  font_size, font_size, framebuf.RGB565), x, y, alpha_color)
+                    fbuf = scaler.rgb565(byte_data, color, bg_color)
+            else:
+                # 获取字体的点阵数据
+                byte_data = list(self.get_bitmap(string[char]))
+                if color_type == 0:
+                    byte_data = self._reverse_byte_data(byte_data) if reverse else byte_data
+                    fbuf = framebuf.FrameBuffer(bytearray(byte_data), font_size, font_size, framebuf.MONO_HLSB)
+                else:
+                    fbuf = framebuf.FrameBuffer(self._flatten_byte_data(byte_data, palette), font_size, font_size,
+                                                framebuf.RGB565)
+            if sized_blit:  # 驱动只刷新修改过的区域，告知字的尺寸
+                display.blit(fbuf, x, y, alpha_color, None, font_size, font_size)
+            else:
+                display.blit(fbuf, x, y, alpha_color)
             # 英文字符半格显示
             if ord(string[char]) < 128 and half_char:
                 x += font_size // 2
@@ -167,32 +175,32 @@ class BMFont:
                 start = mid + 2
         return -1
 
+    def _scaler(self, font_size: int) -> GlyphScaler:
+        """字号对应的缩放器（整数索引表和缩放后点阵的缓存）"""
+        scaler = self._scalers.get(font_size)
+        if scaler is None:
+            scaler = self._scalers[font_size] = GlyphScaler(self.font_size, font_size, self.scaled_cache_bytes)
+        return scaler
+
+    def _scaled_bitmap(self, scaler: GlyphScaler, word: str) -> bytearray:
+        """缩放后的点阵，命中缓存时不读字体也不缩放"""
+        code = ord(word)
+        bitmap = scaler.get(code)
+        if bitmap is None:
+            bitmap = scaler.scale(code, self.get_bitmap(word))
+        return bitmap
+
     @timeit
     def _HLSB_font_size(self, byte_data: bytearray, new_size: int, old_size: int) -> bytearray:
-        old_size = old_size
-        _temp = bytearray(new_size * ((new_size >> 3) + 1))
-        _new_index = -1
-        for _col in range(new_size):
-            for _row in range(new_size):
-                if (_row % 8) == 0:
-                    _new_index += 1
-                _old_index = int(_col / (new_size / old_size)) * old_size + int(_row / (new_size / old_size))
-                _temp[_new_index] = _temp[_new_index] | (
-                        (byte_data[_old_index >> 3] >> (7 - _old_index % 8) & 1) << (7 - _row % 8))
-        return _temp
+        return scale_hlsb(bytearray(byte_data), new_size, old_size)
 
     @timeit
     def _RGB565_font_size(self, byte_data: bytearray, new_size: int, palette: list, old_size: int) -> bytearray:
-        old_size = old_size
-        _temp = []
-        _new_index = -1
-        for _col in range(new_size):
-            for _row in range(new_size):
-                if (_row % 8) == 0:
-                    _new_index += 1
-                _old_index = int(_col / (new_size / old_size)) * old_size + int(_row / (new_size / old_size))
-                _temp.extend(palette[byte_data[_old_index // 8] >> (7 - _old_index % 8) & 1])
-        return bytearray(_temp)
+        color = palette[1][0] | palette[1][1] << 8
+        bg_color = palette[0][0] | palette[0][1] << 8
+        _temp = bytearray(new_size * new_size * 2)
+        hlsb_to_rgb565(scale_hlsb(bytearray(byte_data), new_size, old_size), _temp, new_size, color, bg_color)
+        return _temp
 
     @timeit
     def _flatten_byte_data(self, _byte_data: bytearray, palette: list) -> bytearray:
@@ -227,21 +235,34 @@ class BMFont:
         Returns:
             bytes 字符点阵
         """
+        # 命中缓存时省去索引查找和读文件
+        key = self._font_key | ord(word)
+        bitmap = self.glyph_cache.get(key)
+        if bitmap is not None:
+            return bitmap
         index = self._get_index(word)
         if index == -1:
-            return b'\xff\xff\xff\xff\xff\xff\xff\xff\xf0\x0f\xcf\xf3\xcf\xf3\xff\xf3\xff\xcf\xff?\xff?\xff\xff\xff' \
-                   b'?\xff?\xff\xff\xff\xff'
-
-        self.font.seek(self.start_bitmap + index * self.bitmap_size, 0)
-        return self.font.read(self.bitmap_size)
+            bitmap = b'\xff\xff\xff\xff\xff\xff\xff\xff\xf0\x0f\xcf\xf3\xcf\xf3\xff\xf3\xff\xcf\xff?\xff?\xff\xff\xff' \
+                     b'?\xff?\xff\xff\xff\xff'
+        else:
+            self.font.seek(self.start_bitmap + index * self.bitmap_size, 0)
+            bitmap = self.font.read(self.bitmap_size)
+        self.glyph_cache.put(key, bitmap)
+        return bitmap
 
     @timeit
-    def __init__(self, font_file):
+    def __init__(self, font_file, glyph_cache=None, scaled_cache_bytes=2048):
         """
         Args:
             font_file: 字体文件路径
+            glyph_cache: 字形点阵缓存(fontcache.GlyphCache)，默认与 EasyDisplay 共用
+            scaled_cache_bytes: 非原始字号时，每个字号缩放后点阵缓存的内存上限(字节)
         """
         self.font_file = font_file
+        self.scaled_cache_bytes = scaled_cache_bytes
+        self._scalers = {}  # 字号 -> GlyphScaler
+        self.glyph_cache = glyph_cache if glyph_cache is not None else default_cache()
+        self._font_key = self.glyph_cache.font_key(font_file)
         # 载入字体文件
         self.font = open(font_file, "rb")
         # 获取字体文件信息
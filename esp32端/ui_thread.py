@@ -0,0 +1,155 @@
+# 屏幕显示线程：状态文字以消息提交，录音和播放不等待屏幕
+#
+# 原来音频循环里直接调用 TextDisplay.add_text，每条状态要等 char_delay × 字数 才返回，
+# 一句话结束后还要 sleep(3) 才开始接收回复。这里用 _thread 起一个显示线程：
+# 音频线程只把 (文字, 颜色) 放入有界队列，显示线程取出后排版、推进打字机效果并按帧率刷新。
+# 队列满时丢弃最旧的消息（状态文字只有最新的有意义）。锁只在放入/取出消息时持有，
+# 排版和 SPI 刷新不在锁内，提交不会等待屏幕。
+# 显示器只在显示线程里访问；服务器下发的文字位图先复制到预分配的槽位，再像文字一样排队。
+import time
+import _thread
+import framebuf
+
+
+class _TileSlot:
+    """一块排队等待绘制的文字位图"""
+
+    def __init__(self, nbytes):
+        self.buf = bytearray(nbytes)
+        self.fbuf = None
+        self.palette = framebuf.FrameBuffer(bytearray(4), 2, 1, framebuf.RGB565)
+        self.mono = False
+        self.fmt = -1  # fbuf 的像素格式
+        self.width = 0
+        self.height = 0
+
+
+class UIThread:
+    def __init__(self, display, max_msgs=8, poll_ms=20, char_delay=0.01, tile_slots=2):
+        """
+        初始化显示线程
+
+        参数:
+            display: TextDisplay 实例，需以 wait=False 创建（由本线程调用 update() 推进）
+            max_msgs: 待显示消息上限，屏幕刷新跟不上时丢弃最旧的消息
+            poll_ms: 队列为空且没有待刷新内容时的轮询间隔(ms)
+            char_delay: 打字机效果的字符间隔(秒)
+            tile_slots: 排队等待绘制的文字位图数，每块占一整行 RGB565 的内存，第一次收到位图时才分配
+        """
+        self.display = display
+        self.max_msgs = max_msgs
+        self.poll_ms = poll_ms
+        self.char_delay = char_delay
+        self.tile_slots = tile_slots
+        self.lock = _thread.allocate_lock()  # 只保护消息队列和空闲槽位，不在锁内访问显示器
+        self._msgs = []
+        self._free_tiles = None
+        self._busy = False  # 显示器还有未显示完的内容
+        self.dropped = 0
+        self.running = False
+
+    def start(self):
+        """启动显示线程"""
+        if not self.running:
+            self.running = True
+            _thread.start_new_thread(self._run, ())
+
+    def stop(self):
+        """停止显示线程（线程在下一次轮询时退出）"""
+        self.running = False
+
+    def post(self, text, color=0xFFFF):
+        """提交一条显示消息，不等待屏幕刷新"""
+        with self.lock:
+            self._append((text, color))
+
+    def _append(self, msg):
+        """放入队列（需持有锁），满时丢弃最旧的消息，被丢弃的位图槽位还回空闲列表"""
+        if len(self._msgs) >= self.max_msgs:
+            old = self._msgs.pop(0)
+            if old[0] is None:
+                self._free_tiles.append(old[1])
+            self.dropped += 1
+        self._msgs.append(msg)
+
+    def pending(self):
+        """排队中的消息数"""
+        return len(self._msgs)
+
+    def add_tile(self, tile, width, height, palette=None):
+        """
+        提交一块服务器光栅化好的文字位图（TileReceiver 在接收线程中调用）
+
+        TileReceiver 的缓冲区会被下一块复用，这里先把位图复制到空闲槽位再排队，由显示线程绘制。
+        槽位都在排队时等显示线程画完一块，只在服务器连续下发多行时发生，且在回复音频之前。
+        """
+        slot = self._take_tile_slot()
+        if slot is None:
+            return
+        slot.mono = palette is not None
+        fmt = framebuf.MONO_HLSB if slot.mono else framebuf.RGB565
+        # 尺寸或格式与上次不同时重建（同一槽位可能先后装 RGB565 和 MONO 位图）
+        if slot.fbuf is None or slot.width != width or slot.height != height or slot.fmt != fmt:
+            slot.fbuf = framebuf.FrameBuffer(slot.buf, width, height, fmt)
+            slot.fmt = fmt
+        slot.width = width
+        slot.height = height
+        slot.fbuf.blit(tile, 0, 0)  # 格式相同、不带调色板时逐像素原样复制
+        if slot.mono:
+            slot.palette.pixel(0, 0, palette.pixel(0, 0))
+            slot.palette.pixel(1, 0, palette.pixel(1, 0))
+        with self.lock:
+            self._append((None, slot))
+
+    def _take_tile_slot(self):
+        """取一个空闲的位图槽位，都在排队时等待；显示线程已停止时返回 None"""
+        if self._free_tiles is None:
+            display = self.display
+            nbytes = display.width * display.line_height * 2
+            self._free_tiles = [_TileSlot(nbytes) for _ in range(self.tile_slots)]
+        while True:
+            with self.lock:
+                if self._free_tiles:
+                    return self._free_tiles.pop()
+            if not self.running:
+                return None
+            time.sleep_ms(self.poll_ms)
+
+    def _run(self):
+        display = self.display
+        while self.running:
+            with self.lock:
+                msg = self._msgs.pop(0) if self._msgs else None
+                if msg is not None:
+                    self._busy = True  # 取出后到显示完之前 wait_idle 不应返回
+            if msg is not None:
+                text, arg = msg
+                if text is None:
+                    display.add_tile(arg.fbuf, arg.width, arg.height, arg.palette if arg.mono else None)
+                    with self.lock:
+                        self._free_tiles.append(arg)
+                else:
+                    display.set_color(arg)
+                    display.add_text(text, char_delay=self.char_delay)
+            busy = display.update()
+            with self.lock:
+                self._busy = busy
+            if msg is None:
+                # 有内容待显示时按帧间隔推进，否则低频轮询
+                time.sleep_ms(display.render.frame_ms if self._busy else self.poll_ms)
+
+    def wait_idle(self, timeout_ms=3000):
+        """
+        等待消息全部显示完（重启前显示最后的错误信息用），超时返回 False
+
+        参数:
+            timeout_ms: 最长等待时间(ms)
+        """
+        start = time.ticks_ms()
+        while True:
+            with self.lock:
+                if not self._msgs and not self._busy:
+                    return True
+            if not self.running or time.ticks_diff(time.ticks_ms(), start) > timeout_ms:
+                return False
+            time.sleep_ms(self.poll_ms)
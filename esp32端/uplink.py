@@ -0,0 +1,188 @@
+# 上行音频帧的零拷贝发送
+# 发送缓冲区是由若干帧组成的环形缓冲区，每帧按 [帧头|音频] 排列，
+# I2S 直接读入帧头之后的音频区，帧头用 pack_into 原地写入，再通过 memoryview 发送：
+# 每帧不复制、不分配内存。
+#   coalesce > 1 时凑满多帧再一次发送，减少小包数量
+#   preroll > 0 时保留语音开始前最近的 preroll 帧，语音开始时一并发送，避免句首被截掉
+#   replay > 0 时已发送的帧在环形缓冲区中保留，重连恢复会话后重发服务器没收到的帧
+# 帧头为 <I 长度>，协商了 resume 后为 <I 长度><I 序号>
+import ustruct as struct
+from array import array
+
+
+class UplinkWriter:
+    def __init__(self, frame_bytes, coalesce=1, preroll=0, replay=0):
+        """
+        初始化上行发送缓冲区
+
+        参数:
+            frame_bytes: 每帧音频的字节数
+            coalesce: 合并多少帧后发送一次，1 为每帧立即发送
+            preroll: 保留语音开始前的帧数
+            replay: 重连后可重发的已发送帧数
+        """
+        self.frame_bytes = frame_bytes
+        self.coalesce = coalesce
+        self.max_preroll = preroll
+        self.preroll = preroll
+        self.slots = coalesce + max(preroll, replay)
+        self.sequenced = False
+        self.frames_sent = 0
+        self._alloc(4)
+
+    def _alloc(self, header_bytes):
+        """按帧头长度分配缓冲区"""
+        self.header_bytes = header_bytes
+        self.slot_bytes = self.frame_bytes + header_bytes
+        self._buf = None
+        self._buf = bytearray(self.slot_bytes * self.slots)
+        self._mv = memoryview(self._buf)
+        # 各帧的音频区在这里一次性创建；连续多帧的发送视图首次使用时创建并缓存
+        self._frames = [self._mv[k * self.slot_bytes + header_bytes:(k + 1) * self.slot_bytes]
+                        for k in range(self.slots)]
+        self._spans = [[None] * (self.slots - k) for k in range(self.slots)]
+        self._lens = array('H', [0] * self.slots)
+        self._seqs = array('I', [0] * self.slots)  # 各帧的序号，0 表示不是已提交的帧
+        self._end = bytearray(header_bytes)  # 一句话结束标记，长度为 0
+        self._end_seqs = array('I', [0] * self.slots)  # 最近几个结束标记的序号，用于重发
+        self._end_i = 0
+        self.seq = 1  # 下一帧的序号
+        self._head = 0   # 最旧的已提交未发送帧
+        self._count = 0  # 已提交未发送的帧数
+        self._held = 0   # _head 之前保留的预录帧数
+        self._short = 0  # 最后一帧比 frame_bytes 少的字节数
+
+    def set_sequenced(self, enabled):
+        """按握手结果切换帧头是否带序号（切换时重新分配缓冲区）"""
+        if enabled != self.sequenced:
+            self.sequenced = enabled
+            self._alloc(8 if enabled else 4)
+
+    def set_preroll(self, frames):
+        """按协商结果设置预录帧数，不超过初始化时分配的数量"""
+        self.preroll = max(0, min(frames, self.max_preroll))
+        self._held = min(self._held, self.preroll)
+
+    def frame(self):
+        """下一帧的音频区，I2S 直接读入这里"""
+        return self._frames[(self._head + self._count) % self.slots]
+
+    def _span(self, start, count):
+        """从第 start 帧开始连续 count 帧(含帧头)的视图"""
+        row = self._spans[start]
+        mv = row[count - 1]
+        if mv is None:
+            mv = row[count - 1] = self._mv[start * self.slot_bytes:(start + count) * self.slot_bytes]
+        return mv
+
+    def _number(self, i):
+        """给第 i 帧分配序号"""
+        if self.sequenced:
+            struct.pack_into('<I', self._buf, i * self.slot_bytes + 4, self.seq)
+            self._seqs[i] = self.seq
+            self.seq += 1
+
+    def hold(self, nbytes):
+        """没有语音时调用：把刚读入的一帧留作预录，超出 preroll 的最旧帧被覆盖"""
+        i = self._head
+        self._seqs[i] = 0  # 该位置原来的已发送帧已被覆盖，不能再重发
+        if not self.preroll:
+            return
+        if nbytes < self.frame_bytes:  # 不完整的帧无法与后面的帧连续发送，放弃已保留的预录
+            self._held = 0
+            return
+        struct.pack_into('<I', self._buf, i * self.slot_bytes, nbytes)
+        self._lens[i] = nbytes
+        self._head = (i + 1) % self.slots
+        if self._held < self.preroll:
+            self._held += 1
+
+    def commit(self, sock, nbytes):
+        """
+        提交刚读入 frame() 的一帧，凑满 coalesce 帧时发送
+
+        语音开始的第一帧会带上保留的预录帧；发送失败时帧仍保留，重连后可调用 flush 重发
+        """
+        if self._held:
+            self._head = (self._head - self._held) % self.slots
+            for k in range(self._held):
+                self._number((self._head + k) % self.slots)
+            self._count = self._held
+            self._held = 0
+        i = (self._head + self._count) % self.slots
+        struct.pack_into('<I', self._buf, i * self.slot_bytes, nbytes)
+        self._lens[i] = nbytes
+        self._number(i)
+        self._count += 1
+        self._short = self.frame_bytes - nbytes
+        # 不足一帧时后面的帧无法紧接其后，立即发送
+        if self._short or self._count >= self.coalesce:
+            self.flush(sock)
+
+    def flush(self, sock):
+        """发送已提交的帧"""
+        count = self._count
+        if not count:
+            return
+        head = self._head
+        first = self.slots - head
+        if count > first:  # 跨过缓冲区末尾，先发送到末尾的部分
+            sock.sendall(self._span(head, first))
+            self.frames_sent += first
+            self._head = head = 0
+            self._count = count = count - first
+        span = self._span(head, count)
+        if self._short:  # 很少出现，切片发送
+            span = span[:count * self.slot_bytes - self._short]
+        sock.sendall(span)
+        self.frames_sent += count
+        self._head = (head + count) % self.slots
+        self._count = 0
+        self._short = 0
+
+    def end(self, sock):
+        """发送剩余的帧和一句话结束标记"""
+        if self.sequenced:  # 先记下序号，发送失败时结束标记也能随 replay 重发
+            struct.pack_into('<I', self._end, 4, self.seq)
+            self._end_seqs[self._end_i] = self.seq
+            self._end_i = (self._end_i + 1) % self.slots
+            self.seq += 1
+        self.flush(sock)
+        sock.sendall(self._end)
+
+    def replay(self, sock, last_seq):
+        """
+        恢复会话后重发服务器没有收到的帧（序号大于 last_seq），未发送的帧一并发出
+
+        :return: 需要重发的帧都还在缓冲区中时返回 True
+        """
+        frames = [(self._seqs[k], k) for k in range(self.slots) if self._seqs[k] > last_seq]
+        frames += [(seq, -1) for seq in self._end_seqs if seq > last_seq]
+        frames.sort()
+        for seq, k in frames:
+            if k < 0:
+                struct.pack_into('<I', self._end, 4, seq)
+                sock.sendall(self._end)
+            elif self._lens[k] == self.frame_bytes:
+                sock.sendall(self._span(k, 1))
+            else:
+                sock.sendall(self._span(k, 1)[:self.header_bytes + self._lens[k]])
+        self._head = (self._head + self._count) % self.slots
+        self._count = 0
+        self._short = 0
+        # 序号连续说明没有帧已被覆盖
+        return len(frames) == self.seq - 1 - last_seq
+
+    def restart(self):
+        """服务器开始了新会话：丢弃未发送的帧，序号从 1 重新开始"""
+        self.reset()
+        for k in range(self.slots):
+            self._seqs[k] = 0
+            self._end_seqs[k] = 0
+        self.seq = 1
+
+    def reset(self):
+        """丢弃已提交未发送的帧和预录帧"""
+        self._count = 0
+        self._held = 0
+        self._short = 0
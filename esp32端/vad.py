@@ -0,0 +1,204 @@
+# 自适应噪声基底的语音活动检测(VAD)
+#
+# 噪声基底用"最小值统计"跟踪：把最近 window_s 秒分成若干块，取各块最小能量中的最小值，
+# 再做指数平滑。说话中的停顿足以让它跟上环境噪声的变化，说话本身不会把基底抬高。
+# 起止使用两个阈值(滞回)：能量超过 onset 开始，低于 offset 持续 hangover 才结束，
+# 介于两者之间视为仍在说话。
+# 开机时自动校准一次，结果保存到 flash，下次开机先用保存的值。
+# 每帧的计算只用整数，不分配内存。
+import time
+import ujson as json
+from array import array
+
+# update() 的返回值
+VAD_IDLE = 0    # 没有语音，不发送
+VAD_START = 1   # 语音开始
+VAD_SPEECH = 2  # 语音中
+VAD_END = 3     # 语音结束（本帧仍需发送，随后发送结束标记）
+
+
+class AdaptiveVAD:
+    def __init__(self, frame_ms, min_threshold=40, onset_ratio=3.0, offset_ratio=2.0, margin=10,
+                 hangover_s=1.5, window_s=8, path='vad.json', save_interval_s=600):
+        """
+        初始化 VAD
+
+        参数:
+            frame_ms: 每帧时长(ms)
+            min_threshold: 开始阈值的下限，安静环境下不低于此值
+            onset_ratio: 开始阈值 = 噪声基底 x onset_ratio + margin
+            offset_ratio: 结束阈值 = 噪声基底 x offset_ratio + margin，须小于 onset_ratio
+            margin: 阈值附加量，避免基底很低时阈值过于敏感
+            hangover_s: 低于结束阈值持续多久判定语音结束(s)
+            window_s: 噪声基底跟踪窗口(s)
+            path: 校准结果保存路径
+            save_interval_s: 两次保存到 flash 的最短间隔(s)，减少 flash 擦写
+        """
+        self.frame_ms = frame_ms
+        self.min_threshold = min_threshold
+        self._onset_q4 = int(onset_ratio * 16)
+        self._offset_q4 = int(offset_ratio * 16)
+        self.margin = margin
+        self.hangover = max(1, int(hangover_s * 1000) // frame_ms)
+        self.path = path
+        self.save_interval_s = save_interval_s
+
+        # 最小值统计：nblocks 块，每块 block_frames 帧
+        self.nblocks = 8
+        self.block_frames = max(1, int(window_s * 1000) // frame_ms // self.nblocks)
+        self._blocks = array('H', [0xFFFF] * self.nblocks)
+        self._block_i = 0
+        self._block_n = 0
+        self._block_min = 0xFFFF
+
+        self._floor_q4 = 0  # 噪声基底 x 16
+        self._saved_floor = 0
+        # ticks_ms 约 12.4 天回绕一次，ticks_diff 只在一半范围内有效，不能拿很久以前的时刻相减：
+        # 与 Telemetry 相同，每帧把经过的时间累加到秒数和余下的毫秒数里（都是小整数，不分配内存）
+        self._mark_ms = time.ticks_ms()
+        self.uptime_s = 0
+        self._uptime_rem_ms = 0
+        self._saved_s = 0  # 上次保存时的 uptime_s
+        self.onset = min_threshold
+        self.offset = min_threshold
+
+        self.speaking = False
+        self._silence = 0
+
+        # 统计
+        self.triggers = 0
+        self.speech_frames = 0
+
+        self.load()
+
+    def noise_floor(self):
+        """当前噪声基底(RMS)"""
+        return self._floor_q4 >> 4
+
+    def _advance(self):
+        """累加上次调用以来经过的时间"""
+        now = time.ticks_ms()
+        ms = self._uptime_rem_ms + time.ticks_diff(now, self._mark_ms)
+        self._mark_ms = now
+        self.uptime_s += ms // 1000
+        self._uptime_rem_ms = ms % 1000
+
+    def _set_floor(self, floor):
+        self._floor_q4 = floor << 4
+        for i in range(self.nblocks):
+            self._blocks[i] = floor
+        self._update_thresholds()
+
+    def _update_thresholds(self):
+        f = self._floor_q4
+        self.onset = max(self.min_threshold, ((f * self._onset_q4) >> 8) + self.margin)
+        # 结束阈值低于开始阈值，形成滞回
+        self.offset = min(self.onset, ((f * self._offset_q4) >> 8) + self.margin)
+
+    def _track_noise(self, energy):
+        """最小值统计跟踪噪声基底"""
+        if energy < self._block_min:
+            self._block_min = energy
+        self._block_n += 1
+        if self._block_n < self.block_frames:
+            return
+        blocks = self._blocks
+        blocks[self._block_i] = self._block_min
+        self._block_i = (self._block_i + 1) % self.nblocks
+        self._block_n = 0
+        self._block_min = 0xFFFF
+        target = 0xFFFF
+        for i in range(self.nblocks):
+            if blocks[i] < target:
+                target = blocks[i]
+        # 指数平滑，每块更新 1/4
+        self._floor_q4 += ((target << 4) - self._floor_q4) >> 2
+        self._update_thresholds()
+
+    def update(self, energy, scale=1):
+        """
+        输入一帧能量，返回 VAD_IDLE / VAD_START / VAD_SPEECH / VAD_END
+
+        参数:
+            energy: 本帧 RMS 能量
+            scale: 开始阈值的放大倍数（例如播放时避免回声误触发）
+        """
+        self._advance()
+        self._track_noise(energy)
+        if not self.speaking:
+            if energy > self.onset * scale:
+                self.speaking = True
+                self._silence = 0
+                self.triggers += 1
+                self.speech_frames += 1
+                return VAD_START
+            return VAD_IDLE
+        self.speech_frames += 1
+        if energy >= self.offset:
+            self._silence = 0
+            return VAD_SPEECH
+        self._silence += 1
+        if self._silence > self.hangover:
+            self.speaking = False
+            return VAD_END
+        return VAD_SPEECH
+
+    def reset(self):
+        """放弃当前语音（如连接断开）"""
+        self.speaking = False
+        self._silence = 0
+
+    def calibrate(self, read_energy, seconds=2, percentile=20):
+        """
+        采集一段环境噪声，取能量的百分位数作为噪声基底
+
+        参数:
+            read_energy: 读取一帧并返回其能量的函数
+            seconds: 采集时长(s)
+            percentile: 取第几百分位
+        :return: 噪声基底
+        """
+        frames = max(1, int(seconds * 1000) // self.frame_ms)
+        energies = sorted(read_energy() for _ in range(frames))
+        floor = energies[min(frames - 1, frames * percentile // 100)]
+        # 校准时有人说话会使结果偏高，明显高于保存值时沿用保存值
+        if self._saved_floor and floor > self._saved_floor * 4:
+            floor = self._saved_floor
+        self._set_floor(floor)
+        self.save(force=True)
+        return floor
+
+    def load(self):
+        """读取保存的噪声基底"""
+        try:
+            with open(self.path) as f:
+                floor = int(json.load(f)['noise_floor'])
+        except (OSError, ValueError, KeyError):
+            return False
+        self._saved_floor = floor
+        self._set_floor(floor)
+        return True
+
+    def save(self, force=False):
+        """噪声基底变化明显且距上次保存足够久时写入 flash"""
+        floor = self.noise_floor()
+        if not force:
+            self._advance()
+            if self.uptime_s - self._saved_s < self.save_interval_s:
+                return False
+            if abs(floor - self._saved_floor) * 4 <= self._saved_floor:  # 变化不超过 25%
+                return False
+        try:
+            with open(self.path, 'w') as f:
+                json.dump({'noise_floor': floor}, f)
+        except OSError:
+            return False
+        self._saved_floor = floor
+        self._advance()
+        self._saved_s = self.uptime_s
+        return True
+
+    def triggers_per_hour(self):
+        """开机以来平均每小时的触发次数"""
+        self._advance()
+        return self.triggers * 3600 // max(1, self.uptime_s)
@@ -0,0 +1,707 @@
+# 小智 esp32 全双工客户端（uasyncio 版）
+#
+# 录音采集、上行发送、下行接收、播放、屏幕显示、保活/重连各为独立任务，
+# 任务之间用有界队列连接，任何一个环节阻塞都不会让其它环节停下来：
+#   capture  --uplink_q-->  uplink   --> 服务器
+#   服务器   --> downlink  --play_q-->  playback
+#   各任务   --ui_q-->      ui(屏幕/串口)
+# 播放时仍在录音，检测到用户说话即打断(barge-in)：清空播放缓冲并通知服务器停止发送。
+# 音频缓冲区全部预分配，队列中只传递缓冲区编号。
+# 断线后按指数退避重连；服务器恢复会话时重发它没收到的帧（最近发送的帧保留在 sent_q 中）。
+import gc
+import time
+import network
+import ustruct as struct
+import uasyncio as asyncio
+from array import array
+from machine import I2S, Pin
+from xiaozhi_protocol import (hello_frame, parse_ack, device_id, new_session_id, backoff_ms,
+                              pack_control, pack_playback_stats, pack_log, CTRL_FLAG, LEN_MASK,
+                              FRAME_BARGE_IN, FRAME_KEEPALIVE, FEATURE_FRAMED_DOWNLINK, FEATURE_RESUME)
+from audio_dsp import frame_rms, apply_gain, gain_q15
+from vad import AdaptiveVAD, VAD_IDLE, VAD_START, VAD_END
+from devlog import log
+from telemetry import Telemetry
+
+# 上行队列中的特殊项（非负数为录音缓冲区编号）
+_END_UTTERANCE = -1
+_BARGE_IN = -2
+_KEEPALIVE = -3
+_PLAYBACK_STATS = -4
+_LOG = -5
+_TELEMETRY = -6
+
+# 播放队列中的结束标记
+_END_OF_REPLY = -1
+
+
+class BoundedQueue:
+    """
+    有界队列（uasyncio 没有内置 Queue）
+
+    满时丢弃最旧的一项并返回它，调用方据此回收缓冲区；get 在队列为空时等待。
+    """
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._items = []
+        self._event = asyncio.Event()
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def put_nowait(self, item):
+        """放入一项，队列已满时返回被丢弃的最旧一项，否则返回 None"""
+        dropped = None
+        if len(self._items) >= self.maxsize:
+            dropped = self._items.pop(0)
+            self.dropped += 1
+        self._items.append(item)
+        self._event.set()
+        return dropped
+
+    def get_nowait(self):
+        """取出一项，队列为空时返回 None"""
+        return self._items.pop(0) if self._items else None
+
+    def drop_oldest(self):
+        """取出最旧的缓冲区编号(非负项)，用于回收积压的帧，没有时返回 None"""
+        for k, item in enumerate(self._items):
+            if item >= 0:
+                self.dropped += 1
+                return self._items.pop(k)
+        return None
+
+    def clear(self):
+        """清空队列"""
+        self._items = []
+
+    async def get(self):
+        """取出一项，队列为空时等待"""
+        while not self._items:
+            self._event.clear()
+            await self._event.wait()
+        return self._items.pop(0)
+
+
+class AsyncVoiceRecorder:
+    def __init__(self, display=None):
+        """
+        初始化全双工客户端
+
+        参数:
+            display: 可选的 TextDisplay/ScreenManager 实例，为 None 时只打印到串口
+        """
+        # INMP441 硬件参数配置
+        self.INMP441_sck_pin = Pin(2)    # BCK
+        self.INMP441_ws_pin = Pin(3)     # WS/LRC
+        self.INMP441_sd_pin = Pin(4)     # DIN
+        self.sample_rate = 8000  # 8kHz采样率
+        self.bits = 16           # 每音频采样比特数
+        self.frame_ms = 128      # 每个录音帧的时长(ms)
+        self.buf_size = self.sample_rate * (self.bits // 8) * self.frame_ms // 1000  # 每个录音帧的字节数
+        self.channels = 1        # 单声道
+        self.capture_slots = 6   # 录音帧缓冲区个数(不含预录)，上行跟不上时丢弃最旧的帧
+        self.preroll_ms = 256    # 语音开始前预录的时长(ms)，握手时与服务器协商
+        self.capture_ibuf = self.buf_size * 3  # I2S 录音 DMA 缓冲，容纳 3 帧，事件循环被占用一段时间也不丢音
+
+        # VAD参数
+        self.energy_threshold = 40   # 开始阈值下限，实际阈值随噪声基底自动调整
+        self.silence_duration = 1.5  # 静音持续时间(s)
+        self.vad_calibrate_s = 2     # 开机噪声校准时长(s)
+        self.energy_step = 1  # 能量计算抽样间隔
+        self.barge_in_factor = 3  # 播放时阈值放大倍数，避免喇叭回声被当成说话
+
+        # MAX98357 播放参数
+        self.MAX98357_sck_pin = Pin(9)
+        self.MAX98357_ws_pin = Pin(8)
+        self.MAX98357_sd_pin = Pin(7)
+        self.playback_rate = 8000
+        self.playback_bits = 16
+        self.playback_ibuf = 2048
+        self.recv_buffer_size = 512  # 下行音频块大小，握手后按服务器确认的值调整
+        self.playback_slots = 8  # 播放缓冲区块数
+        self.playback_prefill_ms = 128  # 开始播放前预填的音频时长(ms)
+        self.volume_factor = 0.13
+        self.codecs = ['pcm_s16le']
+
+        # 屏幕
+        self.display = display
+        if display is not None:
+            display.wait = False  # add_text 只排入渲染队列，由 ui_task 逐帧调用 update()，不在事件循环里等待刷新
+        self.ui_slots = 8  # 待显示消息上限，屏幕刷新跟不上时丢弃最旧的消息
+
+        # 保活与重连
+        self.keepalive_s = 15  # 空闲多久发送一次保活帧(s)
+        self.telemetry_s = 60  # 遥测上报间隔(s)
+        self.retry_base_ms = 500    # 重连等待的初始时长(ms)，每次失败加倍
+        self.retry_max_ms = 30000   # 重连等待的上限(ms)
+        self.resume_frames = 4      # 重连后可重发的已发送帧数
+        self.session_id = new_session_id()  # 本次开机的会话 ID，断线重连后服务器据此恢复会话
+
+        # 配置Wi-Fi连接信息 替换为自己的wifi信息
+        self.WIFI_SSID = "xxx"
+        self.WIFI_PASSWORD = "xxx"
+
+        # 服务器配置
+        self.SERVER_IP = "192.168.2.110" #根据实际的服务器端地址
+        self.SERVER_PORT = 8888
+
+        # 状态
+        self.is_recording = False
+        self.playing = False
+        self.reader = None
+        self.writer = None
+        self.connected = asyncio.Event()
+        self.last_tx = time.ticks_ms()
+        self._reply_done = True  # 当前没有正在接收的回复
+        self._discard = False  # 打断后丢弃本轮剩余的下行音频
+
+        # 统计
+        self.underruns = 0
+        self.overruns = 0
+        self.chunks = 0
+        self.barge_ins = 0
+        self.connects = 0
+
+        self.sequenced = False  # 上行帧头是否带序号（协商了 resume）
+        self.seq = 1  # 下一个上行帧的序号
+        self._utt_first = 0  # 当前这句话第一帧的序号，0 为还没有发送
+        self._abandoned = None  # 断线时放弃的半句话的序号范围，重连握手时告知服务器
+        self._hdr = bytearray(8)
+        self._hdr_mv = memoryview(self._hdr)
+        self._rx_hdr = bytearray(4)
+        self._rx_hdr_mv = memoryview(self._rx_hdr)
+        self._rx_discard = None
+        self.gain = gain_q15(self.volume_factor)
+        log.console = False  # 串口输出由 ui_task 完成，日志只记入环形缓冲区，重连后发给服务器
+
+        self.vad = AdaptiveVAD(self.frame_ms, min_threshold=self.energy_threshold,
+                               hangover_s=self.silence_duration)
+        self.telemetry = Telemetry(self.frame_ms, self.telemetry_s)
+        self.ui_q = BoundedQueue(self.ui_slots)
+        self.play_free = BoundedQueue(self.playback_slots)
+        self.play_q = BoundedQueue(self.playback_slots + 1)
+        self.init_i2s()
+        self._alloc_capture()
+        self._alloc_playback(self.recv_buffer_size)
+
+    # 初始化I2S，录音和播放都以 asyncio 流的方式读写
+    def init_i2s(self):
+        self.audio_in = I2S(
+            0,
+            sck=self.INMP441_sck_pin,
+            ws=self.INMP441_ws_pin,
+            sd=self.INMP441_sd_pin,
+            mode=I2S.RX,
+            bits=self.bits,
+            format=I2S.MONO,
+            rate=self.sample_rate,
+            ibuf=self.capture_ibuf
+            )
+        self.audio_out = I2S(
+            1,
+            sck=self.MAX98357_sck_pin,
+            ws=self.MAX98357_ws_pin,
+            sd=self.MAX98357_sd_pin,
+            mode=I2S.TX,
+            bits=self.playback_bits,
+            format=I2S.MONO,
+            rate=self.playback_rate,
+            ibuf=self.playback_ibuf
+            )
+        print(f"[INIT] INMP441采样率: {self.sample_rate} MAX98357采样率: {self.playback_rate}")
+
+    def _alloc_capture(self):
+        """
+        预分配录音帧缓冲区，free_q 中为空闲编号，uplink_q 中为待发送编号
+
+        每个缓冲区前 8 字节留给帧头，I2S 读入其后的音频区，帧头和音频一次发送；
+        帧头不带序号时只发送后 4 字节
+        """
+        self.max_preroll = (self.preroll_ms + self.frame_ms - 1) // self.frame_ms
+        self.preroll = self.max_preroll
+        total = self.capture_slots + self.max_preroll + self.resume_frames
+        self._frames = [bytearray(8 + self.buf_size) for _ in range(total)]
+        mvs = [memoryview(buf) for buf in self._frames]
+        self._seq_views = mvs
+        self._plain_views = [mv[4:] for mv in mvs]
+        self._send_views = self._plain_views
+        self._frame_views = [mv[8:] for mv in mvs]
+        self._frame_lens = array('H', [0] * total)
+        self._seqs = array('I', [0] * total)
+        self.free_q = BoundedQueue(total)
+        for i in range(total):
+            self.free_q.put_nowait(i)
+        # 留出空间给结束标记、打断等控制项
+        self.uplink_q = BoundedQueue(total + 4)
+        # 没有语音时最近的几帧，语音开始时先于开始帧发送
+        self.preroll_q = BoundedQueue(max(1, self.max_preroll))
+        # 最近发送的帧，重连恢复会话后重发服务器没收到的部分；结束标记以 -序号 记录
+        self.sent_q = BoundedQueue(max(1, self.resume_frames))
+
+    def _alloc_playback(self, chunk_bytes):
+        """按下行块大小预分配播放缓冲区"""
+        self.recv_buffer_size = chunk_bytes
+        self._play_bufs = [bytearray(chunk_bytes) for _ in range(self.playback_slots)]
+        self._play_views = [memoryview(buf) for buf in self._play_bufs]
+        self._play_lens = array('H', [0] * self.playback_slots)
+        # 队列对象保持不变（任务可能正在等待），只重置内容
+        self.play_q.clear()
+        self.play_free.clear()
+        for i in range(self.playback_slots):
+            self.play_free.put_nowait(i)
+        self._rx_discard = memoryview(bytearray(chunk_bytes))  # 丢弃控制帧/被打断回复时的读缓冲
+        bytes_per_ms = self.playback_rate * (self.playback_bits // 8) // 1000
+        chunk_ms = max(1, chunk_bytes // bytes_per_ms)
+        self._prefill = max(1, min(self.playback_slots - 1,
+                                   (self.playback_prefill_ms + chunk_ms - 1) // chunk_ms))
+
+    # 连接 WiFi（启动时执行一次，此时还没有音频任务在运行）
+    def connect_wifi(self):
+        sta_if = network.WLAN(network.STA_IF)
+        if not sta_if.isconnected():
+            self.post("\n正在连接WiFi ...")
+            sta_if.active(True)
+            sta_if.connect(self.WIFI_SSID, self.WIFI_PASSWORD)
+            start_time = time.time()
+            while not sta_if.isconnected():
+                if time.time() - start_time > 20:
+                    print("WiFi连接超时，重试...")
+                    sta_if.disconnect()
+                    time.sleep(1)
+                    sta_if.connect(self.WIFI_SSID, self.WIFI_PASSWORD)
+                    start_time = time.time()
+                time.sleep(0.5)
+        self.post(f"\n[INIT] WiFi 连接成功!\nIP地址:{sta_if.ifconfig()[0]}")
+
+    def post(self, text, color=0xFFFF):
+        """提交一条显示消息，不等待屏幕刷新"""
+        self.ui_q.put_nowait((text, color))
+
+    def hello(self):
+        """握手信息"""
+        return {
+            'device_id': device_id(),
+            'capture_rate': self.sample_rate,
+            'playback_rate': self.playback_rate,
+            'bits': self.bits,
+            'channels': self.channels,
+            'codecs': self.codecs,
+            'capture_frame_bytes': self.buf_size,
+            'playback_buffer_bytes': self.recv_buffer_size,
+            'preroll_ms': self.max_preroll * self.frame_ms,
+            'session_id': self.session_id,
+            'features': [FEATURE_FRAMED_DOWNLINK, FEATURE_RESUME],
+            'abandoned': self._abandoned,
+        }
+
+    def _set_sequenced(self, enabled):
+        """按握手结果选择上行帧头格式"""
+        self.sequenced = enabled
+        self._send_views = self._seq_views if enabled else self._plain_views
+
+    def _sent(self, item):
+        """记录一个已发送的帧或结束标记，挤出的最旧帧回收"""
+        if not self.resume_frames:
+            if item >= 0:
+                self.free_q.put_nowait(item)
+            return
+        dropped = self.sent_q.put_nowait(item)
+        if dropped is not None and dropped >= 0:
+            self.free_q.put_nowait(dropped)
+
+    def _restart(self):
+        """服务器开始了新会话：回收保留的已发送帧，序号从 1 重新开始"""
+        while True:
+            i = self.sent_q.get_nowait()
+            if i is None:
+                break
+            if i >= 0:
+                self.free_q.put_nowait(i)
+        self.seq = 1
+        self._utt_first = 0
+
+    async def _replay(self, writer, last_seq):
+        """
+        恢复会话后按顺序重发序号大于 last_seq 的帧和结束标记
+
+        :return: 需要重发的帧都还保留着时返回 True
+        """
+        resent = 0
+        for item in self.sent_q._items:
+            if item >= 0:
+                seq = self._seqs[item]
+                if seq > last_seq:
+                    n = self._frame_lens[item]
+                    writer.write(self._seq_views[item] if n == self.buf_size else self._seq_views[item][:8 + n])
+                    resent += 1
+            elif -item > last_seq:
+                struct.pack_into('<II', self._hdr, 0, 0, -item)
+                writer.write(self._hdr)
+                await writer.drain()  # _hdr 会被下一个结束标记覆盖
+                resent += 1
+        await writer.drain()
+        return resent == self.seq - 1 - last_seq
+
+    async def connect(self):
+        """连接服务器并握手，失败时按指数退避重试"""
+        attempt = 0
+        while True:
+            writer = None
+            try:
+                reader, writer = await asyncio.open_connection(self.SERVER_IP, self.SERVER_PORT)
+                writer.write(hello_frame(self.hello()))
+                await writer.drain()
+                ack = parse_ack(await asyncio.wait_for(reader.readline(), 5))
+                if ack['playback_rate'] != self.playback_rate or ack['capture_rate'] != self.sample_rate:
+                    raise ValueError("服务器采样率不匹配: {}".format(ack))
+                if FEATURE_FRAMED_DOWNLINK not in ack['features']:
+                    raise ValueError("服务器不支持分帧下行")
+                if ack['playback_chunk_bytes'] != self.recv_buffer_size:
+                    self._alloc_playback(ack['playback_chunk_bytes'])
+                # 服务器可能缩短预录时长，不支持预录的服务器不发送
+                self.preroll = min(self.max_preroll, ack.get('preroll_ms', 0) // self.frame_ms)
+                # 会话恢复：先重发服务器没收到的帧，再让上行任务继续发送
+                self._set_sequenced(FEATURE_RESUME in ack['features'])
+                if ack.get('resumed'):
+                    if not await self._replay(writer, ack.get('last_seq', 0)):
+                        log.warn("部分音频帧已被覆盖，服务器收到的语音不完整")
+                        self.post("\n部分音频帧已丢失", 0xF800)
+                else:
+                    self._restart()
+                self._abandoned = None  # 服务器已丢弃（或开始了新会话）
+                self.reader, self.writer = reader, writer
+                # 中断的回复由服务器重发
+                self._reply_done = not ack.get('pending_reply')
+                self._discard = False
+                self.last_tx = time.ticks_ms()
+                self.connected.set()
+                if self.connects:
+                    self.telemetry.reconnects += 1
+                self.connects += 1
+                self.post(f"\n成功连接到:\n {self.SERVER_IP}:{self.SERVER_PORT}")
+                if log.lines():
+                    self.uplink_q.put_nowait(_LOG)
+                return
+            except (OSError, ValueError, asyncio.TimeoutError) as e:
+                if writer is not None:
+                    writer.close()
+                delay = backoff_ms(attempt, self.retry_base_ms, self.retry_max_ms)
+                attempt += 1
+                log.warn("连接失败: %s, %dms后重试...", e, delay)
+                self.post(f"\n连接失败: \n{e}, \n{delay}ms后重试...", 0xF800)
+                await asyncio.sleep_ms(delay)
+
+    def connection_lost(self, writer, e):
+        """任一任务发现连接断开时调用，由 keepalive_task 负责重连"""
+        if writer is not self.writer:  # 已经处理过（或已重连）
+            return
+        self.connected.clear()
+        try:
+            writer.close()
+        except OSError:
+            pass
+        self.reader = self.writer = None
+        self.flush_playback()
+        log.warn("连接错误，尝试重新连接: %s", e)
+        self.post(f"\n连接错误，尝试重新连接:\n{e}", 0xF800)
+
+    def flush_playback(self):
+        """清空待播放的音频，缓冲区还回空闲队列"""
+        while True:
+            i = self.play_q.get_nowait()
+            if i is None:
+                break
+            if i >= 0:
+                self.play_free.put_nowait(i)
+        self.playing = False
+
+    def barge_in(self):
+        """播放中用户开始说话：停止播放，并通知服务器停止发送本轮回复"""
+        self.barge_ins += 1
+        if not self._reply_done:
+            self._discard = True
+        self.flush_playback()
+        self.uplink_q.put_nowait(_BARGE_IN)
+        self.post("\n[打断]")
+
+    def _queue_frame(self, i):
+        """把录音帧交给上行任务，上行跟不上时回收被挤掉的最旧帧"""
+        dropped = self.uplink_q.put_nowait(i)
+        if dropped is not None and dropped >= 0:
+            self.free_q.put_nowait(dropped)
+
+    def _hold_preroll(self, i, n):
+        """没有语音时把帧留作预录，超出预录帧数的最旧帧回收"""
+        if not self.preroll:
+            self.free_q.put_nowait(i)
+            return
+        self._frame_lens[i] = n
+        dropped = self.preroll_q.put_nowait(i)
+        if dropped is None and len(self.preroll_q) > self.preroll:
+            dropped = self.preroll_q.get_nowait()
+        if dropped is not None:
+            self.free_q.put_nowait(dropped)
+
+    def _release_preroll(self, send):
+        """语音开始时把预录帧按顺序放入上行队列，send 为 False 时直接回收"""
+        while True:
+            i = self.preroll_q.get_nowait()
+            if i is None:
+                break
+            if send:
+                self._queue_frame(i)
+            else:
+                self.free_q.put_nowait(i)
+
+    async def capture_task(self):
+        """录音采集 + VAD，录到的帧放入上行队列"""
+        sreader = asyncio.StreamReader(self.audio_in)
+        vad = self.vad
+        telemetry = self.telemetry
+        while True:
+            i = self.free_q.get_nowait()
+            if i is None:  # 先放弃保留待重发的帧
+                i = self.sent_q.drop_oldest()
+            if i is None:  # 缓冲区都在等待发送(网络阻塞)，丢弃最旧的一帧，保证 I2S 不溢出
+                i = self.uplink_q.drop_oldest()
+                if i is None:
+                    i = await self.free_q.get()
+            n = await sreader.readinto(self._frame_views[i])
+            telemetry.loop_start()
+            energy = frame_rms(self._frame_views[i], n, self.energy_step)
+            # 播放时放大开始阈值，避免喇叭回声误触发打断
+            event = vad.update(energy, self.barge_in_factor if self.playing else 1)
+            if event == VAD_IDLE:
+                self._hold_preroll(i, n)
+                telemetry.loop_end()
+                continue
+            if event == VAD_START:
+                self.is_recording = True
+                if self.playing or not self._reply_done:
+                    self.barge_in()
+                self.post("\n检测到语音开始")
+            if not self.connected.is_set():  # 断线期间不缓存录音
+                if self._utt_first:  # 这句话已发出一部分，不会再发结束标记，重连时让服务器丢弃
+                    self._abandoned = (self._utt_first, self.seq - 1)
+                    self._utt_first = 0
+                self.free_q.put_nowait(i)
+                self._release_preroll(False)
+                self.is_recording = False
+                vad.reset()
+                continue
+            if event == VAD_START:
+                self._release_preroll(True)
+            self._frame_lens[i] = n
+            self._queue_frame(i)
+            if event == VAD_END:
+                self._queue_frame(_END_UTTERANCE)
+                self.is_recording = False
+                vad.save()
+                self.post("\n语音发送完毕")
+            telemetry.loop_end()
+
+    async def uplink_task(self):
+        """把上行队列中的帧发送给服务器"""
+        hdr = self._hdr
+        end_plain = self._hdr_mv[4:]
+        while True:
+            i = await self.uplink_q.get()
+            writer = self.writer
+            sent = None  # 带序号、需保留以便重发的项
+            try:
+                if writer is None:
+                    continue
+                if i >= 0:
+                    n = self._frame_lens[i]
+                    if self.sequenced:
+                        struct.pack_into('<II', self._frames[i], 0, n, self.seq)
+                        self._seqs[i] = self.seq
+                        if not self._utt_first:
+                            self._utt_first = self.seq
+                        self.seq += 1
+                        sent = i
+                        writer.write(self._send_views[i] if n == self.buf_size else self._send_views[i][:8 + n])
+                    else:
+                        struct.pack_into('<I', self._frames[i], 4, n)
+                        writer.write(self._send_views[i] if n == self.buf_size else self._send_views[i][:4 + n])
+                elif i == _END_UTTERANCE:
+                    if self.sequenced:
+                        struct.pack_into('<II', hdr, 0, 0, self.seq)
+                        sent = -self.seq
+                        self._utt_first = 0
+                        self.seq += 1
+                        writer.write(hdr)
+                    else:
+                        struct.pack_into('<I', hdr, 4, 0)
+                        writer.write(end_plain)
+                elif i == _BARGE_IN:
+                    writer.write(pack_control(FRAME_BARGE_IN))
+                elif i == _KEEPALIVE:
+                    writer.write(pack_control(FRAME_KEEPALIVE))
+                elif i == _PLAYBACK_STATS:
+                    writer.write(pack_playback_stats(self.underruns, self.overruns, self.chunks))
+                    self.telemetry.add_playback(self.underruns, self.overruns)
+                    self.underruns = self.overruns = self.chunks = 0
+                elif i == _TELEMETRY:
+                    writer.write(self.telemetry.frame())
+                elif i == _LOG:
+                    writer.write(pack_log(log.lines()))
+                    log.clear()
+                await writer.drain()
+                self.last_tx = time.ticks_ms()
+            except OSError as e:
+                self.connection_lost(writer, e)
+            finally:
+                if sent is not None:  # 发送失败的也保留，恢复会话后重发
+                    self._sent(sent)
+                elif i >= 0:
+                    self.free_q.put_nowait(i)
+
+    async def _readinto(self, reader, mv, nbytes):
+        """从 socket 读满 nbytes 字节到 mv 开头"""
+        got = 0
+        while got < nbytes:
+            n = await reader.readinto(mv if got == 0 and nbytes == len(mv) else mv[got:nbytes])
+            if not n:
+                raise OSError("连接已断开")
+            got += n
+
+    async def _receive_reply(self, reader, length):
+        """接收一个下行音频帧，按块放入播放队列；打断后读出并丢弃"""
+        while length > 0:
+            n = min(length, self.recv_buffer_size)
+            if self._discard:
+                await self._readinto(reader, self._rx_discard, n)
+            else:
+                i = self.play_free.get_nowait()
+                if i is None:  # 播放缓冲区已满，等待播放腾出空间
+                    self.overruns += 1
+                    i = await self.play_free.get()
+                await self._readinto(reader, self._play_views[i], n)
+                if self._discard:  # 等待期间被打断
+                    self.play_free.put_nowait(i)
+                else:
+                    apply_gain(self._play_views[i], n, self.gain)
+                    self._play_lens[i] = n
+                    self.play_q.put_nowait(i)
+            length -= n
+
+    async def downlink_task(self):
+        """接收服务器的回复音频，放入播放队列"""
+        hdr_mv = self._rx_hdr_mv
+        while True:
+            await self.connected.wait()
+            reader, writer = self.reader, self.writer
+            try:
+                await self._readinto(reader, hdr_mv, 4)
+                length = struct.unpack_from('<I', self._rx_hdr)[0]
+                if length == 0:  # 本轮回复结束
+                    if self._discard:
+                        self._discard = False
+                    else:
+                        self.play_q.put_nowait(_END_OF_REPLY)
+                    self._reply_done = True
+                elif length & CTRL_FLAG:  # 暂不处理的控制帧
+                    length &= LEN_MASK
+                    while length > 0:
+                        n = min(length, self.recv_buffer_size)
+                        await self._readinto(reader, self._rx_discard, n)
+                        length -= n
+                else:
+                    self._reply_done = False
+                    await self._receive_reply(reader, length)
+            except OSError as e:
+                self.connection_lost(writer, e)
+
+    async def playback_task(self):
+        """从播放队列取音频写入 I2S，先预填抖动缓冲再开始播放"""
+        swriter = asyncio.StreamWriter(self.audio_out)
+        while True:
+            if not self.playing:
+                # 预填：攒够 prefill 块或本轮回复已收完再开始播放
+                while len(self.play_q) < self._prefill and not self._reply_done:
+                    await asyncio.sleep_ms(5)
+            i = await self.play_q.get()
+            if i == _END_OF_REPLY:
+                self.playing = False
+                self.uplink_q.put_nowait(_PLAYBACK_STATS)
+                continue
+            self.playing = True
+            n = self._play_lens[i]
+            view = self._play_views[i]
+            swriter.write(view if n == self.recv_buffer_size else view[:n])
+            await swriter.drain()
+            self.play_free.put_nowait(i)
+            self.chunks += 1
+            if not len(self.play_q) and not self._reply_done and self.playing:
+                self.underruns += 1  # 网络数据没跟上，重新预填后再播放
+                self.playing = False
+
+    async def ui_task(self):
+        """
+        显示消息；屏幕刷新在这里进行
+
+        display.update() 每次最多推进一帧、刷新一次，帧之间让出事件循环，
+        一条长回复分多帧显示，录音和播放任务不会被整段渲染挡住
+        """
+        display = self.display
+        busy = False
+        while True:
+            # 还有未显示完的内容时不等待新消息
+            msg = self.ui_q.get_nowait() if busy else await self.ui_q.get()
+            if msg is not None:
+                text, color = msg
+                if display is None:
+                    print(text)
+                    continue
+                display.set_color(color)
+                display.add_text(text, char_delay=0)
+            busy = display.update()
+            await asyncio.sleep_ms(display.render.frame_ms if busy else 0)
+
+    async def keepalive_task(self):
+        """断线时重连；空闲超过 keepalive_s 时发送保活帧；定期上报遥测"""
+        while True:
+            if not self.connected.is_set():
+                await self.connect()
+            elif (not self.is_recording and not self.playing and self._reply_done
+                  and time.ticks_diff(time.ticks_ms(), self.last_tx) > self.keepalive_s * 1000):
+                self.last_tx = time.ticks_ms()
+                self.uplink_q.put_nowait(_KEEPALIVE)
+            if self.connected.is_set() and self.telemetry.due():
+                self.uplink_q.put_nowait(_TELEMETRY)
+            await asyncio.sleep(1)
+
+    async def run(self):
+        """启动全部任务"""
+        ui = asyncio.create_task(self.ui_task())
+        # 音频任务启动前校准噪声基底（I2S 此时还是阻塞读）
+        frame = self._frame_views[0]
+        floor = self.vad.calibrate(lambda: frame_rms(frame, self.audio_in.readinto(frame)),
+                                   self.vad_calibrate_s)
+        self.post(f"\n[INIT] 噪声基底: {floor}")
+        self.connect_wifi()
+        await self.connect()
+        tasks = [
+            asyncio.create_task(self.capture_task()),
+            asyncio.create_task(self.uplink_task()),
+            asyncio.create_task(self.downlink_task()),
+            asyncio.create_task(self.playback_task()),
+            asyncio.create_task(self.keepalive_task()),
+        ]
+        gc.collect()
+        print(f"[INIT] 全双工客户端就绪，可用内存: {gc.mem_free()}")
+        await asyncio.gather(ui, *tasks)
+
+
+if __name__ == "__main__":
+    gc.collect()
+    print("\n=== 小智全双工客户端 ===")
+    try:
+        asyncio.run(AsyncVoiceRecorder().run())
+    except MemoryError:
+        print("内存不足，系统重启...")
+        import machine
+        machine.reset()
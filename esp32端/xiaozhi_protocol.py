@@ -0,0 +1,130 @@
+# 小智 TCP 通信协议的公共定义（esp32端），与 PC服务端/xiaozhi_protocol.py 保持一致
+#
+# 上行帧格式: <I 长度> + 数据，协商了 resume 后音频帧和结束标记为 <I 长度><I 序号> + 数据
+#   长度 == 0            : 一句话结束标记
+#   长度最高位为 0        : 音频帧，数据为 PCM
+#   长度最高位为 1        : 控制帧，低 31 位为数据长度，数据首字节为帧类型
+# 控制帧:
+#   FRAME_HELLO  连接后发送的握手信息(JSON)，服务器回复一行 JSON 确认
+#   FRAME_PLAYBACK_STATS  每轮播放结束后上报 <III 欠载次数, 溢出次数, 播放块数>
+#   FRAME_BARGE_IN   播放中检测到用户说话(打断)，服务器停止发送本轮回复
+#   FRAME_KEEPALIVE  空闲时的保活帧
+#   FRAME_LOG        设备最近的日志(UTF-8 文本，每行一条)
+#   FRAME_TELEMETRY  定期上报的运行状态，按 TELEMETRY_FORMAT 打包(见 telemetry.py)
+#
+# 下行(服务器 -> 设备)，协商 framed_downlink 后:
+#   与上行相同的 <I 长度> 分帧，长度 0 表示本轮回复结束
+#   FRAME_TILE   协商了 tiles 后，服务器排版并光栅化好的一行文字位图，
+#                数据为 TILE_HEADER <BHH 格式, 宽, 高> + 位图，设备直接贴到屏幕上(见 tiles.py)
+#
+# 会话恢复(resume): 握手带上本次开机的 session_id，断线重连后服务器回复 resumed 和已收到的
+# 最大序号 last_seq，设备重发之后的帧；中断的回复(pending_reply)由服务器重发。
+# 断线时放弃了说到一半的话的设备在握手中带上 abandoned: [首帧序号, 末帧序号]，服务器丢弃这些帧。
+import os
+import random
+import ustruct as struct
+import ujson as json
+
+CTRL_FLAG = 0x80000000
+LEN_MASK = 0x7FFFFFFF
+
+FRAME_HELLO = b'H'
+FRAME_PLAYBACK_STATS = b'P'
+FRAME_BARGE_IN = b'B'
+FRAME_KEEPALIVE = b'K'
+FRAME_LOG = b'L'
+FRAME_TELEMETRY = b'T'
+FRAME_TILE = b'D'
+
+TILE_HEADER = '<BHH'
+TILE_MONO = 0  # MONO_HLSB
+TILE_RGB565 = 1  # RGB565，每像素 2 字节小端序(与 framebuf 内存格式一致)
+
+# 遥测字段: 运行时长(s), GC 堆剩余, 最大空闲块, RSSI(dBm), 循环平均/最大耗时(us),
+# 超时帧数, 最长 GC(ms), 播放欠载, 播放溢出, 重连次数
+TELEMETRY_FORMAT = '<IIIhIIHHHHH'
+
+MAX_LOG_BYTES = 2048  # 日志帧的最大长度，超出时丢弃最旧的行
+
+PROTOCOL_VERSION = 1
+
+# 可选功能
+FEATURE_FRAMED_DOWNLINK = 'framed_downlink'
+FEATURE_RESUME = 'resume'
+FEATURE_TILES = 'tiles'
+
+
+def device_id():
+    """以芯片唯一 ID 作为设备 ID"""
+    import machine
+    import ubinascii
+    return ubinascii.hexlify(machine.unique_id()).decode()
+
+
+def new_session_id():
+    """每次开机生成一个随机会话 ID"""
+    import ubinascii
+    return ubinascii.hexlify(os.urandom(4)).decode()
+
+
+def backoff_ms(attempt, base_ms=500, max_ms=30000):
+    """
+    第 attempt 次重连前的等待时间(ms)：指数增长并加随机抖动，
+    避免网络恢复时大量设备同时重连
+    """
+    delay = min(max_ms, base_ms << min(attempt, 16))
+    half = delay // 2
+    return half + random.getrandbits(16) % (half + 1)
+
+
+def pack_control(frame_type, payload=b''):
+    """打包一个控制帧"""
+    return struct.pack('<I', CTRL_FLAG | (len(payload) + 1)) + frame_type + payload
+
+
+def pack_playback_stats(underruns, overruns, chunks):
+    """打包播放统计控制帧"""
+    return pack_control(FRAME_PLAYBACK_STATS, struct.pack('<III', underruns, overruns, chunks))
+
+
+def pack_log(lines):
+    """打包日志控制帧"""
+    payload = '\n'.join(lines).encode()
+    if len(payload) > MAX_LOG_BYTES:
+        payload = payload[-MAX_LOG_BYTES:]
+        payload = payload[payload.find(b'\n') + 1:]  # 去掉被截断的一行
+    return pack_control(FRAME_LOG, payload)
+
+
+def hello_frame(hello):
+    """打包握手控制帧"""
+    hello['version'] = PROTOCOL_VERSION
+    return pack_control(FRAME_HELLO, json.dumps(hello).encode())
+
+
+def parse_ack(line):
+    """解析服务器的握手确认(一行 JSON)"""
+    if not line:
+        raise OSError("握手无响应")
+    ack = json.loads(line)
+    if ack.get('type') != 'hello_ack':
+        raise OSError("握手被拒绝: {}".format(ack.get('error')))
+    return ack
+
+
+def handshake(sock, hello, timeout=5):
+    """
+    发送握手信息并等待服务器确认
+
+    :param sock: 已连接的 socket
+    :param hello: 握手信息(dict)
+    :param timeout: 等待确认的超时时间(秒)
+    :return: 服务器确认的会话参数(dict)
+    """
+    sock.sendall(hello_frame(hello))
+    sock.settimeout(timeout)
+    try:
+        line = sock.readline()
+    finally:
+        sock.settimeout(None)
+    return parse_ack(line)
@@ -1,10 +1,23 @@
 from machine import I2S, Pin, I2C
-import time, array
+import time, array, gc
 import math, network, socket
-import ustruct as struct
+from xiaozhi_protocol import (handshake, device_id, new_session_id, backoff_ms, pack_playback_stats,
+                              pack_log, FEATURE_FRAMED_DOWNLINK, FEATURE_RESUME, FEATURE_TILES)
+from audio_dsp import frame_rms, zero_crossings
+from uplink import UplinkWriter
+from vad import AdaptiveVAD, VAD_IDLE, VAD_START, VAD_END
+from audio_player import AudioPlayer
+from devlog import log, DEBUG, INFO
+from telemetry import Telemetry
 from TextDisplay import TextDisplay
+from tiles import TileReceiver, display_info
+from ui_thread import UIThread
 
-display = TextDisplay(width=160, height=80, line_height=16)
+# 屏幕由显示线程刷新，音频循环只提交状态消息，不等待打字机效果和 SPI 传输
+# band_rows=16：只分配一行文字高的帧缓冲区(5KB，整屏为 25.6KB)，留给 WiFi、I2S 和播放缓冲区；设为 0 恢复整屏缓冲区
+display = TextDisplay(width=160, height=80, line_height=16, wait=False, band_rows=16)
+ui = UIThread(display)
+ui.start()
 
 class VoiceRecorder:
     def __init__(self):
@@ -12,20 +25,36 @@ class VoiceRecorder:
         self.INMP441_sck_pin = Pin(9)    # BCK
         self.INMP441_ws_pin = Pin(8)     # WS/LRC
         self.INMP441_sd_pin = Pin(7)     # DIN
-        self.buf_size = 2048    # 减小缓冲区大小以避免内存溢出
         self.sample_rate = 8000  # 8kHz采样率
         self.bits = 16           # 每音频采样比特数
+        self.frame_ms = 128      # 每个上行帧的时长(ms)，调小可降低延迟
+        self.buf_size = self.sample_rate * (self.bits // 8) * self.frame_ms // 1000  # 每帧字节数，128ms 为 2048 字节
+        self.uplink_coalesce = 1  # 合并多少帧后发送一次，帧很短时调大可减少小包
+        self.preroll_ms = 256     # 语音开始前预录的时长(ms)，避免句首的轻辅音被截掉，握手时与服务器协商
+        self.trace_alloc = False  # 统计上行每帧的堆分配(gc.mem_free 前后差值)
+        self.log_level = INFO     # 日志级别，设为 DEBUG 时打印每帧能量(串口输出会拖慢录音循环)
         self.format = I2S.MONO   # 改为单声道模式以减少内存使用
         self.channels = 1        # 单声道
         
         # 优化VAD参数
-        self.energy_threshold = 40   # 初始阈值
+        self.energy_threshold = 40   # 开始阈值下限，实际阈值随噪声基底自动调整
         self.silence_duration = 1.5  # 减少静音持续时间(s)
+        self.vad_calibrate_s = 2     # 开机噪声校准时长(s)，校准结果保存在 vad.json
         self.min_voice_duration = 0.5  # 减少最短有效语音时长(s)
+        self.energy_step = 1  # 能量计算抽样间隔，2 表示隔一个采样计算一次以节省CPU
+        self.zero_crossings = 0  # 最近一帧的过零次数
+
+        # MAX98357 播放参数，握手时告知服务器，服务器按此输出TTS音频
+        self.playback_rate = 8000  # 播放采样率需与服务器下发的音频一致，否则变速
+        self.playback_bits = 16
+        self.playback_ibuf = 2048
+        self.recv_buffer_size = 512  # 下行音频接收缓冲区
+        self.playback_slots = 8  # 播放环形缓冲区块数，决定抖动缓冲上限(8 x 512字节 = 256ms)
+        self.playback_prefill_ms = 128  # 开始播放前预填的音频时长(ms)，网络抖动大时调高
+        self.codecs = ['pcm_s16le']
         
         # 标志位
         self.is_recording = False 
-        self.silence_counter = 0
         self.INMP441_is_send_wav = False
           
         # MAX98357 初始化引脚定义
@@ -43,12 +72,33 @@ class VoiceRecorder:
         # 服务器配置
         self.SERVER_IP = "192.168.2.110" #根据实际的服务器端地址
         self.SERVER_PORT = 8888
+        self.session_id = new_session_id()  # 本次开机的会话 ID，断线重连后服务器据此恢复会话
+        self.resume_frames = 4      # 重连后可重发的已发送帧数
+        self.retry_base_ms = 500    # 重连等待的初始时长(ms)，每次失败加倍
+        self.retry_max_ms = 30000   # 重连等待的上限(ms)
+        self.telemetry_s = 60       # 遥测上报间隔(s)：内存、循环耗时、播放欠载、重连次数、RSSI
+        self.resumed = False
+        self.pending_reply = False  # 服务器将重发中断的回复
+        self.server_tiles = True    # 请服务器排版、光栅化回复文字，设备只贴图（服务器不支持时不显示回复文字）
+        self.tiles = None
+
+        log.level = self.log_level
 
+        # 上行发送缓冲区，I2S 直接读入其中
+        self.uplink = UplinkWriter(self.buf_size, self.uplink_coalesce,
+                                   preroll=(self.preroll_ms + self.frame_ms - 1) // self.frame_ms,
+                                   replay=self.resume_frames)
         # 初始化I2S
         self.init_i2s()    
+        # 自适应VAD，开机校准噪声基底
+        self.vad = AdaptiveVAD(self.frame_ms, min_threshold=self.energy_threshold,
+                               hangover_s=self.silence_duration)
+        self.calibrate_vad()
+        self.telemetry = Telemetry(self.frame_ms, self.telemetry_s)
         # 初始化连接 WiFi
         self.connect_wifi()
         # 连接到 TCP服务器
+        self.sock = None
         self.sock = self.connect_socket()
  
     # 初始化I2S录音设备
@@ -63,7 +113,7 @@ class VoiceRecorder:
             bits=self.bits,
             format=self.format,
             rate=self.sample_rate,
-            ibuf=self.buf_size
+            ibuf=max(self.buf_size, 2048)
             )
         
         # MAX98357初始化喇叭
@@ -73,15 +123,19 @@ class VoiceRecorder:
             ws=self.MAX98357_ws_pin,
             sd=self.MAX98357_sd_pin,
             mode=I2S.TX,
-            bits=16,
+            bits=self.playback_bits,
             format=I2S.MONO,
-            rate=8000,
-            ibuf=2048  # 减小缓冲区
+            rate=self.playback_rate,
+            ibuf=self.playback_ibuf  # 减小缓冲区
             )
+        # 预分配播放缓冲区，握手后按协商的下行块大小调整
+        self.player = AudioPlayer(self.audio_out, self.recv_buffer_size, slots=self.playback_slots,
+                                  volume=self.volume_factor, rate=self.playback_rate, bits=self.playback_bits,
+                                  prefill_ms=self.playback_prefill_ms)
         print(f"[INIT] INMP441采样率: {self.sample_rate} INMP441缓冲区: {self.buf_size}字节")
+        print(f"[INIT] MAX98357采样率: {self.playback_rate}")
         print("[INIT] I2S录音设备就绪")
-        display.set_color(0xFFFF)  # 黑色
-        display.add_text("\n[INIT] I2S录音设备就绪")
+        ui.post("\n[INIT] I2S录音设备就绪")
         time.sleep(2)
        
     # 连接 WiFi
@@ -89,8 +143,7 @@ class VoiceRecorder:
         sta_if = network.WLAN(network.STA_IF)
         if not sta_if.isconnected(): 
             print("正在连接WiFi ...")
-            display.set_color(0xFFFF)  # 黑色
-            display.add_text("\n正在连接WiFi ...")
+            ui.post("\n正在连接WiFi ...")
             sta_if.active(True) 
             sta_if.connect(self.WIFI_SSID, self.WIFI_PASSWORD)
             
@@ -100,8 +153,7 @@ class VoiceRecorder:
             while not sta_if.isconnected():
                 if time.time() - start_time > timeout:
                     print("WiFi连接超时，重试...")
-                    display.set_color(0xF800)  # 红色
-                    display.add_text("\nWiFi连接超时，重试...")
+                    ui.post("\nWiFi连接超时，重试...", 0xF800)
                     sta_if.disconnect()
                     time.sleep(1)
                     sta_if.connect(self.WIFI_SSID, self.WIFI_PASSWORD)
@@ -110,183 +162,237 @@ class VoiceRecorder:
                 
         print("[INIT] WiFi 连接成功!")
         print("IP地址:", sta_if.ifconfig()[0])
-        display.set_color(0xFFFF)  # 黑色
-        display.add_text(f"\n[INIT] WiFi 连接成功!\nIP地址:{sta_if.ifconfig()[0]}")
+        ui.post(f"\n[INIT] WiFi 连接成功!\nIP地址:{sta_if.ifconfig()[0]}")
         time.sleep(2)
 
     # 带重试的socket连接
     def connect_socket(self):  
         print("[INIT] 正在连接服务器...")
-        display.set_color(0xFFFF)  # 黑色
-        display.add_text("\n[INIT] 正在连接服务器...")
-        retry_delay = 5  # 重试间隔秒数
+        ui.post("\n[INIT] 正在连接服务器...")
+        # 先关闭断开的旧连接，否则每次重连都泄漏一个 lwIP socket；关闭时可能再次报错
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+        attempt = 0
         while True:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             try:
-                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
                 sock.connect((self.SERVER_IP, self.SERVER_PORT))
+                self.handshake(sock)
                 print(f"成功连接到 {self.SERVER_IP}:{self.SERVER_PORT}")
-                display.set_color(0xFFFF)  # 黑色
-                display.add_text(f"\n成功连接到:\n {self.SERVER_IP}:{self.SERVER_PORT}")
+                if self.sock is not None:
+                    self.telemetry.reconnects += 1
+                self.ship_logs(sock)
+                ui.post(f"\n成功连接到:\n {self.SERVER_IP}:{self.SERVER_PORT}")
                 return sock
-            except OSError as e:
-                print(f"连接失败: {e}, {retry_delay}秒后重试...")
-                display.set_color(0xF800)  # 红色
-                display.add_text(f"\n连接失败: \n{e}, \n{retry_delay}秒后重试...")
-                time.sleep(retry_delay)
+            except (OSError, ValueError) as e:
+                sock.close()
+                delay = backoff_ms(attempt, self.retry_base_ms, self.retry_max_ms)
+                attempt += 1
+                log.warn("连接失败: %s, %dms后重试...", e, delay)
+                ui.post(f"\n连接失败: \n{e}, \n{delay}ms后重试...", 0xF800)
+                time.sleep_ms(delay)
 
-    # 优化的RMS计算
-    def rms(self, data):    
-        if len(data) < 2:
-            return 0
-            
-        samples = len(data) // 2
-        sum_squares = 0
-        
-        # 处理较大的数据块时分批计算以避免内存问题
-        chunk_size = 64  # 每次处理的样本数
-        for i in range(0, samples, chunk_size):
-            end = min(i + chunk_size, samples)
-            for j in range(i, end):
-                idx = j * 2
-                sample = (data[idx+1] << 8) | data[idx]
-                if sample >= 0x8000:
-                    sample -= 0x10000
-                sum_squares += sample * sample
-                
-        if samples == 0:
-            return 0
-            
-        return int(math.sqrt(sum_squares / samples))
+    # 握手：告知服务器设备的音频参数，服务器据此配置ASR输入、TTS输出和重采样
+    def handshake(self, sock):
+        ack = handshake(sock, {
+            'device_id': device_id(),
+            'capture_rate': self.sample_rate,
+            'playback_rate': self.playback_rate,
+            'bits': self.bits,
+            'channels': self.channels,
+            'codecs': self.codecs,
+            'capture_frame_bytes': self.buf_size,
+            'playback_buffer_bytes': self.recv_buffer_size,
+            'preroll_ms': self.uplink.max_preroll * self.frame_ms,
+            'session_id': self.session_id,
+            'features': [FEATURE_FRAMED_DOWNLINK, FEATURE_RESUME] + ([FEATURE_TILES] if self.server_tiles else []),
+            'display': display_info(display),
+        })
+        # 服务器按设备参数输出，采样率不一致说明服务器配置有误
+        if ack['playback_rate'] != self.playback_rate or ack['capture_rate'] != self.sample_rate:
+            raise ValueError("服务器采样率不匹配: {}".format(ack))
+        if FEATURE_FRAMED_DOWNLINK not in ack['features']:
+            raise ValueError("服务器不支持分帧下行")
+        self.recv_buffer_size = ack['playback_chunk_bytes']
+        if self.player.chunk_bytes != self.recv_buffer_size:
+            self.player.resize(self.recv_buffer_size)
+        # 服务器可能缩短预录时长，不支持预录的服务器不发送
+        self.uplink.set_preroll(ack.get('preroll_ms', 0) // self.frame_ms)
+        # 回复文字由服务器光栅化，位图随回复音频之前下发
+        if FEATURE_TILES in ack['features']:
+            if self.tiles is None:
+                self.tiles = TileReceiver(display, sink=ui)
+        else:
+            self.tiles = None
+        # 会话恢复：重发服务器没收到的帧；新会话则丢弃未发送的帧，序号重新开始
+        self.uplink.set_sequenced(FEATURE_RESUME in ack['features'])
+        self.resumed = bool(ack.get('resumed'))
+        self.pending_reply = bool(ack.get('pending_reply'))
+        if self.resumed:
+            if not self.uplink.replay(sock, ack.get('last_seq', 0)):
+                log.warn("部分音频帧已被覆盖，服务器收到的语音不完整")
+            print(f"[INIT] 会话已恢复 已确认序号: {ack.get('last_seq', 0)}")
+        else:
+            self.uplink.restart()
+        print(f"[INIT] 握手完成 编码: {ack['codec']} 下行块: {self.recv_buffer_size}字节 "
+              f"预录: {self.uplink.preroll * self.frame_ms}ms")
 
-    # 流式发送音频
-    def stream_audio(self, data):
+    # 把最近的日志（上次断线的原因等）发给服务器，发送后清空
+    def ship_logs(self, sock):
+        lines = log.lines()
+        if lines:
+            sock.sendall(pack_log(lines))
+            log.clear()
+
+    # 空闲时定期上报遥测
+    def send_telemetry(self):
         try:
-            self.sock.sendall(data)
+            self.sock.sendall(self.telemetry.frame())
         except OSError as e:
-            print(f"传输中断: {e}, 尝试重连...")
-            display.set_color(0xF800)  # 红色
-            display.add_text(f"\n传输中断: {e}, 尝试重连...")
+            log.warn("传输中断: %s, 尝试重连...", e)
             self.sock = self.connect_socket()
-            # 重连后尝试重发
-            try:
-                self.sock.sendall(data)
-            except:
-                print("重连后发送仍失败")
-                display.set_color(0xF800)  # 红色
-                display.add_text("\n重连后发送仍失败")
+
+    # 开机校准噪声基底，校准期间请保持安静
+    def calibrate_vad(self):
+        frame = self.uplink.frame()
+
+        def read_energy():
+            return self.rms(frame, self.audio_in.readinto(frame))
+
+        print("[INIT] 噪声校准中，请保持安静...")
+        floor = self.vad.calibrate(read_energy, self.vad_calibrate_s)
+        print(f"[INIT] VAD 噪声基底: {floor} 开始/结束阈值: {self.vad.onset}/{self.vad.offset}")
+        ui.post(f"\n[INIT] 噪声基底: {floor}")
+
+    # RMS计算，viper 实现直接在读缓冲区上计算，不分配内存，同时统计过零次数
+    def rms(self, data, nbytes=None):
+        energy = frame_rms(data, nbytes, self.energy_step)
+        self.zero_crossings = zero_crossings()
+        return energy
+
+    # 打印 VAD 统计，噪声基底变化明显时保存到 flash
+    def vad_report(self):
+        vad = self.vad
+        print(f"[VAD] 噪声基底: {vad.noise_floor()} 阈值: {vad.onset}/{vad.offset} "
+              f"触发: {vad.triggers}次({vad.triggers_per_hour()}次/小时) "
+              f"上行: {self.uplink.frames_sent * self.uplink.frame_bytes}字节")
+        vad.save()
+
+    # 流式发送音频
+    def stream_audio(self, nbytes):
+        try:
+            self.uplink.commit(self.sock, nbytes)
+        except OSError as e:
+            log.warn("传输中断: %s, 尝试重连...", e)
+            ui.post(f"\n传输中断: {e}, 尝试重连...", 0xF800)
+            self.sock = self.connect_socket()  # 恢复会话时未送达的帧已在握手后重发
+
+    # 发送一句话的结束标记，返回 False 表示这句话已丢失（服务器开始了新会话）
+    def end_audio(self):
+        try:
+            self.uplink.end(self.sock)
+        except OSError as e:
+            log.warn("传输中断: %s, 尝试重连...", e)
+            ui.post(f"\n传输中断: {e}, 尝试重连...", 0xF800)
+            self.sock = self.connect_socket()  # 恢复会话时结束标记随未送达的帧一起重发
+            return self.resumed
+        return True
 
     # 流式处理音频
     def process_audio(self):
-        read_buf = bytearray(self.buf_size)
+        uplink = self.uplink
         self.INMP441_is_send_wav = False
         
-        # 计算静音检测参数
-        max_silence = int(self.silence_duration * self.sample_rate / (self.buf_size // 2))
+        vad = self.vad
+        telemetry = self.telemetry
+        # 分配统计：录音中每帧前后 gc.mem_free() 的差值（语音起止帧和中途发生 GC 的帧不计）
+        traced_frames = 0
+        traced_bytes = 0
         
         while not self.INMP441_is_send_wav:
-            # 读取音频数据
+            # 读取音频数据，直接读入上行缓冲区的音频区
             try:
+                was_recording = self.is_recording
+                if self.trace_alloc:
+                    mem_before = gc.mem_free()
+                read_buf = uplink.frame()
                 bytes_read = self.audio_in.readinto(read_buf)
                 if bytes_read == 0:
                     time.sleep(0.01)  # 防止CPU过载
                     continue
+                telemetry.loop_start()  # 统计读到数据之后的处理耗时，超过一帧时长 I2S 就会丢音
                     
-                current_frame = read_buf[:bytes_read]
-                energy = self.rms(current_frame)
+                energy = self.rms(read_buf, bytes_read)
                 
-                print(f"[DEBUG] 瞬时能量: {energy:.1f}")
-                #display.set_color(0xFFFF)  # 黑色
-                #display.add_text(f"\n[DEBUG] \n瞬时能量: {energy:.1f}")
+                if log.level <= DEBUG:
+                    log.debug("[DEBUG] 瞬时能量: %d 过零: %d", energy, self.zero_crossings)
+                #ui.post(f"\n[DEBUG] \n瞬时能量: {energy:.1f}")
                 
-                if energy > self.energy_threshold:
-                    if not self.is_recording:
+                # 自适应阈值 + 滞回：语音中的静音帧也发送，让服务器处理
+                event = vad.update(energy)
+                if event == VAD_IDLE:
+                    # 留作预录，语音开始时随第一帧一起发送
+                    uplink.hold(bytes_read)
+                    if telemetry.due():
+                        self.send_telemetry()
+                else:
+                    if event == VAD_START:
                         print("检测到语音开始")
-                        display.set_color(0xFFFF)  # 黑色
-                        display.add_text("\n检测到语音开始")
+                        ui.post("\n检测到语音开始")
                         self.is_recording = True
-                        self.silence_counter = 0
-                        
-                    # 直接发送音频帧和长度
-                    header = struct.pack('<I', len(current_frame))
-                    self.stream_audio(header + current_frame)
-                else:
-                    if self.is_recording:
-                        self.silence_counter += 1
-                        
-                        # 静音帧也发送，让服务器处理
-                        header = struct.pack('<I', len(current_frame))
-                        self.stream_audio(header + current_frame)
                         
-                        if self.silence_counter > max_silence:
-                            # 发送结束标记
-                            end_header = struct.pack('<I', 0)
-                            self.sock.sendall(end_header)
-                            self.is_recording = False
-                            self.INMP441_is_send_wav = True
-                            print("语音结束")
-                            display.set_color(0xFFFF)  # 黑色
-                            display.add_text("\n语音发送完毕")
-                            time.sleep(3)
-                            display.add_text("\n开始回答......")
-                            #ed.pbm("star-struck.pbm", 0, 0)
+                    # 帧头原地写入，音频帧和长度一起发送
+                    self.stream_audio(bytes_read)
+                    
+                    if event == VAD_END:
+                        # 发送剩余帧和结束标记
+                        self.INMP441_is_send_wav = self.end_audio()
+                        self.is_recording = False
+                        print("语音结束")
+                        self.vad_report()
+                        ui.post("\n语音发送完毕")
+                        ui.post("\n开始回答......")
+                        #ed.pbm("star-struck.pbm", 0, 0)
+                        if self.trace_alloc:
+                            print(f"[TRACE] 上行 {traced_frames} 帧, 堆分配 {traced_bytes} 字节")
+
+                if self.trace_alloc and was_recording and self.is_recording:
+                    used = mem_before - gc.mem_free()
+                    if used >= 0:
+                        traced_frames += 1
+                        traced_bytes += used
+                telemetry.loop_end()
                             
             except Exception as e:
-                print(f"处理音频错误: {e}")
-                display.set_color(0xF800)  # 红色
-                display.add_text(f"\n处理音频错误: {e}")
-                # 释放资源
-                del read_buf
-                # 创建新缓冲区
-                read_buf = bytearray(self.buf_size)
+                log.error("处理音频错误: %s", e, every_ms=5000)
+                ui.post(f"\n处理音频错误: {e}", 0xF800)
                 time.sleep(0.5)
 
     # 接收并播放音频
     def receive_wavfile(self):
-        try:
-            # 优化接收缓冲区大小
-            recv_buffer_size = 512  # 较小的缓冲区
-            
-            print("等待服务器返回播放数据...")
-            display.set_color(0xFFFF)  # 黑色
-            #display.add_text("\n等待服务器返回播放数据...")
-            while True:
-                content_byte = self.sock.recv(recv_buffer_size)
-                if not content_byte or b"END_OF_STREAM" in content_byte:
-                    break
-                    
-                print("接收到音频数据:", len(content_byte), "bytes")
-                
-                # 使用小缓冲区处理音频
-                try:
-                    # 创建整数数组
-                    audio_samples = array.array('h')
-                    
-                    # 处理单个样本以调整音量
-                    for i in range(0, len(content_byte), 2):
-                        if i + 1 < len(content_byte):
-                            value = content_byte[i] | (content_byte[i+1] << 8)
-                            if value >= 0x8000:
-                                value -= 0x10000
-                            value = int(value * self.volume_factor)
-                            audio_samples.append(value)
-                    
-                    # 播放处理后的音频
-                    if len(audio_samples) > 0:
-                        self.audio_out.write(audio_samples)
-                        
-                except Exception as e:
-                    print(f"处理播放数据时出错: {e}")
-                    display.set_color(0xF800)  # 红色
-                    display.add_text(f"\n处理播放数据时出错: {e}")
-                    
-                # 释放资源
-                del audio_samples
-                
-        except Exception as e:
-            print("连接错误，尝试重新连接:", e)
-            display.set_color(0xF800)  # 红色
-            display.add_text("\n连接错误，尝试重新连接:")
-            self.sock = self.connect_socket()
+        while True:
+            try:
+                print("等待服务器返回播放数据...")
+                #ui.post("\n等待服务器返回播放数据...")
+                # 数据直接读入预分配缓冲区，原地调节音量后以非阻塞方式送入 I2S
+                self.player.set_volume(self.volume_factor)
+                self.player.reset_stats()
+                self.player.play_stream(self.sock, self.tiles.on_control if self.tiles else None)
+                # 上报本轮播放的欠载/溢出次数
+                player = self.player
+                self.sock.sendall(pack_playback_stats(player.underruns, player.overruns, player.chunks))
+                self.telemetry.add_playback(player.underruns, player.overruns)
+                return
+            except Exception as e:
+                log.warn("连接错误，尝试重新连接: %s", e)
+                ui.post("\n连接错误，尝试重新连接:", 0xF800)
+                self.sock = self.connect_socket()
+                # 会话恢复后服务器会重发中断的回复，继续接收
+                if not self.pending_reply:
+                    return
 
     def start(self):
         while True:
@@ -298,18 +404,15 @@ class VoiceRecorder:
                     # 重置状态准备下次录音
                     self.INMP441_is_send_wav = False
                     self.is_recording = False
-                    # 执行垃圾回收
-                    import gc
-                    gc.collect()
-                display.set_color(0xFFFF)  # 黑色
-                display.add_text("\n倾听中......")
+                    # 执行垃圾回收（记录耗时）
+                    self.telemetry.collect()
+                ui.post("\n倾听中......")
                 #ed.pbm("neutral_face.pbm", 0, 0)
                 #time.sleep(3)
                     
             except Exception as e:
-                print(f"主循环错误: {e}")
-                display.set_color(0xF800)  # 红色
-                display.add_text(f"\n主循环错误: {e}")
+                log.error("主循环错误: %s", e, every_ms=5000)
+                ui.post(f"\n主循环错误: {e}", 0xF800)
                 time.sleep(1)
                 # 执行垃圾回收
                 import gc
@@ -323,24 +426,21 @@ if __name__ == "__main__":
     
     # 启动录音系统
     print("\n=== INMP441语音检测系统 ===")
-    display.set_color(0xFFFF)  # 红色
-    display.add_text("=== INMP441语音检测系统 ===")
+    ui.post("=== INMP441语音检测系统 ===")
     try:
         recorder = VoiceRecorder()
-        print("提示：首次使用建议进行阈值校准")
-        display.add_text("\n提示：首次使用建议进行阈值校准")
         print("--------------------------------")
-        display.add_text("\n--------------------------------")
+        ui.post("\n--------------------------------")
         recorder.start()
     except MemoryError:
         print("内存不足，系统重启...")
-        display.set_color(0xF800)  # 红色
-        display.add_text("\n内存不足，系统重启...")
+        ui.post("\n内存不足，系统重启...", 0xF800)
+        ui.wait_idle()
         import machine
         machine.reset()
     except Exception as e:
         print(f"系统错误: {e}")
-        display.set_color(0xF800)  # 红色
-        display.add_text(f"\n系统错误: {e}")
+        ui.post(f"\n系统错误: {e}", 0xF800)
+        ui.wait_idle()
         import machine
         machine.reset()